@@ -1,11 +1,15 @@
 from flask import Flask
 
+from app import lifecycle
 from app.config import ServiceConfig, get_config
 from app.service import init_app
 
 
-def create_app():
-    cfg = get_config()
+def create_app(cfg: ServiceConfig = None):
+    """Create the Flask app; keys and settings are loaded here, before any fork"""
+    if cfg is None:
+        cfg = get_config()
+    lifecycle.prepare(config=cfg)
     app = Flask(__name__)
     init_app(app, cfg)
     return app
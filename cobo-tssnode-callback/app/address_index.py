@@ -0,0 +1,227 @@
+"""Memory-mapped address index for destination allowlists and denylists
+
+The index file is built offline::
+
+    python -m app.address_index build addresses.txt data/allowlist.idx
+
+Layout (little endian): a 32 byte header, an optional Bloom filter, a fan-out
+table of cumulative counts by digest prefix and the sorted 16 byte BLAKE2b
+digests of the normalized addresses. The file is mapped read only, so every
+worker shares the same page cache instead of holding its own copy. Publish a
+new file with ``os.replace`` and ``AddressList`` picks it up on the next
+lookup after ``check_interval`` seconds.
+"""
+import argparse
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterable, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CADX"
+VERSION = 1
+DIGEST_SIZE = 16
+# magic, version, digest 长度, 地址数量, Bloom 位数, Bloom 哈希个数, fan-out 前缀位数
+HEADER = struct.Struct("<4sHHQQIB3x")
+FANOUT_ENTRY = struct.Struct("<I")
+
+
+class AddressIndexError(ValueError):
+    pass
+
+
+def normalize_address(address: str) -> str:
+    # EVM 地址不区分大小写，Solana 等 base58 地址区分大小写
+    address = address.strip()
+    if len(address) == 42 and address[:2] in ("0x", "0X"):
+        return address.lower()
+    return address
+
+
+def address_digest(address: str) -> bytes:
+    return hashlib.blake2b(normalize_address(address).encode(), digest_size=DIGEST_SIZE).digest()
+
+
+def _bloom_positions(digest: bytes, bits: int, hashes: int):
+    # 双重哈希：用摘要的两半生成 k 个位置
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+def _fanout_bits(count: int) -> int:
+    # 每个前缀桶平均不超过几十个摘要，二分查找只需几步
+    return 16 if count > 1 << 16 else 8
+
+
+class AddressIndex:
+    """A read-only, memory-mapped set of addresses"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat.st_size < HEADER.size:
+                raise AddressIndexError(f"{path} is too small for an address index")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, digest_size, count,
+         bloom_bits, bloom_hashes, fanout_bits) = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION or digest_size != DIGEST_SIZE:
+            raise AddressIndexError(f"{path} is not a version {VERSION} address index")
+        self.count = count
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        self.fanout_bytes = fanout_bits // 8
+        self._fanout_offset = HEADER.size + (bloom_bits + 7) // 8
+        self._digests_offset = self._fanout_offset + FANOUT_ENTRY.size * (1 << fanout_bits)
+        if len(self._mm) != self._digests_offset + count * DIGEST_SIZE:
+            raise AddressIndexError(f"{path} is truncated")
+
+    def __len__(self):
+        return self.count
+
+    def contains_digest(self, digest: bytes) -> bool:
+        mm = self._mm
+        if self.bloom_bits:
+            for pos in _bloom_positions(digest, self.bloom_bits, self.bloom_hashes):
+                if not mm[HEADER.size + (pos >> 3)] & (1 << (pos & 7)):
+                    return False
+        # fan-out 表第 p 项为前缀不大于 p 的摘要数量，先定位前缀桶再二分查找
+        prefix = int.from_bytes(digest[:self.fanout_bytes], "big")
+        entry = self._fanout_offset + prefix * FANOUT_ENTRY.size
+        hi = FANOUT_ENTRY.unpack_from(mm, entry)[0]
+        lo = FANOUT_ENTRY.unpack_from(mm, entry - FANOUT_ENTRY.size)[0] if prefix else 0
+        base = self._digests_offset
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            start = base + mid * DIGEST_SIZE
+            candidate = mm[start:start + DIGEST_SIZE]
+            if candidate == digest:
+                return True
+            if candidate < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def __contains__(self, address: str) -> bool:
+        return self.contains_digest(address_digest(address))
+
+
+class AddressList:
+    """An ``AddressIndex`` that is swapped when a new file is published at ``path``"""
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.index = AddressIndex(path)
+        self._next_check = time.monotonic() + check_interval
+        self._lock = threading.Lock()
+
+    def maybe_reload(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = now + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                logger.warning(f"Address index {self.path} is unavailable: {e}")
+                return False
+            if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == self.index.identity:
+                return False
+            try:
+                index = AddressIndex(self.path)
+            except (OSError, AddressIndexError) as e:
+                logger.error(f"Failed to reload address index {self.path}: {e}")
+                return False
+            # 旧索引仍可能被其他线程使用，不主动关闭，引用释放后自动解除映射
+            self.index = index
+            logger.info(f"Reloaded address index {self.path} with {len(index)} addresses")
+            return True
+        finally:
+            self._lock.release()
+
+    def __contains__(self, address: str) -> bool:
+        self.maybe_reload()
+        return address in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+
+def build_index(addresses: Iterable[str], output_path: str, bloom_bits_per_key: int = 10):
+    """Write an index file; the file is written beside ``output_path`` and renamed into place"""
+    digests = sorted({address_digest(a) for a in addresses if a.strip()})
+    count = len(digests)
+    bloom_bits = count * bloom_bits_per_key if bloom_bits_per_key and count else 0
+    bloom_hashes = max(1, round(bloom_bits_per_key * math.log(2))) if bloom_bits else 0
+    bloom = bytearray((bloom_bits + 7) // 8)
+    if bloom_bits:
+        for digest in digests:
+            for pos in _bloom_positions(digest, bloom_bits, bloom_hashes):
+                bloom[pos >> 3] |= 1 << (pos & 7)
+
+    fanout_bits = _fanout_bits(count)
+    fanout = [0] * (1 << fanout_bits)
+    for digest in digests:
+        fanout[int.from_bytes(digest[:fanout_bits // 8], "big")] += 1
+    total = 0
+    for i, n in enumerate(fanout):
+        total += n
+        fanout[i] = total
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, DIGEST_SIZE, count,
+                            bloom_bits, bloom_hashes, fanout_bits))
+        f.write(bloom)
+        f.write(struct.pack(f"<{len(fanout)}I", *fanout))
+        f.write(b"".join(digests))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def open_address_list(path: Optional[str]) -> Optional[AddressList]:
+    if not path:
+        return None
+    return AddressList(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Address index tool")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build an index from a file with one address per line")
+    build.add_argument("input")
+    build.add_argument("output")
+    build.add_argument("--bloom-bits-per-key", type=int, default=10,
+                       help="0 disables the Bloom filter")
+    lookup = sub.add_parser("lookup", help="check addresses against an index")
+    lookup.add_argument("index")
+    lookup.add_argument("addresses", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        with open(args.input, "r") as f:
+            count = build_index(f, args.output, args.bloom_bits_per_key)
+        print(f"Wrote {count} addresses to {args.output}")
+    else:
+        index = AddressIndex(args.index)
+        for address in args.addresses:
+            print(f"{address}\t{'found' if address in index else 'missing'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Optional
+
+# 等待时长分布的桶上限（毫秒），最后一个桶收集超出的部分
+WAIT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class WaitStats:
+    """Counters and a coarse histogram of how long lookups waited for arrival"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.hits = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record(self, elapsed: float, hit: bool):
+        index = bisect_left(WAIT_BUCKETS_MS, elapsed * 1000)
+        with self._lock:
+            self.waits += 1
+            if hit:
+                self.hits += 1
+            else:
+                self.timeouts += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            self.buckets[index] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"le_{b}ms" for b in WAIT_BUCKETS_MS] + ["inf"]
+            return {
+                "waits": self.waits,
+                "hits": self.hits,
+                "timeouts": self.timeouts,
+                "total_seconds": self.total_seconds,
+                "max_seconds": self.max_seconds,
+                "avg_seconds": self.total_seconds / self.waits if self.waits else 0.0,
+                "buckets": dict(zip(labels, self.buckets)),
+            }
+
+
+class ArrivalWaiter:
+    """Lets a lookup wait a bounded time for a key that has not arrived yet
+
+    Local waiters block on a per-key event that ``notify`` sets when the
+    consumer stores the key. When the cache is filled by another process the
+    events can never fire, so ``wait`` polls with a short backoff instead.
+    """
+
+    POLL_MIN_INTERVAL = 0.001
+    POLL_MAX_INTERVAL = 0.01
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [event, 等待者数量]
+        self._waiters: Dict[str, list] = {}
+        self.stats = WaitStats()
+
+    def notify(self, key: str):
+        waiter = self._waiters.get(key)
+        if waiter is not None:
+            waiter[0].set()
+
+    def wait(
+        self, key: str, fetch: Callable[[str], Optional[dict]], timeout: float, poll: bool = False
+    ) -> Optional[dict]:
+        """Call ``fetch`` until it returns a value or ``timeout`` seconds pass"""
+        start = time.monotonic()
+        if poll:
+            value = self._poll(key, fetch, start + timeout)
+        else:
+            value = self._wait_event(key, fetch, start + timeout)
+        self.stats.record(time.monotonic() - start, value is not None)
+        return value
+
+    def _wait_event(self, key, fetch, deadline):
+        with self._lock:
+            waiter = self._waiters.get(key)
+            if waiter is None:
+                waiter = self._waiters[key] = [threading.Event(), 0]
+            waiter[1] += 1
+        event = waiter[0]
+        try:
+            while True:
+                # 先清除再查询，查询之后到达的消息一定会唤醒 wait
+                event.clear()
+                value = fetch(key)
+                if value is not None:
+                    return value
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                event.wait(remaining)
+        finally:
+            with self._lock:
+                waiter[1] -= 1
+                if waiter[1] == 0:
+                    del self._waiters[key]
+
+    def _poll(self, key, fetch, deadline):
+        interval = self.POLL_MIN_INTERVAL
+        while True:
+            value = fetch(key)
+            if value is not None:
+                return value
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.POLL_MAX_INTERVAL)
@@ -0,0 +1,530 @@
+"""
+Append-only audit log of /v2/check decisions.
+
+Request threads only append a small dict to an in-memory buffer. A background
+thread serializes the buffered records as JSON lines every ``flush_interval``
+seconds, or sooner when ``batch_size`` records are waiting. Each batch is
+written as one gzip member with a single write, and files are fsynced at most
+every ``fsync_interval`` seconds.
+
+Files are named ``audit-<YYYYMMDD>-<pid>-<seq>.jsonl.gz``. A new file starts
+when the UTC day changes, when the current file would pass ``max_file_mb``,
+and whenever the process starts. A file is a valid multi-member gzip file, so
+``zcat`` reads it. Files older than ``retention_days`` are deleted.
+
+Loss is bounded:
+
+- When the buffer holds ``buffer_size`` records, new records are dropped and
+  counted rather than blocking the request.
+- A crash loses at most the records buffered since the last flush.
+- A power loss can also lose what was written since the last fsync.
+- A batch cut off by a crash only truncates the last member of its file.
+  ``read_file`` stops at that point.
+
+Scan the log with ``python -m app.audit``. See ``--help``.
+"""
+import argparse
+import contextvars
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import dotenv
+
+from app import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FILE_PREFIX = "audit-"
+FILE_SUFFIX = ".jsonl.gz"
+_FILE_PATTERN = re.compile(r"audit-(\d{8})-(\d+)-(\d+)\.jsonl\.gz$")
+READ_CHUNK = 1 << 20
+
+
+@dataclass
+class AuditSettings:
+    # 审计日志目录，留空表示不启用
+    directory: str = ""
+    # 内存中最多缓存的记录数，超过时丢弃新记录而不阻塞请求
+    buffer_size: int = 10000
+    # 缓存达到 batch_size 条或距上次写入 flush_interval 秒时写入一批
+    batch_size: int = 500
+    flush_interval: float = 1.0
+    # 两次 fsync 的最小间隔（秒），0 表示每批都 fsync
+    fsync_interval: float = 5.0
+    max_file_mb: int = 64
+    # 保留天数，0 表示不删除
+    retention_days: int = 0
+
+    @classmethod
+    def from_env(cls, env_file: str = ".env") -> "AuditSettings":
+        def get(key):
+            return dotenv.get_key(env_file, key)
+
+        return cls(
+            directory=get("AUDIT_DIR") or cls.directory,
+            buffer_size=int(get("AUDIT_BUFFER_SIZE") or cls.buffer_size),
+            batch_size=int(get("AUDIT_BATCH_SIZE") or cls.batch_size),
+            flush_interval=int(get("AUDIT_FLUSH_INTERVAL_MS") or 1000) / 1000,
+            fsync_interval=int(get("AUDIT_FSYNC_INTERVAL_MS") or 5000) / 1000,
+            max_file_mb=int(get("AUDIT_MAX_FILE_MB") or cls.max_file_mb),
+            retention_days=int(get("AUDIT_RETENTION_DAYS") or 0),
+        )
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d")
+
+
+def _format_ts(ts: float) -> str:
+    # 与 jsonlog 的时间格式一致，字符串顺序即时间顺序
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts)) + f".{int(ts % 1 * 1000):03d}Z"
+
+
+def _finish(entry: dict) -> dict:
+    # 时间格式化和耗时换算放在写入线程中，请求线程只保存原始值
+    entry["ts"] = _format_ts(entry["ts"])
+    if "elapsed" in entry:
+        entry["elapsed_ms"] = round(entry.pop("elapsed") * 1000, 3)
+    if "stages" in entry:
+        entry["stages_ms"] = {name: round(seconds * 1000, 3) for name, seconds in entry.pop("stages").items()}
+    return entry
+
+
+class AuditLog:
+    """Buffered audit sink that writes compressed batches from a background thread"""
+
+    def __init__(
+        self,
+        directory: str,
+        buffer_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        fsync_interval: float = 5.0,
+        max_file_bytes: int = 64 << 20,
+        retention_days: int = 0,
+        compress_level: int = 6,
+    ):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_file_bytes = max_file_bytes
+        self.retention_days = retention_days
+        self.compress_level = compress_level
+
+        self._buffer: List[dict] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._fd: Optional[int] = None
+        self._path: Optional[str] = None
+        self._file_day: Optional[str] = None
+        self._file_size = 0
+        self._dirty = False
+        self._last_fsync = 0.0
+        self.records = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.bytes_written = 0
+
+    # ---- 请求线程 ----
+
+    def record(self, entry: dict) -> bool:
+        """Buffer one record; returns False when the buffer is full and the record is dropped"""
+        with self._lock:
+            if self._stopping or len(self._buffer) >= self.buffer_size:
+                self.dropped += 1
+                return False
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+        return True
+
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Write everything still buffered, fsync and close the file"""
+        with self._lock:
+            self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ---- 写入线程 ----
+
+    def _run(self):
+        next_cleanup = 0.0
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                stopping = self._stopping
+            if batch:
+                self._write(batch)
+            now = time.monotonic()
+            if self._dirty and (stopping or now - self._last_fsync >= self.fsync_interval):
+                self._fsync()
+            if self.retention_days and now >= next_cleanup:
+                self._remove_expired()
+                next_cleanup = now + 3600
+            if stopping:
+                break
+        self._close()
+
+    def _write(self, batch: List[dict]):
+        try:
+            lines = []
+            for entry in batch:
+                lines.append(json.dumps(_finish(entry), separators=(",", ":"), default=str))
+            lines.append("")
+            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, 31)
+            data = compressor.compress("\n".join(lines).encode()) + compressor.flush()
+
+            self._open_for(time.time(), len(data))
+            view = memoryview(data)
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} audit records to {self._path}: {e!r}")
+            # 写入中断的文件不再追加，下一批写入新文件
+            self._close()
+            return
+        self._file_size += len(data)
+        self._dirty = True
+        self.records += len(batch)
+        self.batches += 1
+        self.bytes_written += len(data)
+
+    def _open_for(self, now: float, size: int):
+        day = _day(now)
+        if self._fd is not None and (
+            day != self._file_day
+            or (self._file_size and self._file_size + size > self.max_file_bytes)
+        ):
+            self._close()
+        if self._fd is not None:
+            return
+        pid = os.getpid()
+        # 每次都从新的文件开始，不在崩溃时可能截断的文件后追加
+        taken = [int(m.group(3)) for m in map(_FILE_PATTERN.search, glob.glob(
+            os.path.join(self.directory, f"{FILE_PREFIX}{day}-{pid}-*{FILE_SUFFIX}"))) if m]
+        self._path = os.path.join(
+            self.directory, f"{FILE_PREFIX}{day}-{pid}-{max(taken, default=-1) + 1}{FILE_SUFFIX}")
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o640)
+        self._file_day = day
+        self._file_size = 0
+
+    def _fsync(self):
+        if self._fd is not None:
+            try:
+                os.fsync(self._fd)
+            except OSError as e:
+                logger.error(f"Failed to fsync {self._path}: {e!r}")
+        self._dirty = False
+        self._last_fsync = time.monotonic()
+
+    def _close(self):
+        if self._fd is None:
+            return
+        if self._dirty:
+            self._fsync()
+        os.close(self._fd)
+        self._fd = None
+
+    def _remove_expired(self):
+        oldest = _day(time.time() - self.retention_days * 86400)
+        for path in list_files(self.directory):
+            match = _FILE_PATTERN.search(path)
+            if match.group(1) < oldest and path != self._path:
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    logger.warning(f"Failed to remove expired audit file {path}: {e!r}")
+
+
+# ---- 请求处理接入 ----
+
+settings = AuditSettings()
+sink: Optional[AuditLog] = None
+_ANNOTATIONS: contextvars.ContextVar = contextvars.ContextVar("audit_annotations", default=None)
+
+
+def configure(new_settings: AuditSettings):
+    global settings
+    settings = new_settings
+
+
+def start_sink() -> Optional[AuditLog]:
+    """Start the writer in this process; does nothing when AUDIT_DIR is not set"""
+    global sink
+    if sink is None and settings.directory:
+        sink = AuditLog(
+            settings.directory,
+            buffer_size=settings.buffer_size,
+            batch_size=settings.batch_size,
+            flush_interval=settings.flush_interval,
+            fsync_interval=settings.fsync_interval,
+            max_file_bytes=settings.max_file_mb << 20,
+            retention_days=settings.retention_days,
+        )
+        sink.start()
+    return sink
+
+
+def stop_sink():
+    global sink
+    if sink is not None:
+        sink.stop()
+        sink = None
+
+
+@contextmanager
+def annotations():
+    """Collect fields set with ``annotate()`` while a request is verified"""
+    fields = {}
+    token = _ANNOTATIONS.set(fields)
+    try:
+        yield fields
+    finally:
+        _ANNOTATIONS.reset(token)
+
+
+def annotate(**fields):
+    current = _ANNOTATIONS.get()
+    if current is not None:
+        current.update(fields)
+
+
+def record(request_id: Optional[str], request_type: str, decision: str, status: int,
+           reason: Optional[str], elapsed: float, stages: Dict[str, float], **fields):
+    if sink is None:
+        return
+    sink.record({
+        "ts": time.time(),
+        "request_id": request_id,
+        "request_type": request_type,
+        "decision": decision,
+        "status": status,
+        "reason": reason,
+        "elapsed": elapsed,
+        "stages": stages,
+        **fields,
+    })
+
+
+def _sink_stat(name):
+    def samples():
+        return [] if sink is None else [({}, getattr(sink, name))]
+    return samples
+
+
+for _name, _doc in (
+    ("records", "Audit records written to disk"),
+    ("dropped", "Audit records dropped because the buffer was full"),
+    ("failed", "Audit records lost to write errors"),
+):
+    metrics.REGISTRY.register(metrics.GaugeFunc(
+        f"tss_callback_audit_{_name}_total", _doc, _sink_stat(_name), kind="counter"))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "tss_callback_audit_buffered", "Audit records waiting to be written",
+    lambda: [] if sink is None else [({}, sink.buffered())]))
+
+
+# ---- 读取 ----
+
+def list_files(directory: str, since: str = "", until: str = "") -> List[str]:
+    """Audit files whose day is within [since, until]; days are YYYY-MM-DD or YYYYMMDD"""
+    since, until = since[:10].replace("-", ""), until[:10].replace("-", "")
+    paths = []
+    for path in glob.glob(os.path.join(directory, f"{FILE_PREFIX}*{FILE_SUFFIX}")):
+        match = _FILE_PATTERN.search(path)
+        if not match:
+            continue
+        day = match.group(1)
+        if (since and day < since) or (until and day > until):
+            continue
+        paths.append((day, int(match.group(2)), int(match.group(3)), path))
+    return [p[-1] for p in sorted(paths)]
+
+
+def read_lines(path: str) -> Iterator[bytes]:
+    """Yield the raw JSON lines of one file; a member cut off by a crash ends the file"""
+    decompressor = zlib.decompressobj(31)
+    in_member = False
+    pending = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            while chunk:
+                in_member = True
+                try:
+                    data = decompressor.decompress(chunk)
+                except zlib.error as e:
+                    logger.warning(f"Stopped reading corrupt audit file {path}: {e}")
+                    return
+                if data:
+                    pending += data
+                    *lines, pending = pending.split(b"\n")
+                    yield from lines
+                if decompressor.eof:
+                    # 下一个 gzip 成员
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+                    in_member = False
+                else:
+                    chunk = b""
+    if in_member or pending:
+        logger.warning(f"Audit file {path} ends with an incomplete batch")
+
+
+def read_file(path: str) -> Iterator[dict]:
+    for line in read_lines(path):
+        if line:
+            yield json.loads(line)
+
+
+@dataclass(frozen=True)
+class Query:
+    """Filters for ``scan``; ``since`` / ``until`` compare as prefixes of the ISO timestamp"""
+    since: str = ""
+    until: str = ""
+    decision: str = ""
+    request_type: str = ""
+    request_id: str = ""
+    transaction_id: str = ""
+    reason: str = ""
+
+    def needles(self) -> List[bytes]:
+        # 解析 JSON 前先按字节过滤，未命中的行不解析
+        needles = [json.dumps(v).encode() for v in (
+            self.decision, self.request_type, self.request_id, self.transaction_id) if v]
+        if self.reason:
+            # 记录按 ensure_ascii 写入，子串需要按同样的转义规则编码
+            needles.append(json.dumps(self.reason)[1:-1].encode())
+        return needles
+
+    def matches(self, entry: dict) -> bool:
+        ts = entry.get("ts", "")
+        return (
+            (not self.since or ts[:len(self.since)] >= self.since)
+            and (not self.until or ts[:len(self.until)] <= self.until)
+            and (not self.decision or entry.get("decision") == self.decision)
+            and (not self.request_type or entry.get("request_type") == self.request_type)
+            and (not self.request_id or entry.get("request_id") == self.request_id)
+            and (not self.transaction_id or entry.get("transaction_id") == self.transaction_id)
+            and (not self.reason or self.reason in (entry.get("reason") or ""))
+        )
+
+
+def scan_file(path: str, query: Query) -> Iterator[dict]:
+    needles = query.needles()
+    for line in read_lines(path):
+        if line and all(n in line for n in needles):
+            entry = json.loads(line)
+            if query.matches(entry):
+                yield entry
+
+
+def _scan_file_list(args) -> list:
+    return list(scan_file(*args))
+
+
+def _count_file(args) -> Counter:
+    return Counter((e.get("request_type"), e.get("decision")) for e in scan_file(*args))
+
+
+def scan(directory: str, query: Query = Query(), workers: int = 1) -> Iterable[dict]:
+    """Matching records in time order per file; ``workers`` > 1 scans files in parallel"""
+    paths = list_files(directory, query.since, query.until)
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield from scan_file(path, query)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        for entries in pool.map(_scan_file_list, [(p, query) for p in paths]):
+            yield from entries
+
+
+def count(directory: str, query: Query = Query(), workers: int = 1) -> Counter:
+    """Number of matching records by (request_type, decision)"""
+    paths = list_files(directory, query.since, query.until)
+    totals = Counter()
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            totals.update(_count_file((path, query)))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            for counts in pool.map(_count_file, [(p, query) for p in paths]):
+                totals.update(counts)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan the /v2/check audit log")
+    parser.add_argument("directory", nargs="?", default=settings.directory or "data/audit")
+    parser.add_argument("--since", default="", help="YYYY-MM-DD or an ISO timestamp prefix")
+    parser.add_argument("--until", default="", help="inclusive, YYYY-MM-DD or an ISO timestamp prefix")
+    parser.add_argument("--last-days", type=int, default=0, help="shortcut for --since N days ago")
+    parser.add_argument("--decision", default="", help="APPROVE or REJECT")
+    parser.add_argument("--request-type", default="")
+    parser.add_argument("--request-id", default="")
+    parser.add_argument("--transaction-id", default="")
+    parser.add_argument("--reason", default="", help="substring of the reject reason")
+    parser.add_argument("--count", action="store_true", help="print counts by request type and decision")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    since = args.since
+    if args.last_days:
+        since = (datetime.now(timezone.utc) - timedelta(days=args.last_days)).strftime("%Y-%m-%d")
+    query = Query(since=since, until=args.until, decision=args.decision,
+                  request_type=args.request_type, request_id=args.request_id,
+                  transaction_id=args.transaction_id, reason=args.reason)
+
+    if args.count:
+        for (request_type, decision), n in sorted(count(args.directory, query, args.workers).items(),
+                                                  key=lambda item: str(item[0])):
+            print(f"{request_type}\t{decision}\t{n}")
+        return
+    out = sys.stdout
+    for entry in scan(args.directory, query, args.workers):
+        out.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+
+if __name__ == "__main__":
+    main()
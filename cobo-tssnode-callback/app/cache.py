@@ -1,90 +1,463 @@
 import pika
 import json
 import logging
-import time
+import fcntl
+import random
 import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+import dotenv
 
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(host="localhost"),
-)
-channel = connection.channel()
-channel.queue_declare(queue="cobo")
+from app import metrics, partition, txrecord
+from app.arrival import ArrivalWaiter
+from app.cache_backend import CacheBackend, create_backend
 
-global_message_cache = {}
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # 消息过期时间（秒）
 MESSAGE_TTL = 30
+# 缓存条目上限，超出后淘汰最早过期的消息
+MESSAGE_CACHE_MAX_SIZE = 100000
 
 
-def callback(ch, method, properties, body):
-    json_str = body.decode()
-    logger.debug(f"Received message: {json_str}")
-    msg = json.loads(json_str)
+@dataclass
+class CacheSettings:
+    # 缓存后端：memory 为进程内缓存；sqlite 为多进程共享缓存，只由一个进程消费队列
+    backend: str = "memory"
+    sqlite_path: str = "data/tx_cache.db"
+    # memory 后端的重启日志，留空表示不启用；重启后恢复 MESSAGE_TTL 内的消息
+    log_path: str = ""
+    log_capacity_mb: int = 64
+    # 缓存未命中时等待消息到达的最长时间（秒），0 表示不等待
+    wait_timeout: float = 0.0
+    rabbitmq_host: str = "localhost"
+    queue: str = "cobo"
+    # 持久化队列，需要与 API callback 服务的 RABBITMQ_DURABLE 一致
+    durable: bool = False
+    # 未确认消息上限，以及批量确认的条数和最长间隔（秒）
+    prefetch_count: int = 500
+    ack_batch_size: int = 100
+    ack_interval: float = 0.05
+    # 分区数需要与 API callback 服务的 PARTITION_COUNT 一致，0 表示不分区、消费 queue 队列；
+    # partitions 为本实例消费的分区，如 "0-3,7"，留空表示全部分区
+    partition_count: int = 0
+    partitions: str = ""
+    # API callback 服务直接推送交易的 Unix socket，留空表示只经由 RabbitMQ
+    direct_socket_path: str = ""
+    # 断线重连的初始和最大退避时间（秒）
+    reconnect_delay: float = 0.5
+    max_reconnect_delay: float = 30.0
+
+    @classmethod
+    def from_env(cls, env_file: str = ".env") -> "CacheSettings":
+        def get(key):
+            return dotenv.get_key(env_file, key)
+
+        return cls(
+            backend=get("CACHE_BACKEND") or cls.backend,
+            sqlite_path=get("CACHE_SQLITE_PATH") or cls.sqlite_path,
+            log_path=get("CACHE_LOG_PATH") or cls.log_path,
+            log_capacity_mb=int(get("CACHE_LOG_CAPACITY_MB") or cls.log_capacity_mb),
+            wait_timeout=int(get("CACHE_WAIT_TIMEOUT_MS") or 0) / 1000,
+            rabbitmq_host=get("RABBITMQ_HOST") or cls.rabbitmq_host,
+            durable=(get("RABBITMQ_DURABLE") or "").lower() in ("1", "true", "yes"),
+            prefetch_count=int(get("CONSUMER_PREFETCH") or cls.prefetch_count),
+            ack_batch_size=int(get("CONSUMER_ACK_BATCH") or cls.ack_batch_size),
+            direct_socket_path=get("DIRECT_SOCKET_PATH") or cls.direct_socket_path,
+            partition_count=int(get("PARTITION_COUNT") or 0),
+            partitions=get("CONSUMER_PARTITIONS") or cls.partitions,
+        )
+
+    def owned_partitions(self) -> List[int]:
+        if not self.partition_count:
+            return []
+        return partition.parse_partitions(self.partitions, self.partition_count)
+
+    def queues(self) -> List[str]:
+        """本实例消费的队列"""
+        if not self.partition_count:
+            return [self.queue]
+        return [partition.queue_name(p) for p in self.owned_partitions()]
+
+
+settings = CacheSettings()
+global_message_cache: Optional[CacheBackend] = None
+arrival_waiter = ArrivalWaiter()
+consumer: Optional["CacheConsumer"] = None
+_init_lock = threading.Lock()
+# 本进程消费到的消息数和最后一条消息的到达时间
+messages_received = 0
+last_message_at: Optional[float] = None
+
+
+def configure(cache_settings: CacheSettings):
+    """设置缓存参数，不打开任何连接，可以在 fork 之前调用"""
+    global settings
+    settings = cache_settings
 
-    # 清理过期消息
-    cleanup_expired_messages()
 
-    # 存储消息并记录当前时间
-    global_message_cache[msg["transaction_id"]] = {
-        "data": msg,
-        "timestamp": time.time()
-    }
+def _on_message_expired(transaction_id):
+    logger.warning(f"Removed expired message with transaction_id: {transaction_id}")
 
 
-def cleanup_expired_messages():
-    """清理过期消息"""
-    current_time = time.time()
-    expired_keys = []
+def open_cache() -> CacheBackend:
+    """打开缓存后端，需要在 fork 之后调用"""
+    global global_message_cache
+    with _init_lock:
+        if global_message_cache is None:
+            global_message_cache = create_backend(
+                settings.backend,
+                MESSAGE_TTL,
+                MESSAGE_CACHE_MAX_SIZE,
+                sqlite_path=settings.sqlite_path,
+                on_expire=_on_message_expired,
+                log_path=settings.log_path,
+                log_capacity=settings.log_capacity_mb * 1024 * 1024,
+            )
+    return global_message_cache
 
-    # 找出过期的消息
-    for key, value in global_message_cache.items():
-        if current_time - value["timestamp"] > MESSAGE_TTL:
-            expired_keys.append(key)
 
-    # 删除过期消息
-    for key in expired_keys:
-        del global_message_cache[key]
-        logger.warning(f"Removed expired message with transaction_id: {key}")
+def close_cache():
+    global global_message_cache
+    with _init_lock:
+        if global_message_cache is not None:
+            global_message_cache.close()
+            global_message_cache = None
 
-    if expired_keys:
-        logger.debug(f"Cleaned up {len(expired_keys)} expired messages")
 
+def _cache() -> CacheBackend:
+    return global_message_cache or open_cache()
 
-def get_transaction(transaction_id):
-    """获取缓存的消息"""
-    entry = global_message_cache.get(transaction_id)
-    if entry:
-        # 检查消息是否过期
-        if time.time() - entry["timestamp"] <= MESSAGE_TTL:
-            data = entry["data"]
-            del global_message_cache[transaction_id]
-            return data
-    return None
+
+def parse_message(body: bytes) -> dict:
+    """解析 API callback 服务发布的消息，格式错误时抛出 ValueError"""
+    if txrecord.is_record(body):
+        msg = txrecord.decode(body)
+    else:
+        msg = json.loads(body.decode())
+    logger.debug("Received message: %s", msg)
+    if not isinstance(msg, dict) or not msg.get("transaction_id"):
+        raise ValueError("message has no transaction_id")
+    return msg
+
+
+def store_message(msg: dict):
+    global messages_received, last_message_at
+    messages_received += 1
+    last_message_at = time.time()
+    # 存储消息，同时按过期顺序清理过期消息
+    _cache().put(msg["transaction_id"], msg)
+    arrival_waiter.notify(msg["transaction_id"])
+
+
+def callback(ch, method, properties, body):
+    store_message(parse_message(body))
+
+
+def get_transaction(transaction_id, timeout=None):
+    """获取缓存的消息，未命中时最多等待 timeout 秒（默认取配置）让消息到达"""
+    cache = _cache()
+    data = cache.pop(transaction_id)
+    if timeout is None:
+        timeout = settings.wait_timeout
+    if data is not None or not timeout:
+        return data
+    # 命中率只统计第一次查询，等待期间的重试结果记在等待统计中。
+    # 共享缓存由其他进程写入，无法收到本进程的到达通知，只能轮询
+    return arrival_waiter.wait(
+        transaction_id, lambda key: cache.pop(key, count=False), timeout, poll=cache.shared
+    )
 
 
 def get_cache_size():
     """获取当前缓存大小"""
-    return len(global_message_cache)
+    return _cache().size()
+
+
+def get_cache_stats():
+    """获取缓存命中、未命中、过期和淘汰计数"""
+    return _cache().stats()
+
+
+def get_wait_stats():
+    """获取等待消息到达的次数、命中/超时次数和等待时长分布"""
+    return arrival_waiter.stats.snapshot()
+
+
+def _cache_stat(name):
+    def samples():
+        # 缓存尚未打开时不输出，避免抓取指标时打开缓存
+        if global_message_cache is None:
+            return []
+        return [({}, global_message_cache.stats()[name])]
+    return samples
+
+
+def _hit_ratio():
+    if global_message_cache is None:
+        return []
+    stats = global_message_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    return [({}, stats["hits"] / lookups if lookups else 0.0)]
+
+
+def _last_message_age():
+    if last_message_at is None:
+        return []
+    return [({}, max(time.time() - last_message_at, 0.0))]
+
+
+def _wait_stat(name):
+    return lambda: [({}, arrival_waiter.stats.snapshot()[name])]
+
+
+for _name, _kind, _doc in (
+    ("size", "gauge", "Transactions currently cached"),
+    ("hits", "counter", "Cache lookups that found the transaction"),
+    ("misses", "counter", "Cache lookups that did not find the transaction"),
+    ("expirations", "counter", "Transactions removed after MESSAGE_TTL"),
+    ("evictions", "counter", "Transactions evicted because the cache was full"),
+):
+    metrics.REGISTRY.register(metrics.GaugeFunc(
+        f"tss_callback_cache_{_name}" + ("_total" if _kind == "counter" else ""),
+        _doc, _cache_stat(_name), kind=_kind))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "tss_callback_cache_hit_ratio", "Share of cache lookups that were hits", _hit_ratio))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "tss_callback_consumer_messages_total", "Messages consumed by this process",
+    lambda: [({}, messages_received)], kind="counter"))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "tss_callback_consumer_last_message_age_seconds",
+    "Seconds since this process consumed its last message", _last_message_age))
+
+
+def _consumer_stat(name):
+    def samples():
+        value = getattr(consumer, name, None)
+        return [] if value is None else [({}, value)]
+    return samples
+
+
+for _name, _kind, _doc in (
+    ("connected", "gauge", "Whether this process has a live consumer connection"),
+    ("reconnects", "counter", "Consumer reconnections after a lost connection"),
+    ("rejected", "counter", "Malformed messages rejected without requeue"),
+    ("requeued", "counter", "Messages requeued because caching them failed"),
+    ("lag_seconds", "gauge", "Delay between publishing and caching the latest message"),
+    ("queue_depth", "gauge", "Messages waiting in the queue at the last check"),
+):
+    metrics.REGISTRY.register(metrics.GaugeFunc(
+        f"tss_callback_consumer_{_name}" + ("_total" if _kind == "counter" else ""),
+        _doc, _consumer_stat(_name), kind=_kind))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "tss_callback_cache_waits_total", "Cache misses that waited for the transaction to arrive",
+    _wait_stat("waits"), kind="counter"))
+metrics.REGISTRY.register(metrics.GaugeFunc(
+    "tss_callback_cache_wait_timeouts_total", "Waits that ended without the transaction",
+    _wait_stat("timeouts"), kind="counter"))
 
 
 # 导出函数
 __all__ = ['get_transaction']
 
-channel.basic_consume(
-    queue="cobo", on_message_callback=callback, auto_ack=True)
 
+class CacheConsumer:
+    """在后台线程中消费 RabbitMQ 队列并写入缓存
+
+    消息写入缓存后才确认，按 ack_batch_size 条或 ack_interval 秒批量确认。
+    连接断开时按指数退避重连，未确认的消息由 RabbitMQ 重新投递，重复写入同一
+    transaction_id 只会覆盖缓存。无法解析的消息记录日志后拒绝且不重新入队；
+    写入缓存失败的消息重新入队。
+    """
+
+    # 查询队列积压消息数的间隔（秒）
+    QUEUE_DEPTH_INTERVAL = 5.0
+
+    def __init__(self, cache_settings: CacheSettings, shared: bool):
+        self.settings = cache_settings
+        self.queues = cache_settings.queues()
+        self.shared = shared
+        self.connection = None
+        self.channel = None
+        self._lock_file = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._pending_acks = 0
+        self._last_delivery_tag = None
+        self.connected = False
+        self.reconnects = 0
+        self.rejected = 0
+        self.requeued = 0
+        # 最近一条消息从发布到写入缓存的耗时，以及队列中等待消费的消息数
+        self.lag_seconds: Optional[float] = None
+        self.queue_depth: Optional[int] = None
+
+    def _acquire_consumer_lock(self):
+        """共享缓存只需要一个消费者：阻塞等待文件锁，持有锁的进程退出后由其他进程接管"""
+        lock_file = open(f"{self.settings.sqlite_path}.consumer.lock", "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        logger.info("Acquired cache consumer lock")
+        self._lock_file = lock_file
 
-def start_cache_consumer():
-    """启动消息消费者线程"""
-    try:
-        channel.start_consuming()
-    except KeyboardInterrupt:
+    def connect(self):
+        """连接 RabbitMQ 并注册消费回调"""
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=self.settings.rabbitmq_host, heartbeat=30),
+        )
+        self.channel = self.connection.channel()
+        self.channel.basic_qos(prefetch_count=self.settings.prefetch_count)
+        if self.settings.partition_count:
+            self.channel.exchange_declare(
+                exchange=partition.EXCHANGE, exchange_type="direct", durable=self.settings.durable)
+            for p in self.settings.owned_partitions():
+                self.channel.queue_declare(queue=partition.queue_name(p), durable=self.settings.durable)
+                self.channel.queue_bind(
+                    queue=partition.queue_name(p), exchange=partition.EXCHANGE,
+                    routing_key=partition.routing_key(p))
+        else:
+            self.channel.queue_declare(queue=self.settings.queue, durable=self.settings.durable)
+        # 同一个 channel 上的 delivery tag 是连续的，多个分区队列可以一起批量确认
+        for queue in self.queues:
+            self.channel.basic_consume(
+                queue=queue, on_message_callback=self.on_message, auto_ack=False)
+        self._pending_acks = 0
+        self._last_delivery_tag = None
+        self.connection.call_later(self.settings.ack_interval, self._flush_periodically)
+        self.connection.call_later(0, self._poll_queue_depth)
+
+    def on_message(self, channel, method, properties, body):
+        try:
+            msg = parse_message(body)
+        except (ValueError, UnicodeDecodeError) as e:
+            self.flush_acks()
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            self.rejected += 1
+            logger.error(f"Rejected malformed message {body[:200]!r}: {e}")
+            return
+        try:
+            store_message(msg)
+        except Exception as e:
+            self.flush_acks()
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            self.requeued += 1
+            logger.error(f"Failed to cache transaction {msg['transaction_id']}, requeued: {e}")
+            return
+
+        published_at = (properties.headers or {}).get("published_at_ms") if properties else None
+        if published_at is not None:
+            self.lag_seconds = max(time.time() - published_at / 1000, 0.0)
+        self._last_delivery_tag = method.delivery_tag
+        self._pending_acks += 1
+        if self._pending_acks >= self.settings.ack_batch_size:
+            self.flush_acks()
+
+    def flush_acks(self):
+        """一次确认到目前为止处理完的所有消息"""
+        if self._pending_acks and self.channel is not None and self.channel.is_open:
+            self.channel.basic_ack(delivery_tag=self._last_delivery_tag, multiple=True)
+        self._pending_acks = 0
+
+    def _flush_periodically(self):
+        self.flush_acks()
+        if self.connection is not None and self.connection.is_open:
+            self.connection.call_later(self.settings.ack_interval, self._flush_periodically)
+
+    def _poll_queue_depth(self):
+        try:
+            self.queue_depth = sum(
+                self.channel.queue_declare(
+                    queue=queue, durable=self.settings.durable, passive=True
+                ).method.message_count
+                for queue in self.queues
+            )
+        except Exception as e:
+            logger.warning(f"Failed to read queue depth: {e}")
+            return
+        if self.connection is not None and self.connection.is_open:
+            self.connection.call_later(self.QUEUE_DEPTH_INTERVAL, self._poll_queue_depth)
+
+    def consume(self):
+        if self.shared:
+            self._acquire_consumer_lock()
+        delay = self.settings.reconnect_delay
+        try:
+            while not self._stopping.is_set():
+                try:
+                    self.connect()
+                    self.connected = True
+                    delay = self.settings.reconnect_delay
+                    logger.info(f"Cache consumer connected to {self.settings.rabbitmq_host}")
+                    self.channel.start_consuming()
+                except pika.exceptions.AMQPError as e:
+                    logger.error(f"Cache consumer disconnected: {e!r}")
+                except Exception as e:
+                    logger.error(f"Cache consumer stopped unexpectedly: {e!r}")
+                finally:
+                    self.connected = False
+                    self._close_connection()
+                if self._stopping.is_set():
+                    break
+                self.reconnects += 1
+                wait = delay * random.uniform(0.5, 1.0)
+                logger.info(f"Reconnecting cache consumer in {wait:.2f}s")
+                self._stopping.wait(wait)
+                delay = min(delay * 2, self.settings.max_reconnect_delay)
+        finally:
+            self._release_consumer_lock()
+
+    def start(self):
+        """启动消息消费者线程"""
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self.consume, name="cache-consumer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        connection = self.connection
+        if connection is not None and connection.is_open:
+            try:
+                connection.add_callback_threadsafe(self._stop_consuming)
+            except Exception as e:
+                logger.warning(f"Failed to stop cache consumer: {e}")
+        if self._thread is not None:
+            self._thread.join(timeout)
         logger.info("Message consuming stopped")
-        channel.stop_consuming()
-        connection.close()
 
-consumer_thread = threading.Thread(target=start_cache_consumer, daemon=True)
-consumer_thread.start()
\ No newline at end of file
+    def _stop_consuming(self):
+        # 关闭前确认已写入缓存的消息，其余未处理的消息由 RabbitMQ 重新投递
+        self.flush_acks()
+        self.channel.stop_consuming()
+
+    def _close_connection(self):
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.flush_acks()
+                self.connection.close()
+        except Exception as e:
+            logger.warning(f"Failed to close RabbitMQ connection: {e!r}")
+        self.connection = None
+        self.channel = None
+
+    def _release_consumer_lock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def start_consumer():
+    global consumer
+    if consumer is None:
+        consumer = CacheConsumer(settings, _cache().shared)
+        consumer.start()
+    return consumer
+
+
+def stop_consumer():
+    global consumer
+    if consumer is not None:
+        consumer.stop()
+        consumer = None
@@ -0,0 +1,371 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from app.cache_log import DEFAULT_CAPACITY as DEFAULT_LOG_CAPACITY
+from app.cache_log import OP_DELETE, OP_PUT, CacheLog, LogFull, LogLocked
+from app.ttl_cache import TTLCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    """Storage for transactions received from the API callback server"""
+
+    # 是否在多个进程之间共享，共享后端只需要一个消费者
+    shared = False
+
+    @abstractmethod
+    def put(self, transaction_id: str, data: dict, timestamp: Optional[float] = None):
+        pass
+
+    @abstractmethod
+    def pop(self, transaction_id: str, count: bool = True) -> Optional[dict]:
+        """Remove and return a live entry; ``count=False`` is a retry that is not counted in hits and misses"""
+        pass
+
+    @abstractmethod
+    def size(self) -> int:
+        pass
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Per-process in-memory backend
+
+    With ``log_path`` every put and pop is also appended to a memory-mapped
+    log (see ``app.cache_log``). On start the log is replayed, entries still
+    inside the TTL are restored, and the log is compacted to those entries.
+
+    Later compactions run on a background thread. While one runs, appends
+    still go to the old log and are also queued in memory. After the new log
+    is swapped in, the queue is written to it in batches of ``DRAIN_BATCH``.
+    Put and pop hold the log lock for at most one append or one batch.
+    """
+
+    # 定期压缩的最小间隔（秒），日志不足 COMPACT_MIN_BYTES 时不压缩
+    COMPACT_INTERVAL = 60.0
+    COMPACT_MIN_BYTES = 1024 * 1024
+    # 替换日志后每次持锁补写的记录数
+    DRAIN_BATCH = 256
+
+    def __init__(self, ttl: float, max_size: int, on_expire=None,
+                 log_path: str = "", log_capacity: int = DEFAULT_LOG_CAPACITY):
+        self.cache = TTLCache(ttl, max_size=max_size, on_expire=on_expire)
+        self.log: Optional[CacheLog] = None
+        self.replayed = 0
+        self._log_lock = threading.Lock()
+        self._last_compact = time.monotonic()
+        # 压缩进行中时不为 None，保存压缩期间追加的记录
+        self._pending: Optional[Deque[Tuple[int, str, bytes, float]]] = None
+        # 新日志已替换、队列尚未补写完时为 True，此时追加只进入队列以保持顺序
+        self._draining = False
+        self._compact_wake = threading.Event()
+        self._compact_thread: Optional[threading.Thread] = None
+        self._stopping = False
+        if log_path:
+            try:
+                self.log = CacheLog(log_path, log_capacity)
+            except LogLocked as e:
+                # 旧进程没有按时退出时不阻塞启动，本进程的缓存不写日志
+                logger.warning(f"Cache log disabled: {e}")
+            else:
+                self._replay()
+                self._compact_thread = threading.Thread(
+                    target=self._run_compactor, name="cache-log-compactor", daemon=True
+                )
+                self._compact_thread.start()
+
+    def put(self, transaction_id: str, data: dict, timestamp: Optional[float] = None):
+        if timestamp is None:
+            timestamp = time.time()
+        self.cache.set(transaction_id, data, timestamp)
+        if self.log is not None:
+            self._append(OP_PUT, transaction_id, json.dumps(data).encode(), timestamp)
+
+    def pop(self, transaction_id: str, count: bool = True) -> Optional[dict]:
+        data = self.cache.pop(transaction_id, count=count)
+        if data is not None and self.log is not None:
+            self._append(OP_DELETE, transaction_id, b"", time.time())
+        return data
+
+    def size(self) -> int:
+        return len(self.cache)
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.cache.stats()
+        if self.log is not None:
+            stats["replayed"] = self.replayed
+            stats["log_bytes"] = self.log.offset
+            stats["log_compactions"] = self.log.compactions
+        return stats
+
+    def close(self):
+        if self._compact_thread is not None:
+            self._stopping = True
+            self._compact_wake.set()
+            self._compact_thread.join()
+            self._compact_thread = None
+        if self.log is not None:
+            with self._log_lock:
+                self.log.close()
+                self.log = None
+
+    def _replay(self):
+        live = {}
+        for op, transaction_id, value, timestamp in self.log.records():
+            if op == OP_PUT:
+                live.pop(transaction_id, None)
+                live[transaction_id] = (value, timestamp)
+            else:
+                live.pop(transaction_id, None)
+        # 过期时间由 TTLCache 按原始时间戳计算，早于 TTL 的条目不会恢复
+        oldest = time.time() - self.cache.ttl
+        for transaction_id, (value, timestamp) in live.items():
+            if timestamp >= oldest:
+                self.cache.set(transaction_id, json.loads(value), timestamp)
+                self.replayed += 1
+        if self.replayed:
+            logger.info(f"Restored {self.replayed} messages from {self.log.path}")
+        # 启动时还没有请求，直接在当前线程压缩
+        self.log.install(self.log.prepare(self._live_entries()))
+        self._last_compact = time.monotonic()
+
+    def _append(self, op: int, transaction_id: str, value: bytes, timestamp: float):
+        with self._log_lock:
+            if self.log is None:
+                return
+            if self._pending is not None:
+                # 压缩进行中：记录留给新日志，同时写入旧日志以防压缩完成前崩溃
+                self._pending.append((op, transaction_id, value, timestamp))
+                if not self._draining:
+                    try:
+                        self.log.append(op, transaction_id, value, timestamp)
+                    except LogFull:
+                        pass
+                return
+            try:
+                self.log.append(op, transaction_id, value, timestamp)
+            except LogFull:
+                # 交给压缩线程，这条记录写入压缩后的新日志
+                self._pending = deque([(op, transaction_id, value, timestamp)])
+                self._compact_wake.set()
+
+    def _run_compactor(self):
+        while True:
+            if not self._stopping:
+                self._compact_wake.wait(self.COMPACT_INTERVAL)
+                self._compact_wake.clear()
+            with self._log_lock:
+                requested = self._pending is not None
+                due = (not self._stopping and self.log.offset >= self.COMPACT_MIN_BYTES
+                       and time.monotonic() - self._last_compact >= self.COMPACT_INTERVAL)
+                if not requested and not due:
+                    # 关闭前先完成已请求的压缩，内存中的记录不会丢失
+                    if self._stopping:
+                        return
+                    continue
+                if not requested:
+                    self._pending = deque()
+            try:
+                self._compact()
+            except Exception as e:
+                logger.error(f"Cache log compaction failed: {e!r}")
+                with self._log_lock:
+                    # 旧日志写满后的记录只在内存中，丢弃后重启时可能恢复已取走的交易
+                    self._pending = None
+                    self._draining = False
+                    self._last_compact = time.monotonic()
+
+    def _compact(self):
+        # 快照和写入临时文件都在锁外进行，期间的追加记在 _pending 中，替换日志后
+        # 按顺序分批补写；重放时同一个 key 的重复 put 或 delete 不影响结果。
+        # 补写完成前崩溃会丢失队列中的记录
+        prepared = self.log.prepare(self._live_entries())
+        with self._log_lock:
+            self.log.install(prepared)
+            self._draining = True
+        while True:
+            with self._log_lock:
+                pending = self._pending
+                for _ in range(min(self.DRAIN_BATCH, len(pending))):
+                    op, transaction_id, value, timestamp = pending[0]
+                    try:
+                        self.log.append(op, transaction_id, value, timestamp)
+                    except LogFull:
+                        # 新日志只剩不到一半空间时才会发生，剩余记录留给下一次压缩
+                        self._draining = False
+                        self._compact_wake.set()
+                        return
+                    pending.popleft()
+                if not pending:
+                    self._pending = None
+                    self._draining = False
+                    self._last_compact = time.monotonic()
+                    return
+
+    def _live_entries(self):
+        ttl = self.cache.ttl
+        return [
+            (key, json.dumps(value).encode(), expires_at - ttl)
+            for key, value, expires_at in self.cache.items()
+        ]
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Process-shared backend on a SQLite database in WAL mode
+
+    Every worker process opens the same file, so a single consumer can feed
+    all of them. ``pop`` deletes the row in the same statement that reads it,
+    which keeps a transaction from being handed to two workers.
+    """
+
+    shared = True
+
+    # 两次清理过期数据之间的最小间隔（秒）
+    CLEANUP_INTERVAL = 1.0
+
+    def __init__(self, path: str, ttl: float, max_size: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._local = threading.local()
+        self._last_cleanup = 0.0
+        self._use_returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tx_cache ("
+            "transaction_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS tx_cache_expires_at ON tx_cache (expires_at)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程使用，每个线程各自持有一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, transaction_id: str, data: dict, timestamp: Optional[float] = None):
+        now = time.time()
+        expires_at = (now if timestamp is None else timestamp) + self.ttl
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO tx_cache (transaction_id, data, expires_at) VALUES (?, ?, ?)",
+            (transaction_id, json.dumps(data), expires_at),
+        )
+        if now - self._last_cleanup >= self.CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            self._cleanup(conn, now)
+
+    def pop(self, transaction_id: str, count: bool = True) -> Optional[dict]:
+        conn = self._conn()
+        now = time.time()
+        if self._use_returning:
+            row = conn.execute(
+                "DELETE FROM tx_cache WHERE transaction_id = ? AND expires_at >= ? RETURNING data",
+                (transaction_id, now),
+            ).fetchone()
+        else:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT data FROM tx_cache WHERE transaction_id = ? AND expires_at >= ?",
+                    (transaction_id, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "DELETE FROM tx_cache WHERE transaction_id = ?", (transaction_id,)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            self.misses += count
+            return None
+        self.hits += count
+        return json.loads(row[0])
+
+    def size(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM tx_cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size(),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _cleanup(self, conn: sqlite3.Connection, now: float):
+        expired = conn.execute(
+            "DELETE FROM tx_cache WHERE expires_at < ?", (now,)
+        ).rowcount
+        self.expirations += expired
+        if expired:
+            logger.debug(f"Cleaned up {expired} expired messages")
+
+        overflow = self.size() - self.max_size
+        if overflow > 0:
+            # 超出上限时淘汰最早过期的消息
+            self.evictions += conn.execute(
+                "DELETE FROM tx_cache WHERE transaction_id IN ("
+                "SELECT transaction_id FROM tx_cache ORDER BY expires_at LIMIT ?)",
+                (overflow,),
+            ).rowcount
+
+
+def create_backend(
+    kind: str, ttl: float, max_size: int, sqlite_path: str = "", on_expire=None,
+    log_path: str = "", log_capacity: int = DEFAULT_LOG_CAPACITY,
+) -> CacheBackend:
+    """Create a cache backend by name: ``memory`` or ``sqlite``
+
+    ``log_path`` enables the restart log of the memory backend; the SQLite
+    backend is already persistent and ignores it.
+    """
+    kind = (kind or "memory").strip().lower()
+    if kind == "memory":
+        return MemoryCacheBackend(
+            ttl, max_size, on_expire=on_expire, log_path=log_path, log_capacity=log_capacity
+        )
+    if kind == "sqlite":
+        return SQLiteCacheBackend(sqlite_path, ttl, max_size)
+    raise ValueError(f"Unsupported cache backend: {kind}")
@@ -0,0 +1,206 @@
+"""
+Memory-mapped append-only log behind the in-memory transaction cache.
+
+Every put and pop of the memory backend is appended to a preallocated,
+mmap'ed file, so the hot path is a memcpy into the page cache and no
+system call. The kernel writes the pages back even if the process crashes;
+after a restart the log is replayed and transactions still inside the TTL
+are put back into the cache. ``flush`` (msync) is only needed to survive
+a power loss and is called on close and after compaction.
+
+Compaction is split in two so that appends can go on while it runs:
+``prepare`` writes the live entries to a temporary file, and ``install``
+swaps that file in.
+
+File layout (little endian)::
+
+    header  magic "CTXL" | u16 version | u16 reserved
+    record  u32 payload length | u32 crc32 | f64 timestamp | u8 op | 3 pad | payload
+    payload u16 key length | key | value
+
+The region after the last record is zero-filled, so a zero length marks the
+end of the log. A record whose checksum does not match was torn by a crash
+and ends the replay.
+"""
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Iterable, Iterator, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CTXL"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+RECORD = struct.Struct("<IIdB3x")
+KEY_LENGTH = struct.Struct("<H")
+
+OP_PUT = 1
+OP_DELETE = 2
+
+DEFAULT_CAPACITY = 64 * 1024 * 1024
+
+
+class LogFull(Exception):
+    pass
+
+
+class LogLocked(Exception):
+    """另一个进程正在使用该日志文件"""
+
+
+def encode_record(op: int, key: str, value: bytes, timestamp: float) -> bytes:
+    key_bytes = key.encode()
+    payload = KEY_LENGTH.pack(len(key_bytes)) + key_bytes + value
+    # crc 覆盖 crc 字段之后的全部内容
+    body = RECORD.pack(len(payload), 0, timestamp, op)[8:] + payload
+    return struct.pack("<II", len(payload), zlib.crc32(body)) + body
+
+
+class CacheLog:
+    """Append-only log in a preallocated mmap'ed file; not thread-safe, callers lock"""
+
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY, lock_timeout: float = 10.0):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 滚动部署时新旧进程可能同时运行，锁放在单独的文件上，压缩替换日志文件后仍然有效
+        self._lock_file = self._acquire_lock(f"{path}.lock", lock_timeout)
+        self._fd = -1
+        self._mm: Optional[mmap.mmap] = None
+        self.offset = HEADER.size
+        self.compactions = 0
+        try:
+            self._open(max(capacity, HEADER.size + RECORD.size))
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def _acquire_lock(lock_path: str, timeout: float):
+        lock_file = open(lock_path, "a")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    raise LogLocked(f"{lock_path} is held by another process")
+                time.sleep(0.1)
+
+    def _open(self, capacity: int, offset: Optional[int] = None):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = os.fstat(fd).st_size
+        if size < capacity:
+            os.ftruncate(fd, capacity)
+        self._fd = fd
+        self._mm = mmap.mmap(fd, max(size, capacity))
+        magic, version, _ = HEADER.unpack_from(self._mm, 0)
+        if size == 0 or magic == b"\0" * 4:
+            HEADER.pack_into(self._mm, 0, MAGIC, VERSION, 0)
+        elif magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a cache log (version {VERSION})")
+        if offset is not None:
+            # 刚写好的压缩文件，记录结尾已知，不必重新扫描
+            self.offset = offset
+            return
+        self.offset = HEADER.size
+        for _ in self.records():
+            pass
+
+    @property
+    def capacity(self) -> int:
+        return len(self._mm)
+
+    def records(self) -> Iterator[Tuple[int, str, bytes, float]]:
+        """Yield (op, key, value, timestamp) and move ``offset`` to the end of the last good record"""
+        mm = self._mm
+        end = len(mm)
+        position = HEADER.size
+        while position + RECORD.size <= end:
+            length, crc, timestamp, op = RECORD.unpack_from(mm, position)
+            stop = position + RECORD.size + length
+            if length == 0 or stop > end or zlib.crc32(mm[position + 8:stop]) != crc:
+                break
+            payload = mm[position + RECORD.size:stop]
+            (key_length,) = KEY_LENGTH.unpack_from(payload, 0)
+            key_end = KEY_LENGTH.size + key_length
+            yield op, payload[KEY_LENGTH.size:key_end].decode(), payload[key_end:], timestamp
+            position = stop
+        if position + RECORD.size <= end and mm[position:position + RECORD.size] != bytes(RECORD.size):
+            # 崩溃时写了一半的记录；之后的追加会覆盖它，重放后压缩可以清除残留的字节
+            logger.warning(f"Discarding torn record at offset {position} of {self.path}")
+        self.offset = position
+
+    def append(self, op: int, key: str, value: bytes = b"", timestamp: Optional[float] = None):
+        record = encode_record(op, key, value, time.time() if timestamp is None else timestamp)
+        start = self.offset
+        stop = start + len(record)
+        if stop > len(self._mm):
+            raise LogFull(f"{self.path} is full ({len(self._mm)} bytes)")
+        # 先写记录体再写长度，进程在中途崩溃时 crc 不匹配，重放到这里为止
+        self._mm[start + 4:stop] = record[4:]
+        self._mm[start:start + 4] = record[:4]
+        self.offset = stop
+
+    def compact(self, entries: Iterable[Tuple[str, bytes, float]]):
+        """Replace the log with one put per live entry, growing the file if they do not fit"""
+        self.install(self.prepare(entries))
+
+    def prepare(self, entries: Iterable[Tuple[str, bytes, float]]) -> Tuple[str, int, int]:
+        """Write the compacted log to a temporary file; returns (path, capacity, offset)
+
+        Does not touch the current log, so ``append`` may run concurrently.
+        """
+        records = [encode_record(OP_PUT, key, value, timestamp) for key, value, timestamp in entries]
+        used = HEADER.size + sum(len(r) for r in records)
+        capacity = len(self._mm)
+        # 压缩后至少保留一半空间用于追加
+        while used * 2 > capacity:
+            capacity *= 2
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0))
+            for record in records:
+                f.write(record)
+            f.truncate(capacity)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path, capacity, used
+
+    def install(self, prepared: Tuple[str, int, int]):
+        """Swap a file written by ``prepare`` in for the current log"""
+        tmp_path, capacity, offset = prepared
+        os.replace(tmp_path, self.path)
+        self._close_map()
+        self._open(capacity, offset)
+        self.compactions += 1
+
+    def flush(self):
+        if self._mm is not None:
+            self._mm.flush()
+
+    def _close_map(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.flush()
+        self._close_map()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
@@ -14,27 +14,38 @@ class ServiceConfig:
     client_public_key_path: str = "configs/tss-node-callback-pub.key"
     service_private_key_path: str = "configs/callback-server-pri.pem"
     enable_debug: bool = False
+    # 风控策略文件，不存在时不启用
+    policy_path: str = "configs/policy.yaml"
+    # 加载该配置的 YAML 文件，设置后修改文件会重新加载密钥、token 有效期和风控策略
+    config_path: str = ""
+
+
+def read_yaml_config(config_path: str) -> ServiceConfig:
+    """Read configuration from YAML file; raises if the file is missing or invalid"""
+    with open(config_path, "r") as f:
+        yaml_config = yaml.safe_load(f)
+
+    callback_config = yaml_config.get("callback_server", {})
+    return ServiceConfig(
+        service_name="callback-server",
+        endpoint=callback_config.get("endpoint", "0.0.0.0:11020"),
+        token_expire_minutes=callback_config.get("token_expire_minutes", 2),
+        client_public_key_path=callback_config.get(
+            "client_public_key_path", "configs/tss-node-callback-pub.key"
+        ),
+        service_private_key_path=callback_config.get(
+            "service_private_key_path", "configs/callback-server-pri.pem"
+        ),
+        enable_debug=callback_config.get("enable_debug", False),
+        policy_path=callback_config.get("policy_path", "configs/policy.yaml"),
+        config_path=config_path,
+    )
 
 
 def load_yaml_config(config_path: str) -> ServiceConfig:
     """Load configuration from YAML file"""
     try:
-        with open(config_path, "r") as f:
-            yaml_config = yaml.safe_load(f)
-
-        callback_config = yaml_config.get("callback_server", {})
-        return ServiceConfig(
-            service_name="callback-server",
-            endpoint=callback_config.get("endpoint", "0.0.0.0:11020"),
-            token_expire_minutes=callback_config.get("token_expire_minutes", 2),
-            client_public_key_path=callback_config.get(
-                "client_public_key_path", "configs/tss-node-callback-pub.key"
-            ),
-            service_private_key_path=callback_config.get(
-                "service_private_key_path", "configs/callback-server-pri.pem"
-            ),
-            enable_debug=callback_config.get("enable_debug", False),
-        )
+        return read_yaml_config(config_path)
     except Exception as e:
         print(f"Failed to load config file {config_path}: {str(e)}")
         print("Using default configuration...")
@@ -0,0 +1,234 @@
+"""
+Direct transport from the API callback server into the transaction cache.
+
+The API callback server (``cobo_api_callback_server/direct.py``) connects to a
+Unix domain socket and sends batches of the same messages it publishes to
+RabbitMQ. Depending on its ``MESSAGE_FORMAT`` a message is either a binary
+``app.txrecord`` record or JSON, and ``cache.parse_message`` accepts both.
+A batch is acknowledged once every message in it has been
+written to the cache, so ``get_transaction`` sees the transaction as soon as
+the callback returns. RabbitMQ keeps running alongside as the fallback path.
+
+Frames (little endian, both copies of the protocol must match)::
+
+    batch  u32 body length | u64 batch id | u64 sent at (ms) | body
+    body   (u32 message length | message) * n
+    ack    u64 batch id | u8 status
+"""
+import fcntl
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Optional
+
+from app import cache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_HEADER = struct.Struct("<IQQ")
+MESSAGE_LENGTH = struct.Struct("<I")
+ACK = struct.Struct("<QB")
+
+ACK_OK = 0
+# 写入缓存失败，客户端改走 RabbitMQ
+ACK_RETRY = 1
+
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+
+def _recv_exact(conn: socket.socket, size: int) -> Optional[bytes]:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = conn.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return bytes(buf)
+
+
+class DirectReceiver:
+    """Accept batches on a Unix socket and write them to the cache
+
+    With a shared (SQLite) cache only one worker needs to listen: like the
+    RabbitMQ consumer, the receiver waits for a lock file before binding the
+    socket, and another worker takes over when the holder exits.
+    """
+
+    def __init__(self, socket_path: str, shared: bool):
+        self.socket_path = socket_path
+        self.shared = shared
+        self._server: Optional[socket.socket] = None
+        self._socket_inode: Optional[int] = None
+        self._lock_file = None
+        self._thread: Optional[threading.Thread] = None
+        self._connections = set()
+        self._stopping = threading.Event()
+        self.listening = False
+        self.batches = 0
+        self.messages = 0
+        self.rejected = 0
+        self.failed_batches = 0
+        # 最近一批消息从发送到写入缓存的耗时
+        self.lag_seconds: Optional[float] = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.serve, name="direct-receiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        server = self._server
+        if server is not None:
+            try:
+                server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for conn in list(self._connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+        logger.info("Direct receiver stopped")
+
+    def serve(self):
+        try:
+            if self.shared:
+                self._acquire_lock()
+                if self._stopping.is_set():
+                    return
+            self._bind()
+            logger.info(f"Direct receiver listening on {self.socket_path}")
+            while not self._stopping.is_set():
+                try:
+                    conn, _ = self._server.accept()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                threading.Thread(
+                    target=self._handle, args=(conn,), name="direct-connection", daemon=True
+                ).start()
+        except Exception as e:
+            logger.error(f"Direct receiver stopped unexpectedly: {e!r}")
+        finally:
+            self._close()
+
+    def _acquire_lock(self):
+        lock_file = open(f"{self.socket_path}.lock", "a")
+        while not self._stopping.is_set():
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                self._stopping.wait(0.5)
+        self._lock_file = lock_file
+
+    def _bind(self):
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 上一个进程异常退出时留下的 socket 文件
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        self._socket_inode = os.stat(self.socket_path).st_ino
+        server.listen(16)
+        server.settimeout(0.5)
+        self._server = server
+        self.listening = True
+
+    def _handle(self, conn: socket.socket):
+        self._connections.add(conn)
+        try:
+            while not self._stopping.is_set():
+                header = _recv_exact(conn, BATCH_HEADER.size)
+                if header is None:
+                    return
+                length, batch_id, sent_at_ms = BATCH_HEADER.unpack(header)
+                if length > MAX_BATCH_BYTES:
+                    logger.error(f"Direct batch of {length} bytes exceeds {MAX_BATCH_BYTES}, closing")
+                    return
+                body = _recv_exact(conn, length)
+                if body is None:
+                    return
+                status = self.store_batch(body)
+                if status == ACK_OK and sent_at_ms:
+                    self.lag_seconds = max(time.time() - sent_at_ms / 1000, 0.0)
+                conn.sendall(ACK.pack(batch_id, status))
+        except OSError as e:
+            if not self._stopping.is_set():
+                logger.warning(f"Direct connection closed: {e!r}")
+        finally:
+            self._connections.discard(conn)
+            conn.close()
+
+    def store_batch(self, body: bytes) -> int:
+        """Write every message of a batch to the cache; malformed messages are dropped"""
+        self.batches += 1
+        view = memoryview(body)
+        position = 0
+        while position < len(view):
+            (length,) = MESSAGE_LENGTH.unpack_from(view, position)
+            position += MESSAGE_LENGTH.size
+            message = bytes(view[position:position + length])
+            position += length
+            try:
+                msg = cache.parse_message(message)
+            except (ValueError, UnicodeDecodeError) as e:
+                self.rejected += 1
+                logger.error(f"Rejected malformed direct message {message[:200]!r}: {e}")
+                continue
+            try:
+                cache.store_message(msg)
+            except Exception as e:
+                # 已写入的消息重复写入只会覆盖缓存
+                self.failed_batches += 1
+                logger.error(f"Failed to cache transaction {msg['transaction_id']}: {e}")
+                return ACK_RETRY
+            self.messages += 1
+        return ACK_OK
+
+    def _close(self):
+        self.listening = False
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            # 滚动部署时新进程可能已经在同一路径上监听，只删除自己创建的 socket 文件
+            try:
+                if os.stat(self.socket_path).st_ino == self._socket_inode:
+                    os.unlink(self.socket_path)
+            except OSError:
+                pass
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+receiver: Optional[DirectReceiver] = None
+
+
+def start_receiver() -> Optional[DirectReceiver]:
+    """未配置 DIRECT_SOCKET_PATH 时不启动，交易只经由 RabbitMQ 到达"""
+    global receiver
+    if receiver is None and cache.settings.direct_socket_path:
+        receiver = DirectReceiver(cache.settings.direct_socket_path, cache.open_cache().shared)
+        receiver.start()
+    return receiver
+
+
+def stop_receiver():
+    global receiver
+    if receiver is not None:
+        receiver.stop()
+        receiver = None
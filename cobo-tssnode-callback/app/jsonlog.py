@@ -0,0 +1,292 @@
+"""
+Non-blocking JSON-lines logging shared by cobo-tssnode-callback and cobo_api_callback_server.
+
+The two copies (cobo-tssnode-callback/app/jsonlog.py and
+cobo_api_callback_server/jsonlog.py) must stay identical.
+
+Request threads only filter the record and put it on a bounded queue; a
+background thread formats it and writes to stderr and log files. Message
+arguments are formatted in the background thread, so pass objects as
+``%s`` arguments instead of formatting them with f-strings.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+REQUEST_ID: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+DEFAULT_REDACT_KEYS = frozenset({
+    "authorization", "password", "secret", "token", "private_key",
+    "api_secret", "signature", "tss_jwt_msg",
+})
+REDACTED = "***"
+
+# LogRecord 自带的属性，其余属性来自 extra，作为 JSON 字段输出
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "request_id", "sample", "suppressed",
+}
+
+
+@contextmanager
+def request_context(request_id: Optional[str] = None):
+    """Tag every record logged inside the block with ``request_id``"""
+    token = REQUEST_ID.set(request_id or uuid.uuid4().hex)
+    try:
+        yield
+    finally:
+        REQUEST_ID.reset(token)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按调用位置（文件 + 行号）限速的过滤器，对 f-string 生成的不同消息同样有效。
+
+    每个调用位置一个令牌桶，每秒补充 rate 个、最多 burst 个；被丢弃的条数
+    记在下一条放行的记录的 suppressed 字段中。level >= max_level 的记录不限速。
+    记录可以通过 ``extra={"sample": 0.01}`` 按比例采样。
+    """
+
+    def __init__(self, rate: float = 100.0, burst: int = 200, max_level: int = logging.WARNING,
+                 max_keys: int = 10000, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_level = max_level
+        self.max_keys = max_keys
+        self.clock = clock
+        # (pathname, lineno) -> [tokens, updated_at, suppressed]
+        self._buckets: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample = getattr(record, "sample", None)
+        if sample is not None and sample < 1 and random.random() >= sample:
+            return False
+        if record.levelno >= self.max_level or self.rate <= 0:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.dropped += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+def _limit(value, max_length: int, redact_keys: frozenset, depth: int = 0):
+    """脱敏并限制长度，非 JSON 类型转换为字符串"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, dict) and depth < 4:
+        return {
+            str(k): REDACTED if str(k).lower() in redact_keys
+            else _limit(v, max_length, redact_keys, depth + 1)
+            for k, v in list(value.items())[:100]
+        }
+    if isinstance(value, (list, tuple)) and depth < 4:
+        return [_limit(v, max_length, redact_keys, depth + 1) for v in value[:100]]
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > max_length:
+        return f"{text[:max_length]}...(+{len(text) - max_length} chars)"
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, request_id and extra fields"""
+
+    def __init__(self, max_field_length: int = 2048, redact_keys: Iterable[str] = DEFAULT_REDACT_KEYS):
+        super().__init__()
+        self.max_field_length = max_field_length
+        self.redact_keys = frozenset(k.lower() for k in redact_keys)
+
+    def format(self, record: logging.LogRecord) -> str:
+        try:
+            message = record.getMessage()
+        except Exception as e:
+            message = f"{record.msg!r} (format error: {e})"
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                  + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _limit(message, self.max_field_length, self.redact_keys),
+            "pid": record.process,
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = REDACTED if key.lower() in self.redact_keys else _limit(
+                    value, self.max_field_length, self.redact_keys
+                )
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列已满时丢弃记录并计数，不阻塞请求线程"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 不在这里格式化消息；异常堆栈必须在当前线程格式化，traceback 不能跨线程保留
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        if record.stack_info:
+            record.exc_text = "\n".join(filter(None, (record.exc_text, record.stack_info)))
+            record.stack_info = None
+        if not hasattr(record, "request_id"):
+            record.request_id = REQUEST_ID.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # 队列已满时 put_nowait 会失败；写日志的线程仍在消费，阻塞等待即可
+        self.queue.put(self._sentinel)
+
+
+class _State:
+    def __init__(self, handler: NonBlockingQueueHandler, rate_limit: RateLimitFilter,
+                 outputs: list, queue_size: int):
+        self.handler = handler
+        self.rate_limit = rate_limit
+        self.outputs = outputs
+        self.queue_size = queue_size
+        self.listener: Optional[_Listener] = None
+
+    def start(self):
+        self.handler.queue = queue.Queue(maxsize=self.queue_size)
+        self.listener = _Listener(
+            self.handler.queue, *self.outputs, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            # stop 会先写完队列中剩余的记录
+            self.listener.stop()
+            self.listener = None
+        for output in self.outputs:
+            try:
+                output.flush()
+            except (OSError, ValueError):
+                # 退出时 stderr 可能已经关闭
+                pass
+
+
+_state: Optional[_State] = None
+_lock = threading.Lock()
+
+
+def setup_logging(level=logging.INFO, stream=None, files: Dict[str, str] = None,
+                  queue_size: int = 10000, rate: float = 100.0, burst: int = 200,
+                  max_field_length: int = 2048,
+                  redact_keys: Iterable[str] = DEFAULT_REDACT_KEYS) -> NonBlockingQueueHandler:
+    """
+    Replace the root handlers with a queue handler and start the writer thread.
+
+    ``files`` maps a logger name to a log file that additionally receives that
+    logger's records (and its children's). Calling again reconfigures logging.
+    """
+    global _state
+    formatter = JsonFormatter(max_field_length=max_field_length, redact_keys=redact_keys)
+    console = logging.StreamHandler(stream or sys.stderr)
+    console.setFormatter(formatter)
+    outputs = [console]
+    for name, path in (files or {}).items():
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # WatchedFileHandler 在 logrotate 移走文件后重新打开
+        file_handler = logging.handlers.WatchedFileHandler(path)
+        file_handler.setFormatter(formatter)
+        file_handler.addFilter(logging.Filter(name))
+        outputs.append(file_handler)
+
+    rate_limit = RateLimitFilter(rate=rate, burst=burst)
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(rate_limit)
+
+    with _lock:
+        root = logging.getLogger()
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        if _state is not None:
+            _state.stop()
+            for output in _state.outputs:
+                output.close()
+        _state = _State(handler, rate_limit, outputs, queue_size)
+        _state.start()
+        root.addHandler(handler)
+        root.setLevel(level)
+    return handler
+
+
+def shutdown_logging():
+    """Stop the writer thread after draining the queue"""
+    with _lock:
+        if _state is not None:
+            _state.stop()
+
+
+def stats() -> dict:
+    if _state is None:
+        return {}
+    return {
+        "queued": _state.handler.queue.qsize(),
+        "dropped_queue_full": _state.handler.dropped,
+        "dropped_rate_limited": _state.rate_limit.dropped,
+    }
+
+
+def _restart_in_child():
+    # fork 后子进程中没有写日志的线程，队列的锁也可能处于加锁状态，重新创建
+    global _lock
+    _lock = threading.Lock()
+    if _state is not None and _state.listener is not None:
+        _state.rate_limit._lock = threading.Lock()
+        _state.start()
+
+
+os.register_at_fork(after_in_child=_restart_in_child)
+atexit.register(shutdown_logging)
@@ -0,0 +1,52 @@
+import logging
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from app.utils import load_keys
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# RS256 签名要求的最小 RSA 密钥长度
+MIN_RSA_KEY_SIZE = 2048
+
+
+class KeyManager:
+    """Parse the RSA key pair once and hand out reusable key objects"""
+
+    def __init__(
+        self,
+        client_public_key: rsa.RSAPublicKey,
+        service_private_key: rsa.RSAPrivateKey,
+    ):
+        self.client_public_key = client_public_key
+        self.service_private_key = service_private_key
+
+    @classmethod
+    def from_pem(cls, public_key_pem: bytes, private_key_pem: bytes) -> "KeyManager":
+        """Load and validate keys from PEM bytes"""
+        public_key = serialization.load_pem_public_key(public_key_pem)
+        private_key = serialization.load_pem_private_key(private_key_pem, password=None)
+
+        if not isinstance(public_key, rsa.RSAPublicKey):
+            raise ValueError("client public key is not an RSA key")
+        if not isinstance(private_key, rsa.RSAPrivateKey):
+            raise ValueError("service private key is not an RSA key")
+        for name, key in (("client public", public_key), ("service private", private_key)):
+            if key.key_size < MIN_RSA_KEY_SIZE:
+                raise ValueError(
+                    f"{name} key size {key.key_size} is below {MIN_RSA_KEY_SIZE} bits"
+                )
+
+        return cls(public_key, private_key)
+
+    @classmethod
+    def from_files(cls, public_key_path: str, private_key_path: str) -> "KeyManager":
+        """Load and validate keys from PEM files"""
+        public_key_pem, private_key_pem = load_keys(public_key_path, private_key_path)
+        try:
+            return cls.from_pem(public_key_pem, private_key_pem)
+        except Exception as e:
+            logger.error(f"Failed to parse keys: {str(e)}")
+            raise
@@ -0,0 +1,115 @@
+import json
+from typing import Any, List, Optional
+
+import cobo_waas2
+
+
+class KeySignParseError(ValueError):
+    pass
+
+
+def _int_or_none(value, name: str) -> Optional[int]:
+    # 与 pydantic 的宽松模式一致，接受数字字符串
+    if value is None or isinstance(value, int) and not isinstance(value, bool):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise KeySignParseError(f"{name} must be an integer")
+
+
+def _str_or_none(value, name: str) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    raise KeySignParseError(f"{name} must be a string")
+
+
+def _object(value, name: str) -> Optional[dict]:
+    if value is None or isinstance(value, dict):
+        return value
+    raise KeySignParseError(f"{name} must be an object")
+
+
+class _LazyModel:
+    """Fields read by the validator, with the full SDK model built on first other access"""
+
+    __slots__ = ("_raw", "_model")
+    model_class: Any = None
+
+    def __init__(self, raw: dict):
+        self._raw = raw
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self.model_class.from_dict(self._raw)
+        return self._model
+
+    def __getattr__(self, name):
+        # 只有快速路径未提取的字段才会走到这里，例如策略需要的其他交易字段
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+class RawTxInfo(_LazyModel):
+    __slots__ = ("unsigned_raw_tx", "used_nonce")
+    model_class = cobo_waas2.TransactionRawTxInfo
+
+    def __init__(self, raw: dict):
+        super().__init__(raw)
+        self.unsigned_raw_tx = _str_or_none(raw.get("unsigned_raw_tx"), "unsigned_raw_tx")
+        self.used_nonce = _int_or_none(raw.get("used_nonce"), "used_nonce")
+
+
+class KeySignTransaction(_LazyModel):
+    __slots__ = ("transaction_id", "request_id", "wallet_id", "chain_id", "created_timestamp", "raw_tx_info")
+    model_class = cobo_waas2.Transaction
+
+    def __init__(self, raw: dict):
+        super().__init__(raw)
+        self.transaction_id = _str_or_none(raw.get("transaction_id"), "transaction_id")
+        self.request_id = _str_or_none(raw.get("request_id"), "request_id")
+        self.wallet_id = _str_or_none(raw.get("wallet_id"), "wallet_id")
+        self.chain_id = _str_or_none(raw.get("chain_id"), "chain_id")
+        self.created_timestamp = _int_or_none(raw.get("created_timestamp"), "created_timestamp")
+        raw_tx_info = _object(raw.get("raw_tx_info"), "raw_tx_info")
+        self.raw_tx_info = RawTxInfo(raw_tx_info) if raw_tx_info is not None else None
+
+
+class KeySignExtra(_LazyModel):
+    __slots__ = ("transaction",)
+    model_class = cobo_waas2.TSSKeySignExtra
+
+    def __init__(self, raw: dict):
+        super().__init__(raw)
+        transaction = _object(raw.get("transaction"), "transaction")
+        self.transaction = KeySignTransaction(transaction) if transaction is not None else None
+
+
+class KeySignDetail(_LazyModel):
+    __slots__ = ("msg_hash_list",)
+    model_class = cobo_waas2.TSSKeySignRequest
+
+    def __init__(self, raw: dict):
+        super().__init__(raw)
+        msg_hash_list = raw.get("msg_hash_list")
+        if msg_hash_list is not None and not (
+            isinstance(msg_hash_list, list) and all(isinstance(h, str) for h in msg_hash_list)
+        ):
+            raise KeySignParseError("msg_hash_list must be a list of strings")
+        self.msg_hash_list: Optional[List[str]] = msg_hash_list
+
+
+def parse_key_sign(request_detail: str, extra_info: str):
+    """Parse each JSON document once and keep only what validation reads
+
+    Raises ``json.JSONDecodeError`` for invalid JSON and ``KeySignParseError``
+    for fields of the wrong type.
+    """
+    detail = _object(json.loads(request_detail), "request detail")
+    extra = _object(json.loads(extra_info), "extra info")
+    if detail is None or extra is None:
+        raise KeySignParseError("request detail or extra info is null")
+    return KeySignDetail(detail), KeySignExtra(extra)
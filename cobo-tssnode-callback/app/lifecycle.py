@@ -0,0 +1,58 @@
+import logging
+import os
+
+import dotenv
+
+from app import audit, cache, direct, jsonlog, snapshot, validator
+from app.config import ServiceConfig
+
+logger = logging.getLogger(__name__)
+
+LOG_DIR = "logs"
+
+
+def configure_logging(env_file: str = ".env", log_dir: str = LOG_DIR):
+    """JSON logs to stderr from a background thread; validator logs also go to logs/validator.log"""
+
+    def get(key, default):
+        return dotenv.get_key(env_file, key) or default
+
+    jsonlog.setup_logging(
+        level=get("LOG_LEVEL", "INFO").upper(),
+        files={validator.__name__: os.path.join(log_dir, "validator.log")},
+        queue_size=int(get("LOG_QUEUE_SIZE", 10000)),
+        rate=float(get("LOG_RATE_LIMIT", 100)),
+        burst=int(get("LOG_RATE_BURST", 200)),
+        max_field_length=int(get("LOG_MAX_FIELD_LENGTH", 2048)),
+    )
+
+
+def prepare(env_file: str = ".env", config: ServiceConfig = None):
+    """Load settings before workers fork; opens no connections or databases"""
+    dotenv.load_dotenv(env_file)
+    configure_logging(env_file)
+    snapshot.load(env_file, config)
+    cache.configure(cache.CacheSettings.from_env(env_file))
+    audit.configure(audit.AuditSettings.from_env(env_file))
+
+
+def start_worker():
+    """Open the transaction cache and start consuming, once per worker process"""
+    cache.open_cache()
+    cache.start_consumer()
+    direct.start_receiver()
+    # 监视配置文件的线程在每个 worker 中启动，fork 不会复制线程
+    snapshot.start_watcher()
+    audit.start_sink()
+    logger.info(f"Worker {os.getpid()} started with {cache.settings.backend} cache")
+
+
+def stop_worker():
+    snapshot.stop_watcher()
+    direct.stop_receiver()
+    cache.stop_consumer()
+    cache.close_cache()
+    # 写完审计记录后再关闭日志
+    audit.stop_sink()
+    logger.info(f"Worker {os.getpid()} stopped")
+    jsonlog.shutdown_logging()
@@ -0,0 +1,221 @@
+import contextvars
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# 各处理阶段耗时分布的桶上限（秒）
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (指标名, 标签, 值)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """A metric family rendered in the Prometheus text format"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> List[Sample]:
+        pass
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(tuple(str(v) for v in labelvalues), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # 标签值 -> [各桶计数..., 总和]，桶计数不累加，渲染时再求累计值
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labelvalues) -> "_Timer":
+        return _Timer(self, labelvalues)
+
+    def count(self, *labelvalues) -> int:
+        series = self._series.get(labelvalues)
+        return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        result = []
+        for key, series in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                result.append((f"{self.name}_bucket", {**labels, "le": le}, cumulative))
+            result.append((f"{self.name}_sum", labels, series[-1]))
+            result.append((f"{self.name}_count", labels, cumulative))
+        return result
+
+
+class _Timer:
+    # 比 contextlib.contextmanager 生成器开销小，阶段计时默认常开
+    __slots__ = ("histogram", "labelvalues", "start")
+
+    def __init__(self, histogram: Histogram, labelvalues: tuple):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+
+class GaugeFunc(Metric):
+    """A metric whose samples are read from ``fn`` at scrape time
+
+    ``kind`` may be ``counter`` for totals that another component keeps.
+    """
+
+    def __init__(self, name, documentation,
+                 fn: Callable[[], Iterable[Tuple[Dict[str, str], float]]], kind: str = "gauge"):
+        super().__init__(name, documentation)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        return [(self.name, labels, value) for labels, value in self.fn()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                # 单个采集函数失败不影响其他指标
+                parts.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(parts) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "tss_callback_stage_seconds",
+    "Time spent in each stage of a /v2/check request",
+    labelnames=("stage",),
+))
+REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "tss_callback_requests_total",
+    "Handled /v2/check requests by request type and response status",
+    labelnames=("request_type", "status"),
+))
+
+
+# 当前请求各阶段的耗时（秒），collect_stages() 内才记录
+_REQUEST_STAGES: contextvars.ContextVar = contextvars.ContextVar("request_stages", default=None)
+
+
+class _StageTimer(_Timer):
+    __slots__ = ()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed, *self.labelvalues)
+        stages = _REQUEST_STAGES.get()
+        if stages is not None:
+            name = self.labelvalues[0]
+            stages[name] = stages.get(name, 0.0) + elapsed
+        return False
+
+
+def stage(name: str):
+    """Time a block of code as one pipeline stage"""
+    return _StageTimer(STAGE_SECONDS, (name,))
+
+
+@contextmanager
+def collect_stages():
+    """Collect the stage durations of the current request into the yielded dict"""
+    stages = {}
+    token = _REQUEST_STAGES.set(stages)
+    try:
+        yield stages
+    finally:
+        _REQUEST_STAGES.reset(token)
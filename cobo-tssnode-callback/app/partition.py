@@ -0,0 +1,75 @@
+"""
+Partitioned routing of transaction messages between the two services.
+
+The two copies (cobo-tssnode-callback/app/partition.py and
+cobo_api_callback_server/partition.py) must stay identical.
+
+The API callback server hashes a field of each transaction (``wallet_id`` by
+default) to one of ``count`` partitions and publishes it to a direct
+exchange with routing key ``p<n>``. Every partition has its own queue,
+``cobo.p<n>``, so messages wait in RabbitMQ until the TSS callback server
+that owns the partition consumes them. Each TSS callback server consumes only
+the partitions listed in its ``CONSUMER_PARTITIONS``.
+
+Partitions are assigned with jump consistent hashing, so growing ``count``
+moves only about 1/count of the keys.
+"""
+import hashlib
+import sys
+from typing import List
+
+EXCHANGE = "cobo.tx"
+QUEUE_PREFIX = "cobo"
+
+
+def key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+def partition_for(key: str, count: int) -> int:
+    """Jump consistent hash (Lamping & Veach) of ``key`` into ``count`` partitions"""
+    if count <= 0:
+        raise ValueError("partition count must be positive")
+    h = key_hash(key)
+    bucket, j = -1, 0
+    while j < count:
+        bucket = j
+        h = (h * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((h >> 33) + 1)))
+    return bucket
+
+
+def routing_key(partition: int) -> str:
+    return f"p{partition}"
+
+
+def queue_name(partition: int) -> str:
+    return f"{QUEUE_PREFIX}.{routing_key(partition)}"
+
+
+def parse_partitions(spec: str, count: int) -> List[int]:
+    """Parse ``"0-3,7"``; an empty spec means every partition"""
+    if not spec or not spec.strip():
+        return list(range(count))
+    partitions = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+            partitions.update(range(start, end + 1))
+        else:
+            partitions.add(int(part))
+    invalid = [p for p in partitions if not 0 <= p < count]
+    if invalid:
+        raise ValueError(f"partitions {sorted(invalid)} are outside 0-{count - 1}")
+    return sorted(partitions)
+
+
+if __name__ == "__main__":
+    # 查看 key 所在的分区：python -m app.partition 8 <wallet_id> ...
+    if len(sys.argv) < 3:
+        sys.exit("usage: partition.py <count> <key> [<key> ...]")
+    for arg in sys.argv[2:]:
+        print(f"{arg}\t{partition_for(arg, int(sys.argv[1]))}")
@@ -0,0 +1,329 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ANY = "*"
+
+
+@dataclass(frozen=True)
+class PolicyContext:
+    chain_id: str
+    wallet_id: str
+    token_id: Optional[str] = None
+    amount: Optional[Decimal] = None
+    destination: Optional[str] = None
+
+
+class SQLiteVelocityStore:
+    """Velocity sums shared by every worker process through a SQLite database
+
+    Each approved amount is one row, so the window is exact. ``PolicyEngine``
+    reads the totals and records the amounts inside one ``BEGIN IMMEDIATE``
+    transaction, which makes the check and the update atomic across processes.
+    """
+
+    # 两次清理窗口外数据之间的最小间隔（秒）
+    CLEANUP_INTERVAL = 60.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._last_cleanup = 0.0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS policy_velocity ("
+            "rule TEXT NOT NULL, wallet_id TEXT, token_id TEXT, "
+            "at REAL NOT NULL, expires_at REAL NOT NULL, amount TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS policy_velocity_key "
+            "ON policy_velocity (rule, wallet_id, token_id, at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS policy_velocity_expires_at ON policy_velocity (expires_at)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def total(self, rule: str, key: tuple, since: float) -> Decimal:
+        rows = self._conn().execute(
+            "SELECT amount FROM policy_velocity "
+            "WHERE rule = ? AND wallet_id IS ? AND token_id IS ? AND at > ?",
+            (rule, *key, since),
+        )
+        return sum((Decimal(amount) for (amount,) in rows), Decimal(0))
+
+    def add(self, rule: str, key: tuple, amount: Decimal, now: float, window: float):
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO policy_velocity (rule, wallet_id, token_id, at, expires_at, amount) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (rule, *key, now, now + window, str(amount)),
+        )
+        if abs(now - self._last_cleanup) >= self.CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            conn.execute("DELETE FROM policy_velocity WHERE expires_at < ?", (now,))
+
+
+class VelocityCounter:
+    """Sliding-window sum per key, kept in a small ring of time buckets
+
+    Each tracked key costs ``buckets`` slots and at most ``max_keys`` keys are
+    kept. A key is only dropped once its window has passed; while every
+    tracked key is still inside its window, ``can_track`` refuses new keys so
+    the caller fails closed instead of forgetting a wallet's volume.
+
+    With a ``store`` the sums live in the shared SQLite database instead, keyed
+    by the rule ``name``, and the limit holds across worker processes.
+    """
+
+    def __init__(self, limit: Decimal, window: float, buckets: int = 30, max_keys: int = 100000,
+                 store: Optional[SQLiteVelocityStore] = None, name: str = ""):
+        self.limit = limit
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self.max_keys = max_keys
+        self.store = store
+        self.name = name
+        # key -> (bucket 编号列表, 金额列表)
+        self._rings: "OrderedDict[tuple, Tuple[List[int], List[Decimal]]]" = OrderedDict()
+
+    def total(self, key: tuple, now: float) -> Decimal:
+        if self.store is not None:
+            return self.store.total(self.name, key, now - self.window)
+        ring = self._rings.get(key)
+        if ring is None:
+            return Decimal(0)
+        current = int(now / self.bucket_width)
+        oldest = current - self.buckets
+        ids, sums = ring
+        return sum((s for i, s in zip(ids, sums) if i > oldest), Decimal(0))
+
+    def can_track(self, key: tuple, now: float) -> bool:
+        """Whether ``add`` can record ``key`` without dropping a key still inside its window"""
+        if self.store is not None or key in self._rings or len(self._rings) < self.max_keys:
+            return True
+        # 按最近一次累加排序，最早的 key 已过窗口时才能淘汰
+        ids, _ = next(iter(self._rings.values()))
+        return max(ids) <= int(now / self.bucket_width) - self.buckets
+
+    def add(self, key: tuple, amount: Decimal, now: float):
+        if self.store is not None:
+            self.store.add(self.name, key, amount, now, self.window)
+            return
+        current = int(now / self.bucket_width)
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = ([-1] * self.buckets, [Decimal(0)] * self.buckets)
+            self._rings[key] = ring
+            if len(self._rings) > self.max_keys:
+                self._rings.popitem(last=False)
+        else:
+            self._rings.move_to_end(key)
+        ids, sums = ring
+        slot = current % self.buckets
+        if ids[slot] != current:
+            ids[slot] = current
+            sums[slot] = Decimal(0)
+        sums[slot] += amount
+
+    def __len__(self):
+        return len(self._rings)
+
+
+# 编译后的规则：返回违规原因，以及通过后需要累加的速率计数
+Check = Callable[[PolicyContext, float], Optional[str]]
+
+
+@dataclass
+class CompiledRule:
+    name: str
+    chain_id: str
+    wallet_id: str
+    token_ids: Optional[frozenset]
+    check: Check
+    velocity: Optional[VelocityCounter] = None
+
+    def applies_to(self, ctx: PolicyContext) -> bool:
+        return self.token_ids is None or ctx.token_id in self.token_ids
+
+
+def _compile_rule(spec: dict, store: Optional[SQLiteVelocityStore] = None) -> CompiledRule:
+    name = spec.get("name") or "unnamed"
+    token_ids = spec.get("token_id")
+    if isinstance(token_ids, str):
+        token_ids = [token_ids]
+    allow_unknown_amount = bool(spec.get("allow_unknown_amount", False))
+    checks: List[Check] = []
+
+    allowlist = spec.get("token_allowlist")
+    if allowlist is not None:
+        allowed = frozenset(allowlist)
+
+        def check_token(ctx, _now):
+            if ctx.token_id not in allowed:
+                return f"token {ctx.token_id} is not allowed"
+        checks.append(check_token)
+
+    def amount_of(ctx):
+        if ctx.amount is None and not allow_unknown_amount:
+            raise _Violation("transaction amount is unknown")
+        return ctx.amount or Decimal(0)
+
+    max_amount = spec.get("max_amount")
+    if max_amount is not None:
+        cap = Decimal(str(max_amount))
+
+        def check_cap(ctx, _now):
+            amount = amount_of(ctx)
+            if amount > cap:
+                return f"amount {amount} exceeds cap {cap}"
+        checks.append(check_cap)
+
+    velocity = None
+    velocity_spec = spec.get("velocity")
+    if velocity_spec is not None:
+        velocity = VelocityCounter(
+            Decimal(str(velocity_spec["max_amount"])),
+            float(velocity_spec.get("window_seconds", 3600)),
+            buckets=int(velocity_spec.get("buckets", 30)),
+            max_keys=int(velocity_spec.get("max_wallets", 100000)),
+            store=store,
+            name=name,
+        )
+        counter = velocity
+
+        def check_velocity(ctx, now):
+            amount = amount_of(ctx)
+            key = (ctx.wallet_id, ctx.token_id)
+            if not counter.can_track(key, now):
+                return f"velocity counter is full ({counter.max_keys} wallets inside the window)"
+            total = counter.total(key, now)
+            if total + amount > counter.limit:
+                return (f"amount {amount} would bring {ctx.token_id} volume to "
+                        f"{total + amount}, limit {counter.limit} per {counter.window:g}s")
+        checks.append(check_velocity)
+
+    checks = tuple(checks)
+
+    def check(ctx, now):
+        try:
+            for c in checks:
+                err = c(ctx, now)
+                if err:
+                    return err
+        except _Violation as e:
+            return str(e)
+        return None
+
+    return CompiledRule(
+        name=name,
+        chain_id=str(spec.get("chain_id", ANY)),
+        wallet_id=str(spec.get("wallet_id", ANY)),
+        token_ids=frozenset(token_ids) if token_ids else None,
+        check=check,
+        velocity=velocity,
+    )
+
+
+class _Violation(Exception):
+    pass
+
+
+class PolicyEngine:
+    """Evaluate keysign requests against rules compiled once from YAML
+
+    Rules are indexed by ``(chain_id, wallet_id)`` where either part may be
+    ``*``; the rule list for a concrete pair is resolved once and memoized.
+    Velocity counters are only updated when every matching rule passes.
+    With a ``store`` the velocity sums are shared by every worker process.
+    """
+
+    MAX_RESOLVED = 100000
+
+    def __init__(self, rules: List[CompiledRule], store: Optional[SQLiteVelocityStore] = None):
+        self.rules = rules
+        self.store = store
+        self._index: Dict[Tuple[str, str], List[CompiledRule]] = {}
+        for rule in rules:
+            self._index.setdefault((rule.chain_id, rule.wallet_id), []).append(rule)
+        self._resolved: Dict[Tuple[str, str], Tuple[CompiledRule, ...]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_specs(cls, specs: List[dict], store: Optional[SQLiteVelocityStore] = None) -> "PolicyEngine":
+        return cls([_compile_rule(spec, store) for spec in specs or []], store)
+
+    @classmethod
+    def from_yaml(cls, path: str, store: Optional[SQLiteVelocityStore] = None) -> "PolicyEngine":
+        with open(path, "r") as f:
+            config = yaml.safe_load(f) or {}
+        engine = cls.from_specs(config.get("policies", []), store)
+        logger.info(f"Loaded {len(engine.rules)} policies from {path}")
+        return engine
+
+    def rules_for(self, chain_id: str, wallet_id: str) -> Tuple[CompiledRule, ...]:
+        key = (chain_id, wallet_id)
+        rules = self._resolved.get(key)
+        if rules is None:
+            index = self._index
+            rules = tuple(
+                index.get((chain_id, wallet_id), [])
+                + index.get((chain_id, ANY), [])
+                + index.get((ANY, wallet_id), [])
+                + index.get((ANY, ANY), [])
+            )
+            if len(self._resolved) < self.MAX_RESOLVED:
+                self._resolved[key] = rules
+        return rules
+
+    def evaluate(self, ctx: PolicyContext, now: Optional[float] = None) -> Optional[str]:
+        """Return the first violation, or None and record the amount for velocity rules"""
+        rules = [r for r in self.rules_for(ctx.chain_id, ctx.wallet_id) if r.applies_to(ctx)]
+        if not rules:
+            return None
+        now = time.time() if now is None else now
+        # 共享计数时由数据库事务保证多个进程的检查和累加不会交错
+        with self._lock, (self.store.transaction() if self.store is not None else nullcontext()):
+            for rule in rules:
+                err = rule.check(ctx, now)
+                if err:
+                    return f"policy {rule.name}: {err}"
+            for rule in rules:
+                if rule.velocity is not None and ctx.amount is not None:
+                    rule.velocity.add((ctx.wallet_id, ctx.token_id), ctx.amount, now)
+        return None
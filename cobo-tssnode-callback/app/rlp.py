@@ -0,0 +1,199 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# ERC-20 transfer(address,uint256) 函数选择器
+ERC20_TRANSFER_SELECTOR = bytes.fromhex("a9059cbb")
+
+LEGACY_TX = 0
+ACCESS_LIST_TX = 1  # EIP-2930
+DYNAMIC_FEE_TX = 2  # EIP-1559
+
+
+class RLPDecodeError(ValueError):
+    pass
+
+
+# 一个 RLP 元素在缓冲区中的位置：(是否为列表, 负载起点, 负载终点)
+Span = Tuple[bool, int, int]
+
+
+def _read_item(buf: memoryview, pos: int, end: int) -> Tuple[Span, int]:
+    """Decode the item header at ``pos`` and return its span and the next position"""
+    if pos >= end:
+        raise RLPDecodeError("unexpected end of input")
+    prefix = buf[pos]
+    if prefix < 0x80:
+        return (False, pos, pos + 1), pos + 1
+    if prefix <= 0xB7:
+        start, length, is_list = pos + 1, prefix - 0x80, False
+        if length == 1 and start < end and buf[start] < 0x80:
+            raise RLPDecodeError("non-canonical single byte string")
+    elif prefix <= 0xBF:
+        start, is_list = _read_long_length(buf, pos, end, prefix - 0xB7), False
+        length = int.from_bytes(buf[pos + 1:start], "big")
+    elif prefix <= 0xF7:
+        start, length, is_list = pos + 1, prefix - 0xC0, True
+    else:
+        start, is_list = _read_long_length(buf, pos, end, prefix - 0xF7), True
+        length = int.from_bytes(buf[pos + 1:start], "big")
+
+    stop = start + length
+    if stop > end:
+        raise RLPDecodeError("item exceeds input length")
+    return (is_list, start, stop), stop
+
+
+def _read_long_length(buf: memoryview, pos: int, end: int, length_of_length: int) -> int:
+    start = pos + 1 + length_of_length
+    if start > end:
+        raise RLPDecodeError("length prefix exceeds input length")
+    if buf[pos + 1] == 0 or int.from_bytes(buf[pos + 1:start], "big") < 56:
+        raise RLPDecodeError("non-canonical length prefix")
+    return start
+
+
+def decode_list(buf: memoryview, span: Span) -> List[Span]:
+    """Return the spans of the direct children of a list item"""
+    is_list, pos, end = span
+    if not is_list:
+        raise RLPDecodeError("expected an RLP list")
+    items = []
+    while pos < end:
+        item, pos = _read_item(buf, pos, end)
+        items.append(item)
+    return items
+
+
+def decode_top_list(buf: memoryview, pos: int = 0) -> List[Span]:
+    span, stop = _read_item(buf, pos, len(buf))
+    if stop != len(buf):
+        raise RLPDecodeError("trailing bytes after RLP item")
+    return decode_list(buf, span)
+
+
+def _int(buf: memoryview, span: Span) -> int:
+    is_list, start, stop = span
+    if is_list:
+        raise RLPDecodeError("expected an RLP string")
+    if stop - start > 32:
+        raise RLPDecodeError("integer is longer than 32 bytes")
+    if stop > start and buf[start] == 0:
+        raise RLPDecodeError("integer has leading zero bytes")
+    return int.from_bytes(buf[start:stop], "big")
+
+
+def _address(buf: memoryview, span: Span) -> Optional[str]:
+    is_list, start, stop = span
+    if is_list or stop - start not in (0, 20):
+        raise RLPDecodeError("invalid address")
+    # 空地址表示合约创建
+    return "0x" + buf[start:stop].hex() if stop > start else None
+
+
+@dataclass(frozen=True)
+class EvmTransaction:
+    tx_type: int
+    chain_id: Optional[int]
+    nonce: int
+    to: Optional[str]
+    value: int
+    data: bytes
+    gas_limit: int
+    # legacy / EIP-2930 为 gasPrice，EIP-1559 为 maxFeePerGas
+    max_fee_per_gas: int
+    max_priority_fee_per_gas: Optional[int] = None
+
+    def is_erc20_transfer(self) -> bool:
+        return len(self.data) == 68 and self.data[:4] == ERC20_TRANSFER_SELECTOR
+
+    def transfer_recipient(self) -> Optional[str]:
+        """Native transfers pay ``to``; ERC-20 transfers pay the address in calldata"""
+        if self.is_erc20_transfer():
+            return "0x" + self.data[16:36].hex()
+        return self.to
+
+    def transfer_amount(self) -> int:
+        if self.is_erc20_transfer():
+            return int.from_bytes(self.data[36:68], "big")
+        return self.value
+
+
+# 各交易类型的字段位置：(chain_id, nonce, priority_fee, max_fee, gas_limit, to, value, data, 字段数)
+_LAYOUTS = {
+    ACCESS_LIST_TX: (0, 1, None, 2, 3, 4, 5, 6, 8),
+    DYNAMIC_FEE_TX: (0, 1, 2, 3, 4, 5, 6, 7, 9),
+}
+
+
+def decode_evm_transaction(raw: bytes) -> EvmTransaction:
+    """Decode an unsigned legacy, EIP-2930 or EIP-1559 transaction"""
+    buf = memoryview(raw)
+    if not buf:
+        raise RLPDecodeError("empty transaction")
+
+    first = buf[0]
+    if first >= 0xC0:
+        fields = decode_top_list(buf)
+        if len(fields) not in (6, 9):
+            raise RLPDecodeError(f"legacy transaction has {len(fields)} fields")
+        # EIP-155：未签名交易末尾为 (chainId, 0, 0)
+        chain_id = _int(buf, fields[6]) if len(fields) == 9 else None
+        return EvmTransaction(
+            tx_type=LEGACY_TX,
+            chain_id=chain_id,
+            nonce=_int(buf, fields[0]),
+            to=_address(buf, fields[3]),
+            value=_int(buf, fields[4]),
+            data=bytes(buf[fields[5][1]:fields[5][2]]),
+            gas_limit=_int(buf, fields[2]),
+            max_fee_per_gas=_int(buf, fields[1]),
+        )
+
+    layout = _LAYOUTS.get(first)
+    if layout is None:
+        raise RLPDecodeError(f"unsupported transaction type {first}")
+    chain_i, nonce_i, priority_i, max_fee_i, gas_i, to_i, value_i, data_i, count = layout
+    fields = decode_top_list(buf, 1)
+    if len(fields) != count:
+        raise RLPDecodeError(f"type {first} transaction has {len(fields)} fields")
+    data_span = fields[data_i]
+    return EvmTransaction(
+        tx_type=first,
+        chain_id=_int(buf, fields[chain_i]),
+        nonce=_int(buf, fields[nonce_i]),
+        to=_address(buf, fields[to_i]),
+        value=_int(buf, fields[value_i]),
+        data=bytes(buf[data_span[1]:data_span[2]]),
+        gas_limit=_int(buf, fields[gas_i]),
+        max_fee_per_gas=_int(buf, fields[max_fee_i]),
+        max_priority_fee_per_gas=_int(buf, fields[priority_i]) if priority_i is not None else None,
+    )
+
+
+class DecodedTransactionCache:
+    """LRU of decoded transactions keyed by message hash
+
+    Only use it after the payload has been checked against ``msg_hash``, so that
+    the hash really identifies the payload.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_decode(self, msg_hash: str, raw_tx: str) -> EvmTransaction:
+        with self._lock:
+            decoded = self._items.get(msg_hash)
+            if decoded is not None:
+                self._items.move_to_end(msg_hash)
+                return decoded
+
+        decoded = decode_evm_transaction(bytes.fromhex(raw_tx))
+        with self._lock:
+            self._items[msg_hash] = decoded
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return decoded
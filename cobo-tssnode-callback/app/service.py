@@ -1,14 +1,15 @@
 import base64
 import json
 import logging
+import time
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 
 import jwt
-from flask import current_app, g, jsonify, request
+from flask import Response, current_app, g, jsonify, request
 
+from app import audit, jsonlog, metrics, snapshot
 from app.types import PackageDataClaim, Status
-from app.utils import load_keys
 from app.verify import TssVerifier
 
 import cobo_waas2
@@ -22,17 +23,16 @@ def init_app(server, config):
     server.config.update(
         SERVICE_NAME=config.service_name,
         ENDPOINT=config.endpoint,
-        TOKEN_EXPIRE_MINUTES=config.token_expire_minutes,
         ENABLE_DEBUG=config.enable_debug,
     )
 
-    # Load keys
+    # The key pair and token expiry are read from the current config snapshot on
+    # every request (see token_settings), so a config reload applies without a restart
     try:
-        client_public_key, service_private_key = load_keys(
-            config.client_public_key_path, config.service_private_key_path
-        )
-        server.config["CLIENT_PUBLIC_KEY"] = client_public_key
-        server.config["SERVICE_PRIVATE_KEY"] = service_private_key
+        current = snapshot.current()
+        if current.key_manager is None or current.config != config:
+            snapshot.load(current.env_file, config)
+        server.config["CONFIG_SNAPSHOT"] = snapshot.current
 
         logger.info(f"Init server: {server.config['SERVICE_NAME']}")
     except Exception as e:
@@ -49,35 +49,53 @@ def init_app(server, config):
         }
         return jsonify(response)
 
+    @server.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        """Prometheus scrape endpoint; values are per worker process"""
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
     @server.route("/v2/check", methods=["POST"])
     @jwt_required
     def risk_control():
         """Risk control endpoint with JWT verification"""
         try:
             # Get raw request from JWT payload
-            raw_request = get_raw_request()
+            with metrics.stage("parse_request"):
+                raw_request = get_raw_request()
             if not raw_request:
                 response = cobo_waas2.TSSCallbackResponse(
                     status=Status.INVALID_REQUEST, error="Invalid request data"
                 )
+                metrics.REQUESTS_TOTAL.inc("UNKNOWN", response.status)
                 return create_response(server, response, 200)
 
             # Process the request
-            response = process_request(raw_request)
+            with metrics.stage("process_request"):
+                response = process_request(raw_request)
             if not response:
                 response = cobo_waas2.TSSCallbackResponse(
                     status=Status.INTERNAL_ERROR, error="Failed to process request"
                 )
+                metrics.REQUESTS_TOTAL.inc(request_type_name(raw_request), response.status)
                 return create_response(server, response, 400)
-
+            metrics.REQUESTS_TOTAL.inc(request_type_name(raw_request), response.status)
             return create_response(server, response, 200)
 
         except Exception as e:
             logger.error(f"Risk control error: {str(e)}")
             response = cobo_waas2.TSSCallbackResponse(status=Status.INVALID_REQUEST, error=str(e))
+            metrics.REQUESTS_TOTAL.inc("UNKNOWN", response.status)
             return create_response(server, response, 200)
 
 
+def request_type_name(req: cobo_waas2.TSSCallbackRequest) -> str:
+    """Metric label for the request type; unknown values share one label"""
+    try:
+        return cobo_waas2.TSSCallbackRequestType(req.request_type).name
+    except ValueError:
+        return "UNKNOWN"
+
+
 def get_raw_request():
     """Get raw request data from JWT payload"""
     try:
@@ -104,35 +122,60 @@ def process_request(req: cobo_waas2.TSSCallbackRequest) -> cobo_waas2.TSSCallbac
     """Process request with TSS verifier"""
     verifier = TssVerifier.new()
 
-    err = verifier.verify(req)
+    start = time.perf_counter()
+    with jsonlog.request_context(req.request_id), metrics.collect_stages() as stages:
+        with audit.annotations() as fields:
+            err = verifier.verify(req)
     if err:
-        return cobo_waas2.TSSCallbackResponse(
+        response = cobo_waas2.TSSCallbackResponse(
             status=Status.INTERNAL_ERROR,
             request_id=req.request_id,
             action=cobo_waas2.TSSCallbackActionType.REJECT,
             error=err,
         )
+    else:
+        response = cobo_waas2.TSSCallbackResponse(status=Status.OK, request_id=req.request_id, action=cobo_waas2.TSSCallbackActionType.APPROVE)
+
+    # 审计记录只放入内存缓冲，由后台线程批量写入
+    audit.record(
+        req.request_id, request_type_name(req), response.action.value, response.status,
+        err, time.perf_counter() - start, stages, **fields,
+    )
+    return response
 
-    return cobo_waas2.TSSCallbackResponse(status=Status.OK, request_id=req.request_id, action=cobo_waas2.TSSCallbackActionType.APPROVE)
+
+def token_settings(server):
+    """(client public key, service private key, token expiry in minutes)
+
+    Taken from the config snapshot when the app was set up by ``init_app``,
+    otherwise from ``server.config``.
+    """
+    get_snapshot = server.config.get("CONFIG_SNAPSHOT")
+    if get_snapshot is not None:
+        current = get_snapshot()
+        return (current.key_manager.client_public_key, current.key_manager.service_private_key,
+                current.config.token_expire_minutes)
+    return (server.config["CLIENT_PUBLIC_KEY"], server.config["SERVICE_PRIVATE_KEY"],
+            server.config["TOKEN_EXPIRE_MINUTES"])
 
 
 def create_token(server, data):
     """Create a JWT token with the given data"""
     try:
+        _, private_key, expire_minutes = token_settings(server)
         with server.app_context():
-            expiration_time = datetime.now(timezone.utc) + timedelta(
-                minutes=server.config["TOKEN_EXPIRE_MINUTES"]
-            )
+            expiration_time = datetime.now(timezone.utc) + timedelta(minutes=expire_minutes)
             claim = PackageDataClaim(
                 package_data=base64.b64encode(data.encode()).decode(),
                 exp=int(expiration_time.timestamp()),
                 iss=server.config["SERVICE_NAME"],
             )
 
-            token = jwt.encode(
-                claim.to_dict(), server.config["SERVICE_PRIVATE_KEY"], algorithm="RS256"
-            )
-            return token
+            with metrics.stage("create_token"):
+                token = jwt.encode(
+                    claim.to_dict(), private_key, algorithm="RS256"
+                )
+        return token
     except Exception as e:
         logger.error(f"Failed to create token: {str(e)}")
         raise
@@ -145,9 +188,7 @@ def verify_token(server):
         raise jwt.InvalidTokenError("Token not found")
 
     try:
-        payload = jwt.decode(
-            token, server.config["CLIENT_PUBLIC_KEY"], algorithms=["RS256"]
-        )
+        payload = jwt.decode(token, token_settings(server)[0], algorithms=["RS256"])
         package_data = base64.b64decode(payload.get("package_data", "")).decode()
         g.request_data = package_data
         return payload
@@ -162,12 +203,15 @@ def verify_token(server):
 def jwt_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        try:
-            verify_token(current_app)
-        except jwt.InvalidTokenError as e:
-            response = cobo_waas2.TSSCallbackResponse(status=Status.INVALID_TOKEN, error=str(e))
-            return create_response(current_app, response)
-        return f(*args, **kwargs)
+        with metrics.stage("request"):
+            try:
+                with metrics.stage("verify_token"):
+                    verify_token(current_app)
+            except jwt.InvalidTokenError as e:
+                response = cobo_waas2.TSSCallbackResponse(status=Status.INVALID_TOKEN, error=str(e))
+                metrics.REQUESTS_TOTAL.inc("UNKNOWN", response.status)
+                return create_response(current_app, response)
+            return f(*args, **kwargs)
 
     return decorated
 
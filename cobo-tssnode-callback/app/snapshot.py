@@ -0,0 +1,276 @@
+"""
+Hot-reloadable settings of the TSS callback server.
+
+The settings a request depends on are held in an immutable ``Snapshot``. It holds:
+
+- the chain sets, chain ids, token decimals, contracts and mints from ``.env``
+- the address list paths from ``.env``
+- the key pair and token expiry from the YAML config
+- the risk policy
+
+A request reads ``current()`` once and uses that snapshot to the end.
+
+``ConfigWatcher`` checks the source files from a background thread. When one of
+them changes, it builds a new snapshot off the request path and installs it
+with a single assignment. In-flight requests keep the snapshot they started
+with. If building fails, the error is logged and the previous snapshot stays.
+
+Not reloaded: the endpoint, the cache, RabbitMQ and direct socket settings, and
+the log settings. Those still need a restart.
+"""
+import logging
+import os
+import threading
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import FrozenSet, Mapping, Optional, Tuple
+
+import dotenv
+
+from app.address_index import AddressList, open_address_list
+from app.cache import CacheSettings
+from app.config import ServiceConfig, read_yaml_config
+from app.keys import KeyManager
+from app.policy import PolicyEngine, SQLiteVelocityStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 文件标识：(inode, mtime, size)，文件不存在时为 None
+Stamp = Optional[Tuple[int, int, int]]
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    env_file: str = ".env"
+    # 未加载 YAML 配置（只用于校验）时为 None
+    config: Optional[ServiceConfig] = None
+    evm_chains: FrozenSet[str] = frozenset()
+    solana_chains: FrozenSet[str] = frozenset()
+    # EVM 链名称到 EIP-155 chainId 的映射，如 ETH:1,SETH:11155111
+    evm_chain_ids: Mapping[str, int] = field(default_factory=lambda: MappingProxyType({}))
+    # 非原生代币的精度，如 ETH_USDT:6
+    token_decimals: Mapping[str, int] = field(default_factory=lambda: MappingProxyType({}))
+    # 非原生代币的合约地址（小写），如 ETH_USDT:0xdac17f958d2ee523a2206206994597c13d831ec7
+    token_contracts: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+    # SPL 代币的 mint 地址，如 SOL_USDC:EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v
+    token_mints: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+    policy: Optional[PolicyEngine] = None
+    address_allowlist: Optional[AddressList] = None
+    address_denylist: Optional[AddressList] = None
+    key_manager: Optional[KeyManager] = None
+    # 检查配置文件变化的间隔（秒），0 表示不重新加载
+    reload_interval: float = 5.0
+    version: int = 0
+    # 构建快照时读取的文件及其标识，任一文件变化后重新构建
+    stamps: Tuple[Tuple[str, Stamp], ...] = ()
+
+    def changed_files(self):
+        return [path for path, stamp in self.stamps if file_stamp(path) != stamp]
+
+
+def file_stamp(path: str) -> Stamp:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _chain_set(value) -> FrozenSet[str]:
+    return frozenset(chain.strip() for chain in (value or "").split(",") if chain.strip())
+
+
+def _int_map(value) -> Mapping[str, int]:
+    result = {}
+    for item in (value or "").split(","):
+        if ":" in item:
+            key, number = item.split(":", 1)
+            result[key.strip()] = int(number)
+    return MappingProxyType(result)
+
+
+def _str_map(value, convert=str) -> Mapping[str, str]:
+    result = {}
+    for item in (value or "").split(","):
+        if ":" in item:
+            key, address = item.split(":", 1)
+            result[key.strip()] = convert(address.strip())
+    return MappingProxyType(result)
+
+
+def build(env_file: str = ".env", config: Optional[ServiceConfig] = None,
+          previous: Optional[Snapshot] = None) -> Snapshot:
+    """Read every source file and build a snapshot; raises if any of them is invalid
+
+    With ``config.config_path`` set the YAML file is read again. Without it,
+    ``config`` is used as given.
+    """
+    # 先记录文件标识再读取，读取期间文件再次变化时下一次检查会重新构建
+    watched = [env_file]
+    if config is not None and config.config_path:
+        watched.append(config.config_path)
+    stamps = {path: file_stamp(path) for path in watched}
+    if config is not None and config.config_path:
+        config = read_yaml_config(config.config_path)
+
+    values = dotenv.dotenv_values(env_file) if os.path.exists(env_file) else {}
+
+    key_manager = policy = None
+    if config is not None:
+        for path in (config.client_public_key_path, config.service_private_key_path, config.policy_path):
+            stamps[path] = file_stamp(path)
+        key_manager = KeyManager.from_files(config.client_public_key_path, config.service_private_key_path)
+        if config.policy_path and os.path.exists(config.policy_path):
+            policy = _policy(config.policy_path, stamps[config.policy_path], previous, values)
+
+    return Snapshot(
+        env_file=env_file,
+        config=config,
+        evm_chains=_chain_set(values.get("EVM_CHAINS")),
+        solana_chains=_chain_set(values.get("SOLANA_CHAINS")),
+        evm_chain_ids=_int_map(values.get("EVM_CHAIN_IDS")),
+        token_decimals=_int_map(values.get("TOKEN_DECIMALS")),
+        token_contracts=_str_map(values.get("TOKEN_CONTRACTS"), str.lower),
+        token_mints=_str_map(values.get("TOKEN_MINTS")),
+        policy=policy,
+        address_allowlist=_address_list(values.get("ADDRESS_ALLOWLIST_PATH"), previous, "address_allowlist"),
+        address_denylist=_address_list(values.get("ADDRESS_DENYLIST_PATH"), previous, "address_denylist"),
+        key_manager=key_manager,
+        reload_interval=float(values.get("CONFIG_RELOAD_INTERVAL") or 5),
+        version=previous.version + 1 if previous is not None else 0,
+        stamps=tuple(stamps.items()),
+    )
+
+
+def _policy(path: str, stamp: Stamp, previous: Optional[Snapshot], values: Mapping) -> PolicyEngine:
+    # 策略文件未变化时沿用原来的策略，保留滑动窗口中的累计金额
+    if previous is not None and previous.policy is not None and (path, stamp) in previous.stamps:
+        return previous.policy
+    return PolicyEngine.from_yaml(path, _velocity_store(values, previous))
+
+
+def _velocity_store(values: Mapping, previous: Optional[Snapshot]) -> Optional[SQLiteVelocityStore]:
+    # 共享缓存时累计金额也保存在同一个 SQLite 文件中，多个 worker 共用一份计数
+    if values.get("CACHE_BACKEND") != "sqlite":
+        return None
+    path = values.get("CACHE_SQLITE_PATH") or CacheSettings.sqlite_path
+    store = previous.policy.store if previous is not None and previous.policy is not None else None
+    if store is not None and store.path == path:
+        return store
+    return SQLiteVelocityStore(path)
+
+
+def _address_list(path, previous: Optional[Snapshot], name: str) -> Optional[AddressList]:
+    # 路径不变时沿用已打开的索引，索引文件本身的更新由 AddressList 自行加载
+    current = getattr(previous, name, None) if previous is not None else None
+    if current is not None and path and current.path == path:
+        return current
+    return open_address_list(path)
+
+
+_current: Optional[Snapshot] = None
+_reload_lock = threading.Lock()
+
+
+def current() -> Snapshot:
+    """The snapshot for this request; built from ``.env`` on first use if none is installed"""
+    snapshot = _current
+    if snapshot is None:
+        with _reload_lock:
+            if _current is None:
+                install(build())
+            snapshot = _current
+    return snapshot
+
+
+def install(snapshot: Snapshot):
+    global _current
+    _current = snapshot
+
+
+def load(env_file: str = ".env", config: Optional[ServiceConfig] = None) -> Snapshot:
+    """Build and install the first snapshot; errors propagate so startup fails"""
+    with _reload_lock:
+        install(build(env_file, config))
+    logger.info(f"Loaded config version {_current.version} from {[path for path, _ in _current.stamps]}")
+    return _current
+
+
+def reload(force: bool = False) -> bool:
+    """Rebuild the snapshot when its files changed; returns whether a new one was installed"""
+    # 已有线程在重新加载时直接返回，请求线程不会在这里等待
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    try:
+        previous = _current
+        if previous is None:
+            return False
+        changed = previous.changed_files()
+        if not changed and not force:
+            return False
+        try:
+            snapshot = build(previous.env_file, previous.config, previous)
+        except Exception as e:
+            logger.error(f"Failed to reload config after {changed} changed, keeping version {previous.version}: {e!r}")
+            # 记下失败时的文件标识，文件再次变化前不重复尝试
+            install(_restamp(previous))
+            return False
+        install(snapshot)
+        logger.info(f"Reloaded config version {snapshot.version} after {changed} changed")
+        return True
+    finally:
+        _reload_lock.release()
+
+
+def _restamp(snapshot: Snapshot) -> Snapshot:
+    return replace(snapshot, stamps=tuple((path, file_stamp(path)) for path, _ in snapshot.stamps))
+
+
+class ConfigWatcher:
+    """Background thread that calls ``reload()`` every ``interval`` seconds"""
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                reload()
+            except Exception as e:
+                logger.error(f"Config watcher error: {e!r}")
+
+
+_watcher: Optional[ConfigWatcher] = None
+
+
+def start_watcher(interval: Optional[float] = None):
+    """Start watching the config files in this process; ``reload_interval`` 0 disables reloading"""
+    global _watcher
+    if interval is None:
+        interval = current().reload_interval
+    if interval <= 0 or _watcher is not None:
+        return
+    _watcher = ConfigWatcher(interval)
+    _watcher.start()
+
+
+def stop_watcher():
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
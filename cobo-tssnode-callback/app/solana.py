@@ -0,0 +1,319 @@
+import hashlib
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+B58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+SYSTEM_PROGRAM_ID = bytes(32)
+TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+TOKEN_2022_PROGRAM_ID = "TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb"
+ASSOCIATED_TOKEN_PROGRAM_ID = "ATokenGPvbdGVxr1b2hvZbsiqW5xWH25efTNsLJA8knL"
+COMPUTE_BUDGET_PROGRAM_ID = "ComputeBudget111111111111111111111111111111"
+MEMO_PROGRAM_IDS = ("MemoSq4gqABAXKb96qnH8TysNcWxMyWCqXgDLGmfcHr", "Memo1UhkJRfHyvLMcVucJwxXeuD728EqVDDwQDxFMNo")
+
+SYSTEM_TRANSFER = 2
+SYSTEM_ADVANCE_NONCE = 4
+SPL_TRANSFER = 3
+SPL_TRANSFER_CHECKED = 12
+# Create 和 CreateIdempotent；RecoverNested 会转移代币，不在其中
+ATA_CREATE_TAGS = (0, 1)
+
+SIGNATURE_LENGTH = 64
+PUBKEY_LENGTH = 32
+
+
+class SolanaParseError(ValueError):
+    pass
+
+
+def b58encode(data: bytes) -> str:
+    number = int.from_bytes(data, "big")
+    chars = []
+    while number:
+        number, rem = divmod(number, 58)
+        chars.append(B58_ALPHABET[rem])
+    leading_zeros = len(data) - len(data.lstrip(b"\0"))
+    return "1" * leading_zeros + "".join(reversed(chars))
+
+
+def b58decode(text: str) -> bytes:
+    number = 0
+    for char in text:
+        index = B58_ALPHABET.find(char)
+        if index < 0:
+            raise ValueError(f"invalid base58 character {char!r}")
+        number = number * 58 + index
+    leading_zeros = len(text) - len(text.lstrip("1"))
+    body = number.to_bytes((number.bit_length() + 7) // 8, "big") if number else b""
+    return b"\0" * leading_zeros + body
+
+
+_TOKEN_PROGRAM_IDS = (b58decode(TOKEN_PROGRAM_ID), b58decode(TOKEN_2022_PROGRAM_ID))
+_ASSOCIATED_TOKEN_PROGRAM_ID = b58decode(ASSOCIATED_TOKEN_PROGRAM_ID)
+_COMPUTE_BUDGET_PROGRAM_ID = b58decode(COMPUTE_BUDGET_PROGRAM_ID)
+_MEMO_PROGRAM_IDS = tuple(b58decode(program_id) for program_id in MEMO_PROGRAM_IDS)
+
+# Ed25519 曲线参数，用于判断程序派生地址是否落在曲线外
+_P = 2 ** 255 - 19
+_D = -121665 * pow(121666, _P - 2, _P) % _P
+
+
+def is_on_curve(key: bytes) -> bool:
+    """Whether ``key`` decompresses to an Ed25519 point, i.e. could have a private key"""
+    y = (int.from_bytes(key, "little") & ((1 << 255) - 1)) % _P
+    y2 = y * y % _P
+    # x^2 = (y^2 - 1) / (d * y^2 + 1)，有平方根时为曲线上的点
+    x2 = (y2 - 1) * pow(_D * y2 + 1, _P - 2, _P) % _P
+    return x2 == 0 or pow(x2, (_P - 1) // 2, _P) == 1
+
+
+def find_program_address(seeds: List[bytes], program_id: bytes) -> bytes:
+    for bump in range(255, -1, -1):
+        candidate = hashlib.sha256(b"".join(seeds) + bytes([bump]) + program_id + b"ProgramDerivedAddress").digest()
+        if not is_on_curve(candidate):
+            return candidate
+    raise ValueError("no program address found")
+
+
+def associated_token_address(owner: bytes, mint: bytes, token_program_id: bytes) -> bytes:
+    return find_program_address([owner, token_program_id, mint], _ASSOCIATED_TOKEN_PROGRAM_ID)
+
+
+@dataclass(frozen=True)
+class Instruction:
+    program_id_index: int
+    accounts: bytes
+    # (起点, 终点)，指向消息缓冲区中的指令数据
+    data_span: Tuple[int, int]
+
+
+@dataclass(frozen=True)
+class Transfer:
+    kind: str  # "system" 或 "spl"
+    # 账户为 32 字节公钥，地址查找表中的账户为 None
+    source: Optional[bytes]
+    destination: Optional[bytes]
+    amount: int
+    mint: Optional[bytes] = None
+    decimals: Optional[int] = None
+    program_id: Optional[bytes] = None
+
+    @property
+    def destination_address(self) -> Optional[str]:
+        return b58encode(self.destination) if self.destination is not None else None
+
+
+@dataclass(frozen=True)
+class SolanaMessage:
+    raw: bytes
+    version: Optional[int]  # None 表示 legacy 消息
+    num_required_signatures: int
+    account_keys: List[bytes]
+    recent_blockhash: bytes
+    instructions: List[Instruction]
+    # v0 消息通过地址查找表引用的账户数量，这些账户无法在本地解析
+    lookup_account_count: int = 0
+
+    def account(self, index: int) -> Optional[bytes]:
+        if index < len(self.account_keys):
+            return self.account_keys[index]
+        return None
+
+    def transfers(self) -> List[Transfer]:
+        """Decode System and SPL-Token transfer instructions"""
+        result = []
+        for ix in self.instructions:
+            transfer = self.transfer(ix)
+            if transfer is not None:
+                result.append(transfer)
+        return result
+
+    def transfer(self, ix: Instruction) -> Optional[Transfer]:
+        program_id = self.account(ix.program_id_index)
+        data = self.data(ix)
+        if program_id == SYSTEM_PROGRAM_ID:
+            if len(data) == 12 and int.from_bytes(data[:4], "little") == SYSTEM_TRANSFER:
+                return Transfer(
+                    kind="system",
+                    source=self._account_name(ix, 0),
+                    destination=self._account_name(ix, 1),
+                    amount=int.from_bytes(data[4:12], "little"),
+                    program_id=program_id,
+                )
+        elif program_id in _TOKEN_PROGRAM_IDS and len(data) >= 9:
+            tag = data[0]
+            if tag == SPL_TRANSFER and len(data) == 9:
+                return Transfer(
+                    kind="spl",
+                    source=self._account_name(ix, 0),
+                    destination=self._account_name(ix, 1),
+                    amount=int.from_bytes(data[1:9], "little"),
+                    program_id=program_id,
+                )
+            if tag == SPL_TRANSFER_CHECKED and len(data) == 10:
+                return Transfer(
+                    kind="spl",
+                    source=self._account_name(ix, 0),
+                    destination=self._account_name(ix, 2),
+                    amount=int.from_bytes(data[1:9], "little"),
+                    mint=self._account_name(ix, 1),
+                    decimals=data[9],
+                    program_id=program_id,
+                )
+        return None
+
+    def data(self, ix: Instruction) -> memoryview:
+        return memoryview(self.raw)[ix.data_span[0]:ix.data_span[1]]
+
+    def is_auxiliary(self, ix: Instruction) -> bool:
+        """Compute budget, memo and nonce advance instructions, which move no funds"""
+        program_id = self.account(ix.program_id_index)
+        if program_id == _COMPUTE_BUDGET_PROGRAM_ID or program_id in _MEMO_PROGRAM_IDS:
+            return True
+        data = self.data(ix)
+        return (program_id == SYSTEM_PROGRAM_ID and len(data) == 4
+                and int.from_bytes(data, "little") == SYSTEM_ADVANCE_NONCE)
+
+    def associated_account_creation(self, ix: Instruction) -> Optional[Tuple[bytes, bytes, bytes]]:
+        """(token account, owner, mint) of an associated token account creation, else None
+
+        The associated token program checks that the token account is derived
+        from the owner and the mint, so the pairing can be trusted.
+        """
+        if self.account(ix.program_id_index) != _ASSOCIATED_TOKEN_PROGRAM_ID:
+            return None
+        data = self.data(ix)
+        if len(data) > 1 or (len(data) == 1 and data[0] not in ATA_CREATE_TAGS):
+            return None
+        # 账户顺序：付款账户、代币账户、所有者、mint、System 程序、Token 程序
+        accounts = [self._account_name(ix, i) for i in range(1, 4)]
+        if any(account is None for account in accounts):
+            return None
+        return tuple(accounts)
+
+    def _account_name(self, ix: Instruction, position: int) -> Optional[bytes]:
+        if position >= len(ix.accounts):
+            return None
+        return self.account(ix.accounts[position])
+
+
+class _Reader:
+    __slots__ = ("buf", "pos")
+
+    def __init__(self, buf: memoryview, pos: int = 0):
+        self.buf = buf
+        self.pos = pos
+
+    def u8(self) -> int:
+        if self.pos >= len(self.buf):
+            raise SolanaParseError("unexpected end of message")
+        value = self.buf[self.pos]
+        self.pos += 1
+        return value
+
+    def compact_u16(self) -> int:
+        value = 0
+        for shift in (0, 7, 14):
+            byte = self.u8()
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                if byte == 0 and shift:
+                    raise SolanaParseError("non-canonical compact-u16")
+                return value
+        raise SolanaParseError("compact-u16 is too long")
+
+    def take(self, length: int) -> Tuple[int, int]:
+        start, stop = self.pos, self.pos + length
+        if stop > len(self.buf):
+            raise SolanaParseError("unexpected end of message")
+        self.pos = stop
+        return start, stop
+
+
+def parse_message(raw: bytes) -> SolanaMessage:
+    """Parse a legacy or v0 Solana message; the whole buffer must be consumed"""
+    buf = memoryview(raw)
+    reader = _Reader(buf)
+
+    version = None
+    first = reader.u8()
+    if first & 0x80:
+        version = first & 0x7F
+        if version != 0:
+            raise SolanaParseError(f"unsupported message version {version}")
+        first = reader.u8()
+    num_required_signatures = first
+    reader.u8()  # num_readonly_signed_accounts
+    reader.u8()  # num_readonly_unsigned_accounts
+
+    key_count = reader.compact_u16()
+    keys_start, _ = reader.take(key_count * PUBKEY_LENGTH)
+    account_keys = [
+        bytes(buf[keys_start + i * PUBKEY_LENGTH:keys_start + (i + 1) * PUBKEY_LENGTH])
+        for i in range(key_count)
+    ]
+    if num_required_signatures == 0 or num_required_signatures > key_count:
+        raise SolanaParseError("invalid message header")
+    blockhash_start, blockhash_stop = reader.take(PUBKEY_LENGTH)
+
+    instructions = []
+    for _ in range(reader.compact_u16()):
+        program_id_index = reader.u8()
+        accounts_start, accounts_stop = reader.take(reader.compact_u16())
+        data_span = reader.take(reader.compact_u16())
+        instructions.append(Instruction(
+            program_id_index, bytes(buf[accounts_start:accounts_stop]), data_span
+        ))
+
+    lookup_account_count = 0
+    if version is not None:
+        for _ in range(reader.compact_u16()):
+            reader.take(PUBKEY_LENGTH)
+            for _ in range(2):  # writable / readonly 索引
+                count = reader.compact_u16()
+                reader.take(count)
+                lookup_account_count += count
+
+    if reader.pos != len(buf):
+        raise SolanaParseError("trailing bytes after message")
+    total_accounts = key_count + lookup_account_count
+    for ix in instructions:
+        if ix.program_id_index >= key_count or any(a >= total_accounts for a in ix.accounts):
+            raise SolanaParseError("instruction account index out of range")
+
+    return SolanaMessage(
+        raw=raw,
+        version=version,
+        num_required_signatures=num_required_signatures,
+        account_keys=account_keys,
+        recent_blockhash=bytes(buf[blockhash_start:blockhash_stop]),
+        instructions=instructions,
+        lookup_account_count=lookup_account_count,
+    )
+
+
+def extract_message(raw: bytes) -> bytes:
+    """Return the message bytes from either a bare message or a serialized transaction"""
+    try:
+        parse_message(raw)
+        return raw
+    except SolanaParseError:
+        pass
+    reader = _Reader(memoryview(raw))
+    signature_count = reader.compact_u16()
+    _, message_start = reader.take(signature_count * SIGNATURE_LENGTH)
+    message = raw[message_start:]
+    parse_message(message)
+    return message
+
+
+def message_matches_hash(message: bytes, msg_hash: str) -> bool:
+    """Ed25519 signs the message itself; accept the message bytes or their SHA-256"""
+    expected = msg_hash[2:] if msg_hash.startswith("0x") else msg_hash
+    try:
+        expected_bytes = bytes.fromhex(expected)
+    except ValueError:
+        return False
+    if expected_bytes == message:
+        return True
+    return expected_bytes == hashlib.sha256(message).digest()
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class TTLCache:
+    """Thread-safe, size-bounded cache with a single TTL for every entry
+
+    Because every entry lives for the same TTL, insertion order is also expiry
+    order. Entries are kept in an OrderedDict and expired entries are popped
+    from the front, so cleanup is amortized O(1) per insert instead of a full
+    scan. Re-inserting a key moves it to the back with a fresh expiry.
+
+    When the cache is full, the entry closest to expiry (the oldest one) is
+    evicted to make room for the new one.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_size: int = 100000,
+        on_expire: Optional[Callable[[Any], None]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.ttl = ttl
+        self.max_size = max_size
+        self._on_expire = on_expire
+        self._clock = clock
+        self._entries: "OrderedDict[Any, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def set(self, key, value, timestamp: Optional[float] = None):
+        """Insert or replace an entry; ``timestamp`` defaults to now"""
+        now = self._clock()
+        expires_at = (now if timestamp is None else timestamp) + self.ttl
+        with self._lock:
+            self._expire_locked(now)
+            if key in self._entries:
+                del self._entries[key]
+            elif len(self._entries) >= self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._entries[key] = _Entry(value, expires_at)
+
+    def get(self, key, default=None):
+        """Return a live entry without removing it"""
+        return self._lookup(key, default, remove=False)
+
+    def pop(self, key, default=None, count: bool = True):
+        """Return a live entry and remove it; ``count=False`` leaves hits and misses alone"""
+        return self._lookup(key, default, remove=True, count=count)
+
+    def expire(self) -> int:
+        """Drop expired entries and return how many were removed"""
+        with self._lock:
+            return self._expire_locked(self._clock())
+
+    def items(self) -> List[Tuple[Any, Any, float]]:
+        """Snapshot of live entries as (key, value, expires_at), oldest first"""
+        now = self._clock()
+        # 锁内只复制字典；逐条生成元组会分配大量对象并可能触发 GC，放在锁外进行
+        with self._lock:
+            entries = self._entries.copy()
+        return [
+            (key, entry.value, entry.expires_at)
+            for key, entry in entries.items()
+            if entry.expires_at >= now
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key, default, remove: bool, count: bool = True):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += count
+                return default
+            if entry.expires_at < now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += count
+                expired = True
+            else:
+                if remove:
+                    del self._entries[key]
+                self.hits += count
+                expired = False
+        if expired:
+            self._notify_expired(key)
+            return default
+        return entry.value
+
+    def _expire_locked(self, now: float) -> int:
+        removed = 0
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry.expires_at >= now:
+                break
+            del entries[key]
+            removed += 1
+            self._notify_expired(key)
+        self.expirations += removed
+        return removed
+
+    def _notify_expired(self, key):
+        if self._on_expire is not None:
+            self._on_expire(key)
@@ -1,48 +1,68 @@
 from cobo_waas2 import TSSKeySignRequest, TSSKeySignExtra
+import base64
+import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from decimal import Decimal, InvalidOperation
 from eth_utils import keccak
-import dotenv
+from app import metrics
 from app.cache import get_transaction
-
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('logs/validator.log'),
-        logging.StreamHandler()
-    ]
+from app.policy import PolicyContext, PolicyEngine
+from app.rlp import DYNAMIC_FEE_TX, DecodedTransactionCache, RLPDecodeError
+from app.snapshot import Snapshot, current
+from app.solana import (
+    SolanaParseError,
+    associated_token_address,
+    b58decode,
+    b58encode,
+    extract_message,
+    message_matches_hash,
+    parse_message,
 )
+
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-dotenv.load_dotenv()
+# EVM 原生代币固定为 18 位精度，其他代币的精度见 .env 中的 TOKEN_DECIMALS
+NATIVE_DECIMALS = 18
+SOLANA_NATIVE_DECIMALS = 9
+
+# 批量签名时消息数量超过该值才使用线程池分块计算哈希
+BATCH_PARALLEL_THRESHOLD = 16
+BATCH_CHUNK_SIZE = 8
+BATCH_WORKERS = 4
+# 单个 keysign 请求哈希校验的时间预算（秒）
+KEYSIGN_TIME_BUDGET = 2.0
 
-EVM_ID = dotenv.get_key(".env", "EVM_CHAINS")
-EVM_ID = [chain.strip() for chain in EVM_ID.split(",")
-          ] if EVM_ID else []
-SOLANA_ID = dotenv.get_key(".env", "SOLANA_CHAINS")
-SOLANA_ID = [chain.strip() for chain in SOLANA_ID.split(",")
-             ] if SOLANA_ID else []
+_hash_pool = None
+_decoded_evm_txs = DecodedTransactionCache()
 
 
 def validate_key_sign(detail: TSSKeySignRequest, extra: TSSKeySignExtra):
-    # 验证交易哈希以防止交易被篡改
+    # 整个请求使用同一份配置快照，重新加载配置不影响进行中的请求
+    config = current()
+    # 验证交易哈希以防止交易被篡改，批量签名时逐一校验每个消息哈希
     chain = extra.transaction.chain_id
     raw_tx = extra.transaction.raw_tx_info.unsigned_raw_tx
-    msg_hash = detail.msg_hash_list[0]
-    if chain in EVM_ID:
-        print("EVM transaction verify")
-        evm_transaction_verify(raw_tx, msg_hash)
-    elif chain in SOLANA_ID:
-        solana_transaction_verify(raw_tx, msg_hash)
+    if chain in config.evm_chains:
+        verify_fn = evm_transaction_verify
+    elif chain in config.solana_chains:
+        verify_fn = solana_transaction_verify
     else:
         logger.warning(f"Unsupported chain: {chain}")
         raise Exception(f"Unsupported chain: {chain}")
+    payloads = split_unsigned_payloads(raw_tx, len(detail.msg_hash_list or []))
+    with metrics.stage("hash_verify"):
+        verify_message_hashes(verify_fn, payloads, detail.msg_hash_list)
 
     # 根据 API callback 获取到的 tx 数据和此处
     # extra.transaction.raw_tx_info.unsigned_raw_tx 解析出的交易数
     # 据进行对比，验证交易的有效性
 
     tx_id = extra.transaction.transaction_id
-    tx = get_transaction(tx_id)
+    with metrics.stage("get_transaction"):
+        tx = get_transaction(tx_id)
     if not tx:
         logger.error(f"Transaction {tx_id} not found in cache")
         raise Exception(f"Transaction {tx_id} not found in cache")
@@ -55,17 +75,372 @@ def validate_key_sign(detail: TSSKeySignRequest, extra: TSSKeySignExtra):
     created_timestamp = tx["created_timestamp"]
     if extra.transaction.created_timestamp != created_timestamp:
         raise Exception(f"Created timestamp {created_timestamp} mismatch source {extra.transaction.created_timestamp}")
+    request_id = tx.get("request_id")
+    if request_id and extra.transaction.request_id and extra.transaction.request_id != request_id:
+        raise Exception(f"Request ID {request_id} mismatch source {extra.transaction.request_id}")
+
+    with metrics.stage("compare_transaction"):
+        if chain in config.evm_chains:
+            compare_evm_transaction(payloads, detail.msg_hash_list, tx, extra.transaction, config)
+        elif chain in config.solana_chains:
+            compare_solana_transaction(payloads, tx, extra.transaction, config)
+    with metrics.stage("policy"):
+        if config.address_allowlist is not None or config.address_denylist is not None:
+            check_destination_lists(tx.get("destination_address"), config)
+        if config.policy is not None:
+            enforce_policy(config.policy, tx)
     return
 
 
+def check_destination_lists(destination, config: Snapshot):
+    '''
+    收款地址不能在黑名单中；配置了白名单时必须在白名单中
+    '''
+    if not destination:
+        if config.address_allowlist is not None:
+            raise Exception("Destination address is required by the allowlist")
+        return
+    if config.address_denylist is not None and destination in config.address_denylist:
+        logger.warning(f"Destination {destination} is denylisted")
+        raise Exception(f"Destination {destination} is denylisted")
+    if config.address_allowlist is not None and destination not in config.address_allowlist:
+        logger.warning(f"Destination {destination} is not allowlisted")
+        raise Exception(f"Destination {destination} is not allowlisted")
+
+
+def enforce_policy(engine: PolicyEngine, tx: dict):
+    '''
+    按 API callback 中已与待签名数据比对过的交易数据执行风控策略
+    '''
+    amount = tx.get("amount")
+    try:
+        amount = Decimal(amount) if amount else None
+    except InvalidOperation:
+        raise Exception(f"Invalid amount {amount}")
+    violation = engine.evaluate(PolicyContext(
+        chain_id=tx["chain_id"],
+        wallet_id=tx["wallet_id"],
+        token_id=tx.get("token_id"),
+        amount=amount,
+        destination=tx.get("destination_address"),
+    ))
+    if violation:
+        logger.warning(f"Transaction {tx.get('transaction_id')} rejected by {violation}")
+        raise Exception(f"Rejected by {violation}")
+
+
+def compare_evm_transaction(payloads: list, msg_hashes: list, tx: dict, source, config: Snapshot):
+    '''
+    解析待签名的 EVM 交易，与 API callback 收到的交易数据逐项比对 chainId、nonce、
+    收款地址、代币合约、calldata、金额和手续费上限。缺少比对所需的数据或配置时拒绝，
+    只有部署合约（EVM_Contract 且 to 为空）可以没有收款地址
+    '''
+    payload = _single_payload(payloads)
+    try:
+        decoded = _decoded_evm_txs.get_or_decode(msg_hashes[0], payload)
+    except (RLPDecodeError, ValueError) as e:
+        raise Exception(f"Failed to decode EVM transaction: {e}")
+    expected_chain_id = config.evm_chain_ids.get(source.chain_id)
+    if expected_chain_id is None:
+        raise Exception(f"EVM chainId of {source.chain_id} is not configured in EVM_CHAIN_IDS")
+    # 没有 chainId 的 legacy 交易（EIP-155 之前）可以在任意链上重放
+    if decoded.chain_id != expected_chain_id:
+        raise Exception(f"EVM chainId {decoded.chain_id} mismatch {source.chain_id} ({expected_chain_id})")
+
+    used_nonce = source.raw_tx_info.used_nonce if source.raw_tx_info else None
+    if used_nonce is not None and decoded.nonce != used_nonce:
+        raise Exception(f"EVM nonce {decoded.nonce} mismatch used nonce {used_nonce}")
+
+    # 合约调用比对 to、value 和 calldata；原生代币转账不能带 calldata；
+    # ERC-20 转账的 to 必须是该代币的合约，实际收款地址从 calldata 中解析
+    is_contract_call = tx.get("destination_type") == "EVM_Contract"
+    token_id = tx.get("token_id")
+    is_native = is_contract_call or token_id == source.chain_id
+    if is_contract_call:
+        calldata = tx.get("calldata") or ""
+        try:
+            expected_data = bytes.fromhex(calldata[2:] if calldata.startswith("0x") else calldata)
+        except ValueError:
+            raise Exception(f"Invalid calldata {calldata[:20]}")
+        if decoded.data != expected_data:
+            raise Exception(f"EVM calldata ({len(decoded.data)} bytes) mismatch approved calldata")
+        recipient = decoded.to
+    elif is_native:
+        if decoded.data:
+            raise Exception(f"EVM transfer of {token_id} carries {len(decoded.data)} bytes of calldata")
+        recipient = decoded.to
+    else:
+        contract = config.token_contracts.get(token_id)
+        if contract is None:
+            raise Exception(f"Contract of token {token_id} is not configured in TOKEN_CONTRACTS")
+        if not decoded.to or decoded.to.lower() != contract:
+            raise Exception(f"EVM token contract {decoded.to} mismatch {token_id} ({contract})")
+        if not decoded.is_erc20_transfer() or decoded.value:
+            raise Exception(f"EVM transaction to {token_id} contract is not a plain ERC-20 transfer")
+        recipient = decoded.transfer_recipient()
+
+    destination = tx.get("destination_address")
+    if destination:
+        if not recipient or recipient.lower() != destination.lower():
+            raise Exception(f"EVM recipient {recipient} mismatch destination {destination}")
+    elif not is_contract_call or recipient:
+        raise Exception(f"EVM transaction to {recipient} has no destination address to compare")
+
+    amount = tx.get("amount")
+    if is_native:
+        decimals, value = NATIVE_DECIMALS, decoded.value
+    else:
+        decimals, value = config.token_decimals.get(token_id), decoded.transfer_amount()
+    if decimals is None:
+        raise Exception(f"Decimals of token {token_id} are not configured in TOKEN_DECIMALS")
+    # 合约调用未给出金额时 value 必须为 0
+    if not amount and not is_contract_call:
+        raise Exception(f"EVM transfer of {token_id} has no amount to compare")
+    try:
+        expected = Decimal(amount or 0).scaleb(decimals)
+    except InvalidOperation:
+        raise Exception(f"Invalid amount {amount}")
+    if expected != value:
+        raise Exception(f"EVM amount {value} mismatch {amount} {token_id}")
+
+    check_evm_fee(decoded, tx)
+
+
+def check_evm_fee(decoded, tx: dict):
+    '''
+    待签名交易的 gas 上限和单价不能超过 API callback 时批准的手续费
+    '''
+    limits = (
+        ("gas_limit", decoded.gas_limit),
+        ("max_fee_per_gas" if decoded.tx_type == DYNAMIC_FEE_TX else "gas_price", decoded.max_fee_per_gas),
+        ("max_priority_fee_per_gas", decoded.max_priority_fee_per_gas),
+    )
+    for name, value in limits:
+        approved = tx.get(name)
+        if not approved or value is None:
+            continue
+        try:
+            approved = int(Decimal(approved))
+        except InvalidOperation:
+            raise Exception(f"Invalid {name} {approved}")
+        if value > approved:
+            raise Exception(f"EVM {name} {value} exceeds approved {approved}")
+
+
+def split_unsigned_payloads(raw_tx: str, hash_count: int = 1) -> list:
+    '''
+    返回与 msg_hash_list 一一对应的待签名数据。
+    unsigned_raw_tx 通常是单个待签名数据，有多个哈希时（如同一消息需要多个签名）
+    逐一与每个哈希校验。Cobo 没有定义批量格式，为 JSON 字符串数组时按本服务的约定
+    与 msg_hash_list 按顺序对应
+    '''
+    if not raw_tx:
+        raise Exception("Unsigned raw tx is empty")
+    if raw_tx.lstrip().startswith("["):
+        payloads = json.loads(raw_tx)
+        if not all(isinstance(p, str) for p in payloads):
+            raise Exception("Unsigned raw tx list must contain hex strings")
+        return payloads
+    return [raw_tx] * max(hash_count, 1)
+
+
+def verify_message_hashes(verify_fn, payloads: list, msg_hashes: list,
+                          time_budget: float = None):
+    '''
+    校验每个消息哈希与对应的待签名数据是否一致。消息较多时分块交给线程池，
+    超出时间预算则拒绝
+    '''
+    if not msg_hashes:
+        raise Exception("Message hash list is empty")
+    if len(payloads) != len(msg_hashes):
+        raise Exception(
+            f"Message hash count {len(msg_hashes)} mismatch unsigned payload count {len(payloads)}")
+
+    deadline = time.monotonic() + (time_budget or KEYSIGN_TIME_BUDGET)
+    pairs = list(zip(payloads, msg_hashes))
+    chunks = [pairs[i:i + BATCH_CHUNK_SIZE] for i in range(0, len(pairs), BATCH_CHUNK_SIZE)]
+
+    def verify_chunk(chunk):
+        for payload, msg_hash in chunk:
+            verify_fn(payload, msg_hash)
+
+    if len(pairs) < BATCH_PARALLEL_THRESHOLD:
+        for chunk in chunks:
+            if time.monotonic() > deadline:
+                raise Exception("Message hash verification exceeded time budget")
+            verify_chunk(chunk)
+        return
+
+    futures = [_get_hash_pool().submit(verify_chunk, chunk) for chunk in chunks]
+    done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+    if not_done:
+        for future in not_done:
+            future.cancel()
+        raise Exception("Message hash verification exceeded time budget")
+    for future in done:
+        # 任意一个分块校验失败都会在这里抛出
+        future.result()
+
+
+def _get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS,
+                                        thread_name_prefix="keysign-hash")
+    return _hash_pool
+
+
+def compare_solana_transaction(payloads: list, tx: dict, source, config: Snapshot):
+    '''
+    解析待签名的 Solana 消息，与 API callback 收到的交易数据比对。
+    转账类交易必须恰好包含一笔收款地址和金额都一致的转账，除计算预算、备注和 nonce 指令
+    以及为收款地址创建关联代币账户外，不能包含其他指令。SPL 转账的目标是代币账户，
+    需要是收款地址本身或其关联代币账户，mint 和精度以 TOKEN_MINTS、TOKEN_DECIMALS 为准。
+    合约调用（SOL_Contract）按顺序比对 API callback 批准的指令
+    '''
+    payload = _single_payload(payloads)
+    message = parse_message(extract_message(_decode_solana_payload(payload)))
+    if tx.get("destination_type") == "SOL_Contract":
+        compare_solana_instructions(message, tx.get("instructions"))
+        return
+
+    amount = tx.get("amount")
+    token_id = tx.get("token_id")
+    destination = tx.get("destination_address")
+    if not destination or not amount:
+        raise Exception(f"Solana transfer requires destination and amount, got {destination} {amount}")
+    try:
+        destination_key = b58decode(destination)
+    except ValueError:
+        raise Exception(f"Invalid Solana destination {destination}")
+
+    is_native = token_id == source.chain_id
+    mint = None
+    if not is_native:
+        mint = config.token_mints.get(token_id)
+        if mint is None:
+            raise Exception(f"Mint of token {token_id} is not configured in TOKEN_MINTS")
+        mint = b58decode(mint)
+
+    transfers = []
+    created = {}
+    for ix in message.instructions:
+        transfer = message.transfer(ix)
+        if transfer is not None:
+            transfers.append(transfer)
+            continue
+        if message.is_auxiliary(ix):
+            continue
+        creation = message.associated_account_creation(ix)
+        if creation is not None and mint is not None and creation[1:] == (destination_key, mint):
+            created[creation[0]] = creation
+            continue
+        program_id = message.account(ix.program_id_index)
+        raise Exception(f"Solana message contains an unexpected instruction of program {b58encode(program_id)}")
+    if not transfers:
+        raise Exception(f"Solana message contains no transfer for {token_id}")
+    if len(transfers) != 1:
+        raise Exception(f"Solana message contains {len(transfers)} transfers, expected 1")
+    (transfer,) = transfers
+
+    if is_native:
+        if transfer.kind != "system":
+            raise Exception(f"Solana transfer of {token_id} is not a System transfer")
+        if transfer.destination != destination_key:
+            raise Exception(f"Solana transfer destination mismatch {destination}")
+        if _scaled_amount(amount, SOLANA_NATIVE_DECIMALS) != transfer.amount:
+            raise Exception(f"Solana amount mismatch {amount} {token_id}")
+        return
+
+    if transfer.kind != "spl":
+        raise Exception(f"Solana transfer of {token_id} is not an SPL transfer")
+    if transfer.mint is not None and transfer.mint != mint:
+        raise Exception(f"SPL transfer mint {b58encode(transfer.mint)} mismatch {token_id}")
+    if not _is_token_account_of(transfer, destination_key, mint, created):
+        raise Exception(f"SPL transfer destination {transfer.destination_address} mismatch {destination}")
+    decimals = config.token_decimals.get(token_id)
+    if decimals is None:
+        raise Exception(f"Decimals of token {token_id} are not configured in TOKEN_DECIMALS")
+    if transfer.decimals is not None and transfer.decimals != decimals:
+        raise Exception(f"SPL transfer decimals {transfer.decimals} mismatch {token_id} ({decimals})")
+    if _scaled_amount(amount, decimals) != transfer.amount:
+        raise Exception(f"SPL amount {transfer.amount} mismatch {amount} {token_id}")
+
+
+def compare_solana_instructions(message, approved):
+    '''
+    合约调用的消息必须按顺序包含 API callback 批准的全部指令（程序、账户和数据逐一一致），
+    此外只能有计算预算、备注和 nonce 指令
+    '''
+    if not approved:
+        raise Exception("Solana contract call has no instructions to compare")
+    try:
+        expected = [
+            (b58decode(ix["program_id"]), [b58decode(a["pubkey"]) for a in ix["accounts"]],
+             base64.b64decode(ix["data"], validate=True))
+            for ix in json.loads(approved)
+        ]
+    except (ValueError, KeyError, TypeError) as e:
+        raise Exception(f"Invalid Solana contract call instructions: {e!r}")
+
+    position = 0
+    for ix in message.instructions:
+        # 地址查找表中的账户无法在本地解析，为 None，不会与批准的指令一致
+        actual = (message.account(ix.program_id_index), [message.account(i) for i in ix.accounts],
+                  bytes(message.data(ix)))
+        if position < len(expected) and actual == expected[position]:
+            position += 1
+            continue
+        if message.is_auxiliary(ix):
+            continue
+        program_id = message.account(ix.program_id_index)
+        program = b58encode(program_id) if program_id is not None else None
+        raise Exception(f"Solana message contains an unapproved instruction of program {program}")
+    if position != len(expected):
+        raise Exception(f"Solana message contains {position} of {len(expected)} approved instructions")
+
+
+def _single_payload(payloads: list) -> str:
+    # 一个 API callback 只记录一笔交易，多个不同的待签名数据无法逐一比对，直接拒绝
+    if len(set(payloads)) != 1:
+        raise Exception(f"Keysign contains {len(set(payloads))} distinct unsigned payloads, expected 1")
+    return payloads[0]
+
+
+def _is_token_account_of(transfer, owner: bytes, mint: bytes, created: dict) -> bool:
+    # 目标代币账户可以是同一消息中为收款地址创建的关联代币账户、由收款地址和 mint 派生出的
+    # 关联代币账户，或收款地址本身。只有 TransferChecked 带 mint，链上会校验其与账户一致，
+    # Transfer 转到收款地址本身时无法确认代币种类
+    if transfer.destination is None or transfer.program_id is None:
+        return False
+    if transfer.destination in created:
+        return True
+    if transfer.destination == owner:
+        return transfer.mint is not None
+    return transfer.destination == associated_token_address(owner, mint, transfer.program_id)
+
+
+def _scaled_amount(amount: str, decimals: int) -> Decimal:
+    try:
+        return Decimal(amount).scaleb(decimals)
+    except InvalidOperation:
+        raise Exception(f"Invalid amount {amount}")
+
+
+def _decode_solana_payload(raw_tx: str) -> bytes:
+    # Solana 交易可能以 hex 或 base64 编码
+    try:
+        return bytes.fromhex(raw_tx[2:] if raw_tx.startswith("0x") else raw_tx)
+    except ValueError:
+        return base64.b64decode(raw_tx, validate=True)
+
+
 def evm_transaction_verify(raw_tx: str, msg_hash: str):
     '''
     验证 EVM 原始交易的有效性，使用 Keccak-256 算法
     '''
     hex_bytes = bytes.fromhex(raw_tx)
     hash_result = "0x" + keccak(hex_bytes).hex()
-    print(hash_result)
-    print(msg_hash)
     if hash_result == msg_hash:
         return
     else:
@@ -75,8 +450,13 @@ def evm_transaction_verify(raw_tx: str, msg_hash: str):
 
 def solana_transaction_verify(raw_tx: str, msg_hash: str):
     '''
-    TODO 验证 Solana 原始交易有效性 
+    验证 Solana 原始交易的有效性：消息可以完整解析，且与待签名的消息一致
     '''
-    # raise NotImplementedError("还没有实现Solana交易验证")
-    # 目前无条件通过Solana交易
-    return
+    try:
+        message = extract_message(_decode_solana_payload(raw_tx))
+    except (SolanaParseError, ValueError) as e:
+        raise Exception(f"Failed to parse Solana transaction: {e}")
+    if not message_matches_hash(message, msg_hash):
+        logger.warning(f"Message hash: {msg_hash} does not match Solana message")
+        raise Exception("Solana transaction verify failed")
+
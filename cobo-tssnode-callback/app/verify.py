@@ -2,6 +2,8 @@ import json
 import logging
 from abc import ABC, abstractmethod
 from typing import Optional
+from app import audit, metrics
+from app.keysign import parse_key_sign
 from app.validator import validate_key_sign
 
 import cobo_waas2
@@ -60,16 +62,18 @@ class TssVerifier(Verifier):
             return "request detail or extra info is empty"
 
         try:
-            logger.debug(
-                f"key gen original detail:\n request detail: {request_detail}\nextra:\n{extra_info}"
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"key gen original detail:\n request detail: {request_detail}\nextra:\n{extra_info}"
+                )
 
             key_gen_detail = cobo_waas2.TSSKeyGenRequest.from_json(request_detail)
             extra = cobo_waas2.TSSKeyGenExtra.from_json(extra_info)
 
-            logger.debug(
-                f"key gen class detail:\n request detail: {key_gen_detail}\nextra:\n{extra}"
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"key gen class detail:\n request detail: {key_gen_detail}\nextra:\n{extra}"
+                )
 
             # key gen logic add here
 
@@ -88,16 +92,19 @@ class TssVerifier(Verifier):
             return "request detail or extra info is empty"
 
         try:
-            logger.debug(
-                f"key sign original detail:\n request detail: {request_detail}\nextra:\n{extra_info}"
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"key sign original detail:\n request detail: {request_detail}\nextra:\n{extra_info}"
+                )
 
-            key_sign_detail = cobo_waas2.TSSKeySignRequest.from_json(request_detail)
-            extra = cobo_waas2.TSSKeySignExtra.from_json(extra_info)
+            # 只解析一次 JSON 并提取校验需要的字段，完整模型在访问其他字段时才构造
+            with metrics.stage("parse_extra"):
+                key_sign_detail, extra = parse_key_sign(request_detail, extra_info)
 
-            logger.debug(
-                f"key sign class detail:\n{key_sign_detail}\nextra:\n{extra}"
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"key sign class detail:\n{key_sign_detail.model}\nextra:\n{extra.model}"
+                )
 
             # key sign logic add here
 
@@ -105,6 +112,8 @@ class TssVerifier(Verifier):
                 raise Exception('Key sign detail is None')
             if extra is None:
                 raise Exception('Key sign extra is None')
+            if extra.transaction is not None:
+                audit.annotate(transaction_id=extra.transaction.transaction_id)
             validate_key_sign(key_sign_detail, extra)
 
             return None
@@ -121,16 +130,18 @@ class TssVerifier(Verifier):
             return "request detail or extra info is empty"
 
         try:
-            logger.debug(
-                f"key reshare original detail:\n request detail: {request_detail}\nextra:\n{extra_info}"
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"key reshare original detail:\n request detail: {request_detail}\nextra:\n{extra_info}"
+                )
 
             key_reshare_detail = cobo_waas2.TSSKeyReshareRequest.from_json(request_detail)
             extra = cobo_waas2.TSSKeyReshareExtra.from_json(extra_info)
 
-            logger.debug(
-                f"key reshare class detail:\n{key_reshare_detail}\nextra:\n{extra}"
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"key reshare class detail:\n{key_reshare_detail}\nextra:\n{extra}"
+                )
 
             # key reshare logic add here
 
@@ -0,0 +1,46 @@
+"""Microbenchmark for Solana keysign verification
+
+Run from the project root::
+
+    python -m benchmarks.bench_solana
+"""
+import timeit
+from types import SimpleNamespace
+
+from app import snapshot, validator
+from app.solana import SYSTEM_PROGRAM_ID, SYSTEM_TRANSFER, b58encode, parse_message
+
+PAYER = bytes(range(1, 33))
+RECIPIENT = bytes(range(101, 133))
+
+
+def system_transfer_message(lamports: int) -> bytes:
+    """A legacy message with one System transfer from PAYER to RECIPIENT"""
+    data = SYSTEM_TRANSFER.to_bytes(4, "little") + lamports.to_bytes(8, "little")
+    return b"".join([
+        bytes([1, 0, 1, 3]), PAYER, RECIPIENT, SYSTEM_PROGRAM_ID,
+        bytes(32),  # recent blockhash
+        bytes([1, 2, 2, 0, 1, len(data)]), data,
+    ])
+
+
+def bench(name, fn, number=20000):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    print(f"{name:<40} {seconds / number * 1e6:8.2f} us/op")
+
+
+def main():
+    message = system_transfer_message(lamports=1500000000)
+    payload = message.hex()
+    source = SimpleNamespace(chain_id="SOL")
+    config = snapshot.Snapshot(solana_chains=frozenset({"SOL"}))
+    tx = {"token_id": "SOL", "destination_address": b58encode(RECIPIENT), "amount": "1.5"}
+
+    bench("parse_message", lambda: parse_message(message))
+    bench("parse_message + transfers", lambda: parse_message(message).transfers())
+    bench("solana_transaction_verify", lambda: validator.solana_transaction_verify(payload, payload))
+    bench("compare_solana_transaction", lambda: validator.compare_solana_transaction([payload], tx, source, config))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""In-process stand-in for RabbitMQ
+
+``InProcessBroker`` exposes the ``publish`` method of the API callback server's
+``RabbitMQPublisher`` and delivers each message to a consumer callback with
+the ``pika`` signature on its own thread, like the cache consumer does.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+
+class InProcessBroker:
+    def __init__(self, on_message: Callable):
+        self.on_message = on_message
+        self._queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.delivered = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._deliver, name="bench-broker", daemon=True)
+        self._thread.start()
+        return self
+
+    def publish(self, body: bytes, routing_key: str = None) -> Future:
+        """Accept the message; the returned future plays the publisher confirm"""
+        self._queue.put(body)
+        ack = Future()
+        ack.set_result(None)
+        return ack
+
+    def join(self):
+        """Wait until every published message has been delivered"""
+        self._queue.join()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _deliver(self):
+        while True:
+            body = self._queue.get()
+            try:
+                if body is None:
+                    return
+                self.on_message(None, None, None, body)
+                self.delivered += 1
+            finally:
+                self._queue.task_done()
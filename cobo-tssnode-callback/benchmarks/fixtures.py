@@ -0,0 +1,133 @@
+"""Signed request fixtures for the load harness
+
+``TssClient`` plays the TSS node: it signs ``TSS_JWT_MSG`` tokens with RS256.
+``CallbackSigner`` plays Cobo: it signs API callback bodies with Ed25519 the
+way ``cobo_api_callback_server/signature.py`` verifies them.
+"""
+import base64
+import hashlib
+import json
+import time
+import uuid
+
+import cobo_waas2
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from eth_utils import keccak
+from nacl.signing import SigningKey
+
+from tests.test_rlp import RECIPIENT, rlp_encode
+
+CHAIN_ID = "ETH"
+EIP155_CHAIN_ID = 1
+WALLET_ID = "00000000-0000-0000-0000-00000000b0b0"
+AMOUNT = "0.01"
+
+
+def generate_rsa_pem(key_size: int = 2048):
+    """Return (private_pem, public_pem) for a fresh RSA key"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption(),
+    )
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return private_pem, public_pem
+
+
+class TssClient:
+    """Sign TSS callback requests as the TSS node does"""
+
+    def __init__(self, private_pem: bytes, expire_seconds: int = 600):
+        self.private_key = serialization.load_pem_private_key(private_pem, password=None)
+        self.expire_seconds = expire_seconds
+
+    def token(self, request: dict) -> str:
+        package_data = base64.b64encode(json.dumps(request).encode()).decode()
+        claim = {"package_data": package_data, "exp": int(time.time()) + self.expire_seconds}
+        return jwt.encode(claim, self.private_key, algorithm="RS256")
+
+
+def ping_request() -> dict:
+    return {
+        "request_id": str(uuid.uuid4()),
+        "request_type": cobo_waas2.TSSCallbackRequestType.PING.value,
+    }
+
+
+def evm_transaction(nonce: int, transaction_id: str = None, created_timestamp: int = None) -> dict:
+    """An ETH transfer as reported by Cobo in the API callback"""
+    now = int(time.time() * 1000)
+    return {
+        "transaction_id": transaction_id or str(uuid.uuid4()),
+        "wallet_id": WALLET_ID,
+        "status": "Submitted",
+        "source": {"source_type": "Org-Controlled", "wallet_id": WALLET_ID},
+        "destination": {
+            "destination_type": "Address",
+            "account_output": {"address": "0x" + RECIPIENT.hex(), "amount": AMOUNT},
+        },
+        "initiator_type": "API",
+        "chain_id": CHAIN_ID,
+        "token_id": CHAIN_ID,
+        "created_timestamp": created_timestamp or now,
+        "updated_timestamp": now,
+    }
+
+
+def cache_message(transaction: dict) -> dict:
+    """The message the API callback server publishes for ``transaction``"""
+    output = transaction["destination"]["account_output"]
+    return {
+        "transaction_id": transaction["transaction_id"],
+        "wallet_id": transaction["wallet_id"],
+        "chain_id": transaction["chain_id"],
+        "created_timestamp": transaction["created_timestamp"],
+        "token_id": transaction["token_id"],
+        "destination_type": transaction["destination"]["destination_type"],
+        "destination_address": output["address"],
+        "amount": output["amount"],
+    }
+
+
+def evm_keysign_request(transaction: dict, nonce: int) -> dict:
+    """A KEYSIGN request whose unsigned transaction matches ``transaction``"""
+    raw = rlp_encode([nonce, 20 * 10**9, 21000, RECIPIENT, 10**16, b"", EIP155_CHAIN_ID, 0, 0])
+    extra = {
+        "transaction": {
+            **transaction,
+            "raw_tx_info": {"unsigned_raw_tx": raw.hex(), "used_nonce": nonce},
+        }
+    }
+    detail = {"msg_hash_list": ["0x" + keccak(raw).hex()]}
+    return {
+        "request_id": str(uuid.uuid4()),
+        "request_type": cobo_waas2.TSSCallbackRequestType.KEYSIGN.value,
+        "request_detail": json.dumps(detail),
+        "extra_info": json.dumps(extra),
+    }
+
+
+class CallbackSigner:
+    """Sign API callback bodies as Cobo does"""
+
+    def __init__(self):
+        self.signing_key = SigningKey.generate()
+
+    @property
+    def public_key_hex(self) -> str:
+        return self.signing_key.verify_key.encode().hex()
+
+    def headers(self, body: bytes) -> dict:
+        timestamp = str(int(time.time() * 1000))
+        digest = hashlib.sha256(hashlib.sha256(body + b"|" + timestamp.encode()).digest()).digest()
+        signature = self.signing_key.sign(digest).signature.hex()
+        return {
+            "Content-Type": "application/json",
+            "Biz-Timestamp": timestamp,
+            "Biz-Resp-Signature": signature,
+        }
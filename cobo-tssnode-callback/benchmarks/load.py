@@ -0,0 +1,416 @@
+"""Open-loop load test for /v2/check and /api/callback
+
+Run from the project root::
+
+    python -m benchmarks.load --rate 200 --duration 10
+    python -m benchmarks.load --scenario ping,keysign-evm --rate 500 --json result.json
+
+By default both services run in process: the callback server with an
+in-memory cache, the API callback server loaded from
+``../cobo_api_callback_server`` and an ``InProcessBroker`` in place of
+RabbitMQ, so callbacks flow into the same cache the keysign requests read.
+
+With ``--url`` the TSS scenarios are sent to a running callback server.
+``--client-key`` must then be the TSS node private key that server trusts,
+and keysign-evm needs ``--rabbitmq-host`` to seed transactions through the
+real queue. The callback scenario is only available in process, because
+Cobo's signing key is not available to the harness.
+
+Requests are scheduled at a fixed rate regardless of how fast responses come
+back, and latency is measured from the scheduled send time, so queueing in
+an overloaded server shows up in the tail instead of lowering the rate.
+"""
+import argparse
+import asyncio
+import base64
+import http.client
+import importlib.util
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Callable, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+import cobo_waas2
+import jwt
+from flask import Flask
+
+from app import cache, snapshot
+from app.config import ServiceConfig
+from app.service import init_app
+from app.types import Status
+from benchmarks.broker import InProcessBroker
+from benchmarks.fixtures import (
+    CHAIN_ID,
+    EIP155_CHAIN_ID,
+    CallbackSigner,
+    TssClient,
+    cache_message,
+    evm_keysign_request,
+    evm_transaction,
+    generate_rsa_pem,
+    ping_request,
+)
+
+SCENARIOS = ("ping", "keysign-evm", "cache-miss", "callback")
+API_SERVER_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "cobo_api_callback_server",
+)
+# keysign-evm 提前多久把交易消息发到 broker，模拟 API callback 先于 keysign 到达
+SEED_LEAD_SECONDS = 0.05
+
+
+@dataclass
+class LoadResult:
+    scenario: str
+    rate: float
+    sent: int
+    errors: int
+    elapsed: float
+    latencies: List[float] = field(repr=False)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        # 最近秩法；先取整避免 99.9 / 100 * n 的浮点误差多进一位
+        rank = max(math.ceil(round(q * len(ordered) / 100, 6)) - 1, 0)
+        return ordered[rank]
+
+    def summary(self) -> dict:
+        return {
+            "scenario": self.scenario,
+            "target_rps": self.rate,
+            "rps": round(len(self.latencies) / self.elapsed, 1) if self.elapsed else 0.0,
+            "sent": self.sent,
+            "errors": self.errors,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "p999_ms": round(self.percentile(99.9) * 1000, 3),
+            "max_ms": round(max(self.latencies, default=float("nan")) * 1000, 3),
+        }
+
+
+def run_open_loop(
+    name: str,
+    send: Callable[[int], object],
+    expect: Callable[[object], bool],
+    rate: float,
+    duration: float,
+    workers: int = 16,
+    before_send: Optional[Callable[[int], None]] = None,
+) -> LoadResult:
+    """Call ``send(i)`` at ``rate`` per second for ``duration`` seconds"""
+    total = int(rate * duration)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def task(i, scheduled):
+        nonlocal errors
+        try:
+            ok = expect(send(i))
+        except Exception:
+            ok = False
+        latency = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(latency)
+            if not ok:
+                errors += 1
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"load-{name}")
+    start = time.perf_counter() + 0.01
+    for i in range(total):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if before_send is not None:
+            before_send(i)
+        pool.submit(task, i, scheduled)
+    pool.shutdown(wait=True)
+    return LoadResult(name, rate, total, errors, time.perf_counter() - start, latencies)
+
+
+def decode_response(token: str) -> dict:
+    """Read the response payload; the harness trusts the server it drives"""
+    claim = jwt.decode(token, options={"verify_signature": False})
+    return json.loads(base64.b64decode(claim["package_data"]))
+
+
+def approved(token: str) -> bool:
+    data = decode_response(token)
+    return (data.get("status") == Status.OK
+            and data.get("action") == cobo_waas2.TSSCallbackActionType.APPROVE.value)
+
+
+def rejected(token: str) -> bool:
+    return decode_response(token).get("action") == cobo_waas2.TSSCallbackActionType.REJECT.value
+
+
+class InProcessTss:
+    """The callback server app with an in-memory cache fed by ``InProcessBroker``"""
+
+    def __init__(self, key_dir: str, wait_ms: int = 0):
+        client_private, client_public = generate_rsa_pem()
+        service_private, _ = generate_rsa_pem()
+        config = ServiceConfig(
+            client_public_key_path=os.path.join(key_dir, "tss-node-callback-pub.key"),
+            service_private_key_path=os.path.join(key_dir, "callback-server-pri.pem"),
+        )
+        for path, pem in ((config.client_public_key_path, client_public),
+                          (config.service_private_key_path, service_private)):
+            with open(path, "wb") as f:
+                f.write(pem)
+
+        cache.close_cache()
+        cache.configure(cache.CacheSettings(wait_timeout=wait_ms / 1000))
+        cache.open_cache()
+
+        self.app = Flask("bench")
+        init_app(self.app, config)
+        snapshot.install(replace(
+            snapshot.current(),
+            evm_chains=frozenset([CHAIN_ID]),
+            solana_chains=frozenset(),
+            evm_chain_ids={CHAIN_ID: EIP155_CHAIN_ID},
+        ))
+        self.client = TssClient(client_private)
+        self.broker = InProcessBroker(cache.callback).start()
+        self._local = threading.local()
+
+    def check(self, token: str) -> str:
+        test_client = getattr(self._local, "client", None)
+        if test_client is None:
+            test_client = self._local.client = self.app.test_client()
+        response = test_client.post("/v2/check", data={"TSS_JWT_MSG": token})
+        return response.get_data(as_text=True)
+
+    def publish(self, message: dict):
+        self.broker.publish(json.dumps(message).encode())
+
+    def close(self):
+        self.broker.stop()
+        cache.close_cache()
+
+
+class HttpTss:
+    """A running callback server, with transactions seeded through RabbitMQ"""
+
+    def __init__(self, url: str, client_key_path: str, rabbitmq_host: Optional[str] = None):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.path = parts.path.rstrip("/") + "/v2/check"
+        with open(client_key_path, "rb") as f:
+            self.client = TssClient(f.read())
+        self.rabbitmq_host = rabbitmq_host
+        self._channel = None
+        self._local = threading.local()
+
+    def check(self, token: str) -> str:
+        body = urlencode({"TSS_JWT_MSG": token})
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            try:
+                conn.request("POST", self.path, body, headers)
+                return conn.getresponse().read().decode()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def publish(self, message: dict):
+        if self.rabbitmq_host is None:
+            raise RuntimeError("keysign-evm against --url needs --rabbitmq-host")
+        if self._channel is None:
+            import pika
+            connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.rabbitmq_host))
+            self._channel = connection.channel()
+            self._channel.queue_declare(queue=cache.settings.queue)
+        self._channel.basic_publish(
+            exchange="", routing_key=cache.settings.queue, body=json.dumps(message).encode())
+
+    def close(self):
+        if self._channel is not None:
+            self._channel.connection.close()
+
+
+class InProcessCallbackServer:
+    """The API callback server app, publishing to ``broker`` and trusting ``signer``"""
+
+    def __init__(self, broker: InProcessBroker, signer: CallbackSigner):
+        if API_SERVER_DIR not in sys.path:
+            sys.path.append(API_SERVER_DIR)
+        spec = importlib.util.spec_from_file_location(
+            "bench_api_callback_server", os.path.join(API_SERVER_DIR, "app.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.publisher = broker
+        module.verifier = module.SignatureVerifier({"BENCH": signer.public_key_hex}, env="BENCH")
+        self.module = module
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="bench-asgi", daemon=True)
+        self._thread.start()
+
+    def post(self, path: str, body: bytes, headers: dict):
+        future = asyncio.run_coroutine_threadsafe(self._call(path, body, headers), self.loop)
+        return future.result(timeout=30)
+
+    async def _call(self, path: str, body: bytes, headers: dict):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+            "client": ("127.0.0.1", 0),
+            "server": ("127.0.0.1", 8888),
+        }
+        received = False
+
+        async def receive():
+            nonlocal received
+            if received:
+                return {"type": "http.disconnect"}
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        status, chunks = None, []
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.module.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.module.verifier.close()
+
+
+def run_scenario(name: str, tss, rate: float, duration: float, workers: int,
+                 callback_server: Optional[InProcessCallbackServer] = None,
+                 signer: Optional[CallbackSigner] = None) -> LoadResult:
+    total = int(rate * duration)
+
+    if name == "ping":
+        tokens = [tss.client.token(ping_request()) for _ in range(total)]
+        return run_open_loop(name, lambda i: tss.check(tokens[i]), approved, rate, duration, workers)
+
+    if name in ("keysign-evm", "cache-miss"):
+        transactions = [evm_transaction(nonce=i) for i in range(total)]
+        tokens = [tss.client.token(evm_keysign_request(tx, i)) for i, tx in enumerate(transactions)]
+        if name == "cache-miss":
+            return run_open_loop(name, lambda i: tss.check(tokens[i]), rejected, rate, duration, workers)
+
+        lead = max(int(rate * SEED_LEAD_SECONDS), 1)
+        for tx in transactions[:lead]:
+            tss.publish(cache_message(tx))
+        if isinstance(tss, InProcessTss):
+            tss.broker.join()
+
+        def seed_ahead(i):
+            if i + lead < total:
+                tss.publish(cache_message(transactions[i + lead]))
+
+        return run_open_loop(name, lambda i: tss.check(tokens[i]), approved,
+                             rate, duration, workers, before_send=seed_ahead)
+
+    if name == "callback":
+        if callback_server is None:
+            raise ValueError("the callback scenario runs in process only")
+        bodies = [json.dumps(evm_transaction(nonce=i)).encode() for i in range(total)]
+        requests = [(body, signer.headers(body)) for body in bodies]
+
+        def send(i):
+            body, headers = requests[i]
+            return callback_server.post("/api/callback", body, headers)
+
+        return run_open_loop(name, send, lambda r: r == (200, b"ok"), rate, duration, workers)
+
+    raise ValueError(f"Unknown scenario {name}")
+
+
+def print_report(results: List[LoadResult]):
+    columns = ("scenario", "target_rps", "rps", "sent", "errors",
+               "p50_ms", "p99_ms", "p999_ms", "max_ms")
+    print(" ".join(f"{c:>12}" for c in columns))
+    for result in results:
+        summary = result.summary()
+        print(" ".join(f"{summary[c]!s:>12}" for c in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop load test")
+    parser.add_argument("--scenario", default=",".join(SCENARIOS),
+                        help=f"comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--rate", type=float, default=100, help="requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent requests")
+    parser.add_argument("--wait-ms", type=int, default=0,
+                        help="in-process cache wait on a miss, like CACHE_WAIT_TIMEOUT_MS")
+    parser.add_argument("--url", help="callback server URL, e.g. http://127.0.0.1:11020")
+    parser.add_argument("--client-key", help="TSS node RSA private key trusted by --url")
+    parser.add_argument("--rabbitmq-host", help="RabbitMQ used by --url, for keysign-evm")
+    parser.add_argument("--json", help="also write the summaries to this file")
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.scenario.split(",") if n.strip()]
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+    if args.url and not args.client_key:
+        parser.error("--url needs --client-key")
+
+    with tempfile.TemporaryDirectory() as key_dir:
+        if args.url:
+            tss = HttpTss(args.url, args.client_key, args.rabbitmq_host)
+        else:
+            tss = InProcessTss(key_dir, wait_ms=args.wait_ms)
+        signer = callback_server = None
+        if "callback" in names and isinstance(tss, InProcessTss):
+            signer = CallbackSigner()
+            callback_server = InProcessCallbackServer(tss.broker, signer)
+
+        results = []
+        try:
+            for name in names:
+                if name == "callback" and callback_server is None:
+                    print("skipping callback: only available in process")
+                    continue
+                results.append(run_scenario(name, tss, args.rate, args.duration, args.workers,
+                                            callback_server, signer))
+        finally:
+            if callback_server is not None:
+                callback_server.close()
+            tss.close()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([r.summary() for r in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
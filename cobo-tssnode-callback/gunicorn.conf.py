@@ -0,0 +1,37 @@
+import os
+
+from app.config import DEFAULT_CONFIG_YAML, load_yaml_config
+
+_config = load_yaml_config(
+    os.environ.get("CALLBACK_SERVER_CONFIG", DEFAULT_CONFIG_YAML)
+)
+
+bind = _config.endpoint
+workers = int(os.environ.get("CALLBACK_SERVER_WORKERS", 1))
+threads = int(os.environ.get("CALLBACK_SERVER_THREADS", 8))
+# 在 master 中加载配置和密钥后再 fork，worker 之间共享只读内存
+preload_app = True
+graceful_timeout = 10
+
+
+def on_starting(server):
+    from app import cache
+
+    cache.configure(cache.CacheSettings.from_env())
+    if server.cfg.workers > 1 and cache.settings.backend == "memory":
+        raise RuntimeError(
+            "memory cache backend only supports one worker, "
+            "set CACHE_BACKEND=sqlite to run multiple workers"
+        )
+
+
+def post_fork(server, worker):
+    from app import lifecycle
+
+    lifecycle.start_worker()
+
+
+def worker_exit(server, worker):
+    from app import lifecycle
+
+    lifecycle.stop_worker()
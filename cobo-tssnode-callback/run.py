@@ -1,4 +1,4 @@
-from app import create_app
+from app import create_app, lifecycle
 
 
 def main():
@@ -8,7 +8,12 @@ def main():
         return
 
     host, port = app.config["ENDPOINT"].split(":")
-    app.run(host=host, port=int(port), debug=app.config["ENABLE_DEBUG"])
+    lifecycle.start_worker()
+    try:
+        # 开发模式；生产环境请使用 gunicorn -c gunicorn.conf.py wsgi:app
+        app.run(host=host, port=int(port), debug=app.config["ENABLE_DEBUG"], use_reloader=False)
+    finally:
+        lifecycle.stop_worker()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+import os
+import time
+
+import pytest
+
+from app import validator
+from app.address_index import AddressIndex, AddressIndexError, AddressList, build_index
+from app.snapshot import Snapshot
+
+ADDRESSES = [f"0x{i:040x}" for i in range(1, 2001)] + ["9xQeWvG816bUx9EPjHmaT23yvVM2ZWbrrpZb9PusVFin"]
+
+
+def test_lookup(tmp_path):
+    path = str(tmp_path / "allow.idx")
+    assert build_index(ADDRESSES, path) == len(ADDRESSES)
+    index = AddressIndex(path)
+    assert len(index) == len(ADDRESSES)
+    assert ADDRESSES[0] in index
+    # EVM 地址不区分大小写，base58 地址区分大小写
+    assert ADDRESSES[10].upper().replace("0X", "0x") in index
+    assert ADDRESSES[-1] in index
+    assert ADDRESSES[-1].lower() not in index
+    assert f"0x{5000:040x}" not in index
+
+
+def test_without_bloom_and_empty(tmp_path):
+    path = str(tmp_path / "plain.idx")
+    build_index(ADDRESSES[:10], path, bloom_bits_per_key=0)
+    assert ADDRESSES[3] in AddressIndex(path)
+    build_index([], path)
+    assert ADDRESSES[3] not in AddressIndex(path)
+
+
+def test_rejects_invalid_file(tmp_path):
+    path = tmp_path / "bad.idx"
+    path.write_bytes(b"not an index" * 4)
+    with pytest.raises(AddressIndexError):
+        AddressIndex(str(path))
+
+
+def test_hot_swap(tmp_path):
+    path = str(tmp_path / "deny.idx")
+    build_index(ADDRESSES[:1], path)
+    address_list = AddressList(path, check_interval=0)
+    assert ADDRESSES[0] in address_list
+    assert ADDRESSES[1] not in address_list
+
+    build_index(ADDRESSES[1:2], path)
+    stat = os.stat(path)
+    # 保证 mtime 不同，避免文件系统时间精度导致检测不到
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert ADDRESSES[1] in address_list
+    assert ADDRESSES[0] not in address_list
+
+
+def test_lookup_is_fast(tmp_path):
+    path = str(tmp_path / "allow.idx")
+    build_index(ADDRESSES, path)
+    index = AddressIndex(path)
+    start = time.perf_counter()
+    for i in range(2000):
+        _ = ADDRESSES[i] in index
+    assert (time.perf_counter() - start) / 2000 < 100e-6
+
+
+def test_check_destination_lists(tmp_path):
+    allow, deny = str(tmp_path / "allow.idx"), str(tmp_path / "deny.idx")
+    build_index(ADDRESSES[:5], allow)
+    build_index(ADDRESSES[4:5], deny)
+    config = Snapshot(address_allowlist=AddressList(allow), address_denylist=AddressList(deny))
+
+    validator.check_destination_lists(ADDRESSES[0], config)
+    with pytest.raises(Exception, match="denylisted"):
+        validator.check_destination_lists(ADDRESSES[4], config)
+    with pytest.raises(Exception, match="not allowlisted"):
+        validator.check_destination_lists(ADDRESSES[5], config)
+    with pytest.raises(Exception, match="required"):
+        validator.check_destination_lists(None, config)
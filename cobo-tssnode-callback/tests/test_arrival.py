@@ -0,0 +1,33 @@
+import threading
+import time
+
+from app.arrival import ArrivalWaiter
+
+
+def test_wait_returns_value_stored_after_lookup():
+    store = {}
+    waiter = ArrivalWaiter()
+
+    def deliver():
+        time.sleep(0.02)
+        store["tx-1"] = {"transaction_id": "tx-1"}
+        waiter.notify("tx-1")
+
+    threading.Thread(target=deliver).start()
+    value = waiter.wait("tx-1", lambda k: store.pop(k, None), 1.0)
+
+    assert value == {"transaction_id": "tx-1"}
+    stats = waiter.stats.snapshot()
+    assert stats["waits"] == 1
+    assert stats["hits"] == 1
+    assert 0 < stats["max_seconds"] < 1.0
+
+
+def test_wait_times_out_and_polls():
+    waiter = ArrivalWaiter()
+
+    assert waiter.wait("tx-1", lambda k: None, 0.01) is None
+    assert waiter.wait("tx-1", lambda k: None, 0.01, poll=True) is None
+    stats = waiter.stats.snapshot()
+    assert stats["timeouts"] == 2
+    assert sum(stats["buckets"].values()) == 2
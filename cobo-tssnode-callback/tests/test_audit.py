@@ -0,0 +1,112 @@
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+from app import audit, metrics
+from app.audit import AuditLog, Query
+
+
+def _entry(i, decision="APPROVE", **fields):
+    return {"ts": time.time(), "request_id": f"req-{i}", "request_type": "KEYSIGN",
+            "decision": decision, "reason": None, **fields}
+
+
+def test_batches_are_compressed_and_readable(tmp_path):
+    log = AuditLog(str(tmp_path), batch_size=10, flush_interval=0.01, fsync_interval=0)
+    log.start()
+    for i in range(25):
+        assert log.record(_entry(i, transaction_id=f"tx-{i}"))
+    log.stop()
+
+    [path] = audit.list_files(str(tmp_path))
+    with gzip.open(path, "rt") as f:
+        assert len(f.readlines()) == 25
+    entries = list(audit.read_file(path))
+    assert [e["request_id"] for e in entries] == [f"req-{i}" for i in range(25)]
+    assert entries[0]["ts"].endswith("Z")
+    assert log.records == 25 and log.failed == 0
+
+
+def test_full_buffer_drops_instead_of_blocking(tmp_path):
+    log = AuditLog(str(tmp_path), buffer_size=5, batch_size=100, flush_interval=60)
+    results = [log.record(_entry(i)) for i in range(8)]
+    assert results == [True] * 5 + [False] * 3
+    assert log.dropped == 3
+
+
+def test_rotates_files_and_survives_truncated_batch(tmp_path):
+    log = AuditLog(str(tmp_path), batch_size=1, flush_interval=0.01, max_file_bytes=1)
+    log.start()
+    for i in range(3):
+        log.record(_entry(i))
+        time.sleep(0.05)
+    log.stop()
+    paths = audit.list_files(str(tmp_path))
+    assert len(paths) == 3
+
+    # 进程崩溃时最后一批只写入一部分
+    with open(paths[-1], "r+b") as f:
+        f.truncate(os.path.getsize(paths[-1]) - 8)
+    assert [e["request_id"] for e in audit.scan(str(tmp_path))][:2] == ["req-0", "req-1"]
+
+
+def test_scan_filters_and_counts(tmp_path):
+    log = AuditLog(str(tmp_path), flush_interval=0.01)
+    log.start()
+    for i in range(30):
+        rejected = i % 3 == 0
+        log.record(_entry(i, "REJECT" if rejected else "APPROVE",
+                          reason="Destination 0xabc is denylisted" if rejected else None,
+                          transaction_id=f"tx-{i}"))
+    log.stop()
+
+    rejects = list(audit.scan(str(tmp_path), Query(decision="REJECT", reason="denylisted")))
+    assert len(rejects) == 10
+    assert [e["request_id"] for e in audit.scan(str(tmp_path), Query(transaction_id="tx-7"))] == ["req-7"]
+    assert audit.count(str(tmp_path), Query(), workers=2) == {("KEYSIGN", "APPROVE"): 20, ("KEYSIGN", "REJECT"): 10}
+    today = time.strftime("%Y-%m-%d", time.gmtime())
+    assert len(list(audit.scan(str(tmp_path), Query(since=today, until=today)))) == 30
+    assert list(audit.scan(str(tmp_path), Query(until="2000-01-01"))) == []
+
+
+def test_scan_reason_with_escaped_characters(tmp_path):
+    log = AuditLog(str(tmp_path), flush_interval=0.01)
+    log.start()
+    log.record(_entry(0, "REJECT", reason='Token "ETH_USDT" 金额超限'))
+    log.stop()
+
+    assert len(list(audit.scan(str(tmp_path), Query(reason='"ETH_USDT" 金额')))) == 1
+
+
+@pytest.fixture
+def sink(tmp_path, monkeypatch):
+    monkeypatch.setattr(audit, "settings", audit.AuditSettings(directory=str(tmp_path), flush_interval=0.01))
+    audit.start_sink()
+    yield str(tmp_path)
+    audit.stop_sink()
+
+
+def test_process_request_records_decision(sink, monkeypatch):
+    import cobo_waas2
+    from app import service
+
+    def verify(req):
+        audit.annotate(transaction_id="tx-1")
+        with metrics.stage("compare_transaction"):
+            pass
+        return "EVM amount mismatch"
+
+    monkeypatch.setattr(service.TssVerifier, "verify", staticmethod(verify))
+    request = cobo_waas2.TSSCallbackRequest(request_id="req-1", request_type=cobo_waas2.TSSCallbackRequestType.KEYSIGN)
+    response = service.process_request(request)
+    assert response.action == cobo_waas2.TSSCallbackActionType.REJECT
+    audit.stop_sink()
+
+    [entry] = audit.scan(sink)
+    assert entry["transaction_id"] == "tx-1"
+    assert (entry["request_type"], entry["decision"], entry["reason"]) == ("KEYSIGN", "REJECT", "EVM amount mismatch")
+    assert "compare_transaction" in entry["stages_ms"]
+    assert json.dumps(entry)
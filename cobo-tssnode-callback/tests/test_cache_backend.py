@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from app import cache
+from app.cache_backend import MemoryCacheBackend, SQLiteCacheBackend, create_backend
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "tx_cache.db")
+
+
+def test_sqlite_backend_is_shared_between_instances(db_path):
+    writer = SQLiteCacheBackend(db_path, ttl=30, max_size=100)
+    reader = SQLiteCacheBackend(db_path, ttl=30, max_size=100)
+
+    writer.put("tx-1", {"transaction_id": "tx-1", "wallet_id": "w"})
+
+    assert reader.pop("tx-1") == {"transaction_id": "tx-1", "wallet_id": "w"}
+    assert writer.pop("tx-1") is None
+    assert reader.stats()["hits"] == 1
+    assert writer.stats()["misses"] == 1
+
+
+def test_sqlite_backend_skips_expired_entries(db_path):
+    backend = SQLiteCacheBackend(db_path, ttl=30, max_size=100)
+    backend.put("tx-old", {"transaction_id": "tx-old"}, timestamp=time.time() - 60)
+
+    assert backend.pop("tx-old") is None
+
+
+def test_sqlite_backend_evicts_oldest_when_full(db_path):
+    backend = SQLiteCacheBackend(db_path, ttl=30, max_size=2)
+    backend.CLEANUP_INTERVAL = 0
+    now = time.time()
+    for i in range(3):
+        backend.put(f"tx-{i}", {"transaction_id": f"tx-{i}"}, timestamp=now + i)
+
+    assert backend.size() == 2
+    assert backend.pop("tx-0") is None
+    assert backend.stats()["evictions"] == 1
+
+
+def test_create_backend(db_path):
+    assert isinstance(create_backend("memory", 30, 10), MemoryCacheBackend)
+    assert create_backend("sqlite", 30, 10, sqlite_path=db_path).shared
+    with pytest.raises(ValueError):
+        create_backend("redis", 30, 10)
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_waiting_for_a_late_message_counts_one_miss(db_path, monkeypatch, shared):
+    backend = SQLiteCacheBackend(db_path, ttl=30, max_size=100) if shared else MemoryCacheBackend(30, 100)
+    monkeypatch.setattr(cache, "global_message_cache", backend)
+    timer = threading.Timer(0.1, cache.store_message, [{"transaction_id": "tx-1"}])
+    timer.start()
+
+    # 等待期间的重复查询不计入命中率
+    assert cache.get_transaction("tx-1", timeout=2) == {"transaction_id": "tx-1"}
+    assert cache.get_transaction("tx-2", timeout=0.05) is None
+    stats = backend.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 2)
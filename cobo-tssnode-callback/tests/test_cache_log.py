@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+
+import pytest
+
+from app.cache_backend import MemoryCacheBackend
+from app.cache_log import OP_DELETE, OP_PUT, RECORD, CacheLog, LogLocked
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "tx_cache.log")
+
+
+def test_restart_restores_unused_messages(log_path):
+    backend = MemoryCacheBackend(ttl=30, max_size=100, log_path=log_path, log_capacity=4096)
+    backend.put("tx-1", {"transaction_id": "tx-1", "wallet_id": "w"})
+    backend.put("tx-2", {"transaction_id": "tx-2"})
+    backend.put("tx-old", {"transaction_id": "tx-old"}, timestamp=time.time() - 60)
+    assert backend.pop("tx-2") == {"transaction_id": "tx-2"}
+    backend.close()
+
+    restarted = MemoryCacheBackend(ttl=30, max_size=100, log_path=log_path, log_capacity=4096)
+    assert restarted.replayed == 1
+    assert restarted.pop("tx-1") == {"transaction_id": "tx-1", "wallet_id": "w"}
+    assert restarted.pop("tx-2") is None
+    assert restarted.pop("tx-old") is None
+    restarted.close()
+
+
+def test_replay_survives_a_crash(log_path):
+    # 子进程写入后直接退出，不关闭日志也不 msync
+    pid = os.fork()
+    if pid == 0:
+        backend = MemoryCacheBackend(ttl=30, max_size=100, log_path=log_path, log_capacity=4096)
+        backend.put("tx-1", {"transaction_id": "tx-1"})
+        os._exit(0)
+    assert os.waitpid(pid, 0)[1] == 0
+
+    backend = MemoryCacheBackend(ttl=30, max_size=100, log_path=log_path, log_capacity=4096)
+    assert backend.pop("tx-1") == {"transaction_id": "tx-1"}
+    backend.close()
+
+
+def test_torn_record_ends_replay(log_path):
+    log = CacheLog(log_path, capacity=4096)
+    log.append(OP_PUT, "tx-1", b"{}", 1.0)
+    torn_at = log.offset
+    log.append(OP_PUT, "tx-2", b"{}", 2.0)
+    # 模拟写到一半崩溃：最后一条记录的内容被破坏
+    log._mm[log.offset - 1] ^= 0xFF
+    log.close()
+
+    log = CacheLog(log_path, capacity=4096)
+    assert [key for _, key, _, _ in log.records()] == ["tx-1"]
+    assert log.offset == torn_at
+    log.append(OP_DELETE, "tx-1", timestamp=3.0)
+    assert [(op, key) for op, key, _, _ in log.records()] == [(OP_PUT, "tx-1"), (OP_DELETE, "tx-1")]
+    log.close()
+
+
+def test_full_log_is_compacted_and_grown(log_path):
+    capacity = 2048
+    backend = MemoryCacheBackend(ttl=30, max_size=1000, log_path=log_path, log_capacity=capacity)
+    for i in range(200):
+        backend.put(f"tx-{i}", {"transaction_id": f"tx-{i}"})
+        if i % 2:
+            backend.pop(f"tx-{i}")
+    # 压缩在后台线程中进行
+    deadline = time.monotonic() + 5
+    while backend._pending is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stats = backend.stats()
+    assert stats["log_compactions"] > 1
+    assert backend.log.capacity > capacity
+    backend.close()
+
+    restarted = MemoryCacheBackend(ttl=30, max_size=1000, log_path=log_path, log_capacity=capacity)
+    assert restarted.replayed == 100
+    assert restarted.pop("tx-198") == {"transaction_id": "tx-198"}
+    restarted.close()
+
+
+def test_pop_does_not_wait_for_compaction(log_path):
+    backend = MemoryCacheBackend(ttl=30, max_size=10**6, log_path=log_path, log_capacity=2048)
+    started, release = threading.Event(), threading.Event()
+    prepare = backend.log.prepare
+
+    def slow_prepare(entries):
+        started.set()
+        release.wait(5)
+        return prepare(entries)
+
+    backend.log.prepare = slow_prepare
+    i = 0
+    while not started.is_set():
+        backend.put(f"tx-{i}", {"transaction_id": f"tx-{i}"})
+        i += 1
+    # 压缩线程停在写临时文件时，put 和 pop 仍然立即返回
+    begin = time.monotonic()
+    backend.put("tx-late", {"transaction_id": "tx-late"})
+    assert backend.pop("tx-0") == {"transaction_id": "tx-0"}
+    assert time.monotonic() - begin < 0.5
+    release.set()
+    backend.close()
+
+    restarted = MemoryCacheBackend(ttl=30, max_size=10**6, log_path=log_path, log_capacity=2048)
+    assert restarted.replayed == i
+    assert restarted.pop("tx-0") is None
+    assert restarted.pop("tx-late") == {"transaction_id": "tx-late"}
+    restarted.close()
+
+
+def test_second_process_does_not_share_the_log(log_path):
+    backend = MemoryCacheBackend(ttl=30, max_size=100, log_path=log_path, log_capacity=4096)
+    with pytest.raises(LogLocked):
+        CacheLog(log_path, capacity=4096, lock_timeout=0)
+    backend.close()
+    CacheLog(log_path, capacity=4096, lock_timeout=0).close()
+
+
+def test_record_layout():
+    assert RECORD.size == 20
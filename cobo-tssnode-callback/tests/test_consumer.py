@@ -0,0 +1,80 @@
+import json
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pika
+import pytest
+
+from app import cache
+from app.cache_backend import MemoryCacheBackend
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    monkeypatch.setattr(cache, "global_message_cache", MemoryCacheBackend(30, 100))
+    settings = cache.CacheSettings(ack_batch_size=3, reconnect_delay=0.001)
+    target = cache.CacheConsumer(settings, shared=False)
+    target.channel = Mock(is_open=True)
+    return target
+
+
+def deliver(consumer, tag, body, headers=None):
+    method = SimpleNamespace(delivery_tag=tag)
+    properties = SimpleNamespace(headers=headers)
+    consumer.on_message(consumer.channel, method, properties, body)
+
+
+def message(tx_id):
+    return json.dumps({"transaction_id": tx_id}).encode()
+
+
+def test_acks_in_batches(consumer):
+    for tag in range(1, 6):
+        deliver(consumer, tag, message(f"tx-{tag}"))
+    consumer.channel.basic_ack.assert_called_once_with(delivery_tag=3, multiple=True)
+
+    consumer.flush_acks()
+    consumer.channel.basic_ack.assert_called_with(delivery_tag=5, multiple=True)
+    assert cache.get_transaction("tx-5", timeout=0) == {"transaction_id": "tx-5"}
+
+
+def test_rejects_malformed_message(consumer):
+    deliver(consumer, 1, message("tx-1"))
+    deliver(consumer, 2, b"not json")
+    deliver(consumer, 3, json.dumps({"wallet_id": "w"}).encode())
+
+    # 先确认之前处理完的消息，再单独拒绝格式错误的消息
+    consumer.channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=True)
+    consumer.channel.basic_nack.assert_any_call(delivery_tag=2, requeue=False)
+    consumer.channel.basic_nack.assert_any_call(delivery_tag=3, requeue=False)
+    assert consumer.rejected == 2
+
+
+def test_requeues_when_cache_fails(consumer, monkeypatch):
+    monkeypatch.setattr(cache.global_message_cache, "put", Mock(side_effect=OSError("disk full")))
+    deliver(consumer, 1, message("tx-1"))
+    consumer.channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+    assert consumer.requeued == 1
+
+
+def test_records_lag(consumer):
+    published_at = int((time.time() - 2) * 1000)
+    deliver(consumer, 1, message("tx-1"), headers={"published_at_ms": published_at})
+    assert 1.5 < consumer.lag_seconds < 5
+
+
+def test_reconnects_with_backoff(consumer, monkeypatch):
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 3:
+            consumer._stopping.set()
+        raise pika.exceptions.AMQPConnectionError("broker down")
+
+    monkeypatch.setattr(consumer, "connect", connect)
+    consumer.consume()
+    assert len(attempts) == 3
+    assert consumer.reconnects == 2
+    assert not consumer.connected
@@ -0,0 +1,134 @@
+import json
+import sys
+import time
+from concurrent.futures import Future
+from unittest.mock import Mock
+
+import pytest
+
+from app import cache
+from app.cache_backend import MemoryCacheBackend
+from app.direct import DirectReceiver
+from benchmarks.load import API_SERVER_DIR
+
+if API_SERVER_DIR not in sys.path:
+    sys.path.append(API_SERVER_DIR)
+from direct import DirectPublisher  # noqa: E402
+
+
+class RecordingFallback:
+    def __init__(self):
+        self.bodies = []
+
+    def start(self):
+        pass
+
+    def stop(self, timeout=5.0):
+        pass
+
+    def publish(self, body, routing_key=None):
+        self.bodies.append(body)
+        future = Future()
+        future.set_result(True)
+        return future
+
+
+def _message(transaction_id):
+    return json.dumps({"transaction_id": transaction_id, "wallet_id": "w"}).encode()
+
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "global_message_cache", MemoryCacheBackend(30, 100))
+    return str(tmp_path / "direct.sock")
+
+
+@pytest.fixture
+def receiver(socket_path):
+    receiver = DirectReceiver(socket_path, shared=False)
+    receiver.start()
+    deadline = time.monotonic() + 2
+    while not receiver.listening and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield receiver
+    receiver.stop()
+
+
+def _publisher(socket_path, fallback=None):
+    publisher = DirectPublisher(socket_path, fallback=fallback, reconnect_delay=0.05)
+    publisher.start()
+    return publisher
+
+
+def test_messages_are_cached_before_ack(socket_path, receiver):
+    publisher = _publisher(socket_path)
+    try:
+        futures = [publisher.publish(_message(f"tx-{i}")) for i in range(50)]
+        futures.append(publisher.publish(b"not json"))
+        assert all(f.result(timeout=2) for f in futures)
+    finally:
+        publisher.stop()
+
+    assert cache.get_transaction("tx-0", timeout=0) == {"transaction_id": "tx-0", "wallet_id": "w"}
+    assert receiver.messages == 50
+    assert receiver.rejected == 1
+    assert publisher.stats["direct"] == 51
+    assert receiver.lag_seconds is not None
+
+
+def test_falls_back_when_receiver_is_down(socket_path):
+    fallback = RecordingFallback()
+    publisher = _publisher(socket_path, fallback)
+    try:
+        assert publisher.publish(_message("tx-1")).result(timeout=2)
+    finally:
+        publisher.stop()
+    assert fallback.bodies == [_message("tx-1")]
+    assert publisher.stats["fallback"] == 1
+
+
+def test_falls_back_when_cache_write_fails(socket_path, receiver, monkeypatch):
+    monkeypatch.setattr(cache.global_message_cache, "put", Mock(side_effect=OSError("disk full")))
+    fallback = RecordingFallback()
+    publisher = _publisher(socket_path, fallback)
+    try:
+        assert publisher.publish(_message("tx-1")).result(timeout=2)
+    finally:
+        publisher.stop()
+    assert fallback.bodies == [_message("tx-1")]
+    assert receiver.failed_batches == 1
+
+
+def test_reconnects_after_receiver_restart(socket_path, receiver):
+    fallback = RecordingFallback()
+    publisher = _publisher(socket_path, fallback)
+    try:
+        assert publisher.publish(_message("tx-1")).result(timeout=2)
+        receiver.stop()
+        restarted = DirectReceiver(socket_path, shared=False)
+        restarted.start()
+        try:
+            deadline = time.monotonic() + 2
+            while restarted.messages == 0 and time.monotonic() < deadline:
+                publisher.publish(_message("tx-2")).result(timeout=2)
+                time.sleep(0.02)
+        finally:
+            restarted.stop()
+    finally:
+        publisher.stop()
+    assert restarted.messages >= 1
+    assert publisher.stats["failures"] >= 1
+
+
+def test_only_local_partitions_are_sent_directly(socket_path, receiver):
+    fallback = RecordingFallback()
+    publisher = DirectPublisher(socket_path, fallback=fallback, routing_keys=["p0", "p1"])
+    publisher.start()
+    try:
+        assert publisher.publish(_message("tx-local"), routing_key="p1").result(timeout=2)
+        assert publisher.publish(_message("tx-remote"), routing_key="p2").result(timeout=2)
+    finally:
+        publisher.stop()
+    assert fallback.bodies == [_message("tx-remote")]
+    assert receiver.messages == 1
+    assert cache.get_transaction("tx-remote", timeout=0) is None
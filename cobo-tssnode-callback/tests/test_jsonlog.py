@@ -0,0 +1,107 @@
+import io
+import json
+import logging
+import os
+import queue
+
+import pytest
+
+from app import jsonlog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _record(msg="hello %s", args=("world",), level=logging.INFO, lineno=10, **extra):
+    record = logging.LogRecord("app.test", level, "test.py", lineno, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.fixture
+def root_logging():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    jsonlog.shutdown_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_copies_are_identical():
+    with open(os.path.join(ROOT, "cobo-tssnode-callback", "app", "jsonlog.py")) as f:
+        tss_copy = f.read()
+    with open(os.path.join(ROOT, "cobo_api_callback_server", "jsonlog.py")) as f:
+        api_copy = f.read()
+    assert tss_copy == api_copy
+
+
+def test_formatter_redacts_and_limits_fields():
+    formatter = jsonlog.JsonFormatter(max_field_length=8)
+    record = _record(
+        request_id="req-1",
+        payload={"token": "abc", "nested": {"Password": "x"}, "data": "0123456789"},
+        signature="deadbeef",
+    )
+    entry = json.loads(formatter.format(record))
+    assert entry["msg"] == "hello wo...(+3 chars)"
+    assert entry["level"] == "INFO"
+    assert entry["request_id"] == "req-1"
+    assert entry["payload"] == {
+        "token": "***", "nested": {"Password": "***"}, "data": "01234567...(+2 chars)",
+    }
+    assert entry["signature"] == "***"
+
+
+def test_rate_limit_per_call_site():
+    now = [0.0]
+    limit = jsonlog.RateLimitFilter(rate=1, burst=2, clock=lambda: now[0])
+    assert [limit.filter(_record(f"msg {i}", ())) for i in range(4)] == [True, True, False, False]
+    # 其他调用位置和警告不受影响
+    assert limit.filter(_record(lineno=11))
+    assert limit.filter(_record(level=logging.WARNING))
+
+    now[0] = 1.0
+    record = _record()
+    assert limit.filter(record)
+    assert record.suppressed == 2
+    assert limit.dropped == 2
+
+
+def test_sampling():
+    limit = jsonlog.RateLimitFilter(rate=0)
+    assert not limit.filter(_record(sample=0))
+    assert limit.filter(_record(sample=1))
+
+
+def test_queue_handler_drops_when_full():
+    handler = jsonlog.NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    handler.handle(_record())
+    handler.handle(_record())
+    assert handler.dropped == 1
+
+
+def test_setup_logging_writes_json_lines(tmp_path, root_logging):
+    stream = io.StringIO()
+    validator_log = tmp_path / "validator.log"
+    jsonlog.setup_logging(stream=stream, files={"app.validator": str(validator_log)})
+
+    with jsonlog.request_context("req-42"):
+        logging.getLogger("app.validator").warning("Chain %s mismatch", "ETH")
+    logging.getLogger("app.cache").info("cached", extra={"transaction_id": "tx-1"})
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("app.cache").exception("failed")
+    jsonlog.shutdown_logging()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert lines[0]["msg"] == "Chain ETH mismatch"
+    assert lines[0]["request_id"] == "req-42"
+    assert "request_id" not in lines[1]
+    assert lines[1]["transaction_id"] == "tx-1"
+    assert "ValueError: boom" in lines[2]["exc"]
+    file_lines = validator_log.read_text().splitlines()
+    assert [json.loads(line)["logger"] for line in file_lines] == ["app.validator"]
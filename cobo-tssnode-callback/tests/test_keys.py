@@ -0,0 +1,73 @@
+import base64
+import json
+
+import cobo_waas2
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import Flask
+
+from app.keys import KeyManager
+from app.service import create_response
+
+
+def generate_pem_pair(key_size=2048):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption(),
+    )
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return public_pem, private_pem
+
+
+@pytest.fixture
+def key_manager():
+    return KeyManager.from_pem(*generate_pem_pair())
+
+
+@pytest.fixture
+def app(key_manager):
+    _app = Flask(__name__)
+    _app.config.update(
+        SERVICE_NAME="test-service",
+        TOKEN_EXPIRE_MINUTES=30,
+        SERVICE_PRIVATE_KEY=key_manager.service_private_key,
+        CLIENT_PUBLIC_KEY=key_manager.client_public_key,
+    )
+    return _app
+
+
+def test_key_manager_parsed_keys_roundtrip(key_manager):
+    token = jwt.encode({"a": 1}, key_manager.service_private_key, algorithm="RS256")
+    decoded = jwt.decode(token, key_manager.client_public_key, algorithms=["RS256"])
+    assert decoded == {"a": 1}
+
+
+def test_key_manager_rejects_invalid_keys():
+    _, private_pem = generate_pem_pair()
+    with pytest.raises(ValueError):
+        KeyManager.from_pem(b"not a key", private_pem)
+
+    with pytest.raises(ValueError):
+        KeyManager.from_pem(*generate_pem_pair(key_size=1024))
+
+
+def test_ping_responses_carry_their_own_request_id(app, key_manager):
+    tokens = []
+    for request_id in ("ping-1", "ping-2"):
+        response = cobo_waas2.TSSCallbackResponse(
+            status=0, request_id=request_id, action=cobo_waas2.TSSCallbackActionType.APPROVE
+        )
+        token, _ = create_response(app, response)
+        tokens.append(token)
+
+    request_ids = []
+    for token in tokens:
+        claim = jwt.decode(token, key_manager.client_public_key, algorithms=["RS256"])
+        request_ids.append(json.loads(base64.b64decode(claim["package_data"]))["request_id"])
+    assert request_ids == ["ping-1", "ping-2"]
@@ -0,0 +1,64 @@
+import json
+
+import cobo_waas2
+import pytest
+
+from app.keysign import KeySignParseError, parse_key_sign
+from benchmarks.fixtures import evm_keysign_request, evm_transaction
+
+
+def _request(nonce=7):
+    tx = evm_transaction(nonce)
+    request = evm_keysign_request(tx, nonce)
+    return tx, request["request_detail"], request["extra_info"]
+
+
+def test_fast_fields_match_sdk_models():
+    _, request_detail, extra_info = _request()
+    detail, extra = parse_key_sign(request_detail, extra_info)
+    expected_detail = cobo_waas2.TSSKeySignRequest.from_json(request_detail)
+    expected = cobo_waas2.TSSKeySignExtra.from_json(extra_info).transaction
+
+    assert detail.msg_hash_list == expected_detail.msg_hash_list
+    tx = extra.transaction
+    for name in ("transaction_id", "wallet_id", "chain_id", "created_timestamp"):
+        assert getattr(tx, name) == getattr(expected, name)
+    assert tx.raw_tx_info.unsigned_raw_tx == expected.raw_tx_info.unsigned_raw_tx
+    assert tx.raw_tx_info.used_nonce == expected.raw_tx_info.used_nonce
+
+
+def test_other_fields_fall_back_to_sdk_model():
+    tx, request_detail, extra_info = _request()
+    _, extra = parse_key_sign(request_detail, extra_info)
+    assert extra.transaction._model is None
+    assert extra.transaction.status == tx["status"]
+    assert isinstance(extra.transaction.model, cobo_waas2.Transaction)
+    assert extra.org is None
+
+
+def test_numeric_strings_are_coerced():
+    _, request_detail, extra_info = _request()
+    raw = json.loads(extra_info)
+    raw["transaction"]["created_timestamp"] = str(raw["transaction"]["created_timestamp"])
+    raw["transaction"]["raw_tx_info"]["used_nonce"] = "7"
+    _, extra = parse_key_sign(request_detail, json.dumps(raw))
+    assert isinstance(extra.transaction.created_timestamp, int)
+    assert extra.transaction.raw_tx_info.used_nonce == 7
+
+
+@pytest.mark.parametrize("request_detail, extra_info", [
+    ('{"msg_hash_list": "0x00"}', '{"transaction": {}}'),
+    ('{"msg_hash_list": [1]}', '{"transaction": {}}'),
+    ("{}", '{"transaction": []}'),
+    ("{}", '{"transaction": {"created_timestamp": "soon"}}'),
+    ("[]", "{}"),
+    ("null", "{}"),
+])
+def test_malformed_fields(request_detail, extra_info):
+    with pytest.raises(KeySignParseError):
+        parse_key_sign(request_detail, extra_info)
+
+
+def test_missing_transaction():
+    _, extra = parse_key_sign("{}", "{}")
+    assert extra.transaction is None
@@ -0,0 +1,41 @@
+import pytest
+
+from app import cache, snapshot
+from benchmarks.fixtures import CallbackSigner
+from benchmarks.load import InProcessCallbackServer, InProcessTss, LoadResult, run_scenario
+
+
+def test_percentiles():
+    result = LoadResult("x", 10, 1000, 0, 1.0, [i / 1000 for i in range(1, 1001)])
+    assert result.percentile(50) == 0.5
+    assert result.percentile(99) == 0.99
+    assert result.percentile(99.9) == 0.999
+    assert result.summary()["rps"] == 1000
+
+
+@pytest.fixture
+def tss(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "_current", snapshot._current)
+    monkeypatch.setattr(cache, "settings", cache.settings)
+    target = InProcessTss(str(tmp_path))
+    yield target
+    target.close()
+
+
+@pytest.mark.parametrize("scenario", ["ping", "keysign-evm", "cache-miss"])
+def test_tss_scenarios(tss, scenario):
+    result = run_scenario(scenario, tss, rate=50, duration=0.2, workers=4)
+    assert result.sent == 10
+    assert result.errors == 0
+
+
+def test_callback_scenario_feeds_cache(tss):
+    signer = CallbackSigner()
+    server = InProcessCallbackServer(tss.broker, signer)
+    try:
+        result = run_scenario("callback", tss, 50, 0.2, 4, server, signer)
+    finally:
+        server.close()
+    assert result.errors == 0
+    tss.broker.join()
+    assert cache.get_cache_size() == 10
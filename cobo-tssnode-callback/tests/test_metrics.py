@@ -0,0 +1,43 @@
+from app import metrics
+from benchmarks.fixtures import evm_keysign_request, evm_transaction, cache_message, ping_request
+from tests.test_load import tss  # noqa: F401
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram("test_seconds", "Test", labelnames=("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(5, "a")
+    text = histogram.render()
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="a",le="1.0"} 2' in text
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'test_seconds_count{stage="a"} 3' in text
+    assert histogram.count("a") == 3
+
+
+def test_counter_escapes_labels():
+    counter = metrics.Counter("test_total", "Test", labelnames=("type",))
+    counter.inc('a"b')
+    counter.inc('a"b', amount=2)
+    assert counter.value('a"b') == 3
+    assert 'test_total{type="a\\"b"} 3' in counter.render()
+
+
+def test_metrics_endpoint(tss):  # noqa: F811
+    transaction = evm_transaction(nonce=1)
+    tss.publish(cache_message(transaction))
+    tss.broker.join()
+    tss.check(tss.client.token(evm_keysign_request(transaction, 1)))
+    tss.check(tss.client.token(ping_request()))
+
+    response = tss.app.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    text = response.get_data(as_text=True)
+    for stage in ("verify_token", "parse_extra", "hash_verify", "get_transaction",
+                  "compare_transaction", "policy", "create_token", "request"):
+        assert f'tss_callback_stage_seconds_count{{stage="{stage}"}}' in text
+    assert 'tss_callback_requests_total{request_type="KEYSIGN",status="0"}' in text
+    assert "tss_callback_cache_hit_ratio" in text
+    assert "tss_callback_consumer_last_message_age_seconds" in text
@@ -0,0 +1,54 @@
+import os
+from unittest.mock import Mock
+
+import pytest
+
+from app import cache, partition
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_copies_are_identical():
+    with open(os.path.join(ROOT, "cobo-tssnode-callback", "app", "partition.py")) as f:
+        tss_copy = f.read()
+    with open(os.path.join(ROOT, "cobo_api_callback_server", "partition.py")) as f:
+        api_copy = f.read()
+    assert tss_copy == api_copy
+
+
+def test_partitions_are_balanced_and_consistent():
+    keys = [f"wallet-{i}" for i in range(20000)]
+    counts = [0] * 8
+    for key in keys:
+        counts[partition.partition_for(key, 8)] += 1
+    assert min(counts) > 2000
+
+    # 分区数从 8 增加到 9 时只有约 1/9 的 key 换到新分区
+    moved = [key for key in keys if partition.partition_for(key, 8) != partition.partition_for(key, 9)]
+    assert len(moved) < len(keys) * 0.15
+    assert all(partition.partition_for(key, 9) == 8 for key in moved)
+
+
+def test_parse_partitions():
+    assert partition.parse_partitions("", 4) == [0, 1, 2, 3]
+    assert partition.parse_partitions("0-2, 5", 8) == [0, 1, 2, 5]
+    with pytest.raises(ValueError):
+        partition.parse_partitions("6-8", 8)
+
+
+def test_consumer_binds_only_its_partitions(monkeypatch):
+    connection = Mock()
+    monkeypatch.setattr(cache.pika, "BlockingConnection", Mock(return_value=connection))
+    settings = cache.CacheSettings(partition_count=8, partitions="2-3")
+    consumer = cache.CacheConsumer(settings, shared=False)
+    consumer.connect()
+
+    channel = connection.channel.return_value
+    channel.exchange_declare.assert_called_once_with(
+        exchange=partition.EXCHANGE, exchange_type="direct", durable=False)
+    assert [c.kwargs["routing_key"] for c in channel.queue_bind.call_args_list] == ["p2", "p3"]
+    assert [c.kwargs["queue"] for c in channel.basic_consume.call_args_list] == ["cobo.p2", "cobo.p3"]
+
+
+def test_unpartitioned_consumer_uses_the_cobo_queue():
+    assert cache.CacheSettings().queues() == ["cobo"]
@@ -0,0 +1,97 @@
+import time
+from decimal import Decimal
+
+import pytest
+
+from app import validator
+from app.policy import PolicyContext, PolicyEngine, SQLiteVelocityStore, VelocityCounter
+
+WALLET = "wallet-1"
+
+POLICIES = [
+    {"name": "eth-cap", "chain_id": "ETH", "token_id": "ETH", "max_amount": "10"},
+    {"name": "eth-tokens", "chain_id": "ETH", "token_allowlist": ["ETH", "ETH_USDT"]},
+    {"name": "eth-hourly", "chain_id": "ETH", "token_id": "ETH",
+     "velocity": {"max_amount": "15", "window_seconds": 3600}},
+    {"name": "wallet-cap", "wallet_id": "wallet-2", "max_amount": "1"},
+]
+
+
+def ctx(amount, token_id="ETH", wallet_id=WALLET, chain_id="ETH"):
+    return PolicyContext(chain_id, wallet_id, token_id,
+                         Decimal(amount) if amount is not None else None)
+
+
+def test_caps_and_allowlist():
+    engine = PolicyEngine.from_specs(POLICIES)
+    assert engine.evaluate(ctx("5")) is None
+    assert "eth-cap" in engine.evaluate(ctx("11"))
+    assert "eth-tokens" in engine.evaluate(ctx("1", token_id="ETH_DAI"))
+    assert "wallet-cap" in engine.evaluate(ctx("2", token_id="ETH_USDT", wallet_id="wallet-2"))
+    # 其他链不受 ETH 规则约束
+    assert engine.evaluate(ctx("100", token_id="SOL", chain_id="SOL")) is None
+    assert "amount is unknown" in engine.evaluate(ctx(None))
+
+
+def test_velocity_window():
+    engine = PolicyEngine.from_specs(POLICIES)
+    now = 1_000_000.0
+    assert engine.evaluate(ctx("8"), now=now) is None
+    assert "eth-hourly" in engine.evaluate(ctx("8"), now=now + 60)
+    # 被拒绝的请求不计入累计金额
+    assert engine.evaluate(ctx("7"), now=now + 60) is None
+    assert engine.evaluate(ctx("1", wallet_id="wallet-3"), now=now + 60) is None
+    assert engine.evaluate(ctx("8"), now=now + 3600 + 120) is None
+
+
+def test_velocity_counter_is_bounded():
+    counter = VelocityCounter(Decimal(10), 60, buckets=6, max_keys=3)
+    for i in range(5):
+        counter.add((i,), Decimal(1), 0)
+    assert len(counter) == 3
+    assert counter.total((0,), 0) == 0
+    assert counter.total((4,), 0) == 1
+
+
+def test_full_velocity_counter_fails_closed():
+    specs = [{"name": "hourly", "velocity": {"max_amount": "15", "window_seconds": 3600, "max_wallets": 2}}]
+    engine = PolicyEngine.from_specs(specs)
+    now = 1_000_000.0
+    assert engine.evaluate(ctx("8", wallet_id="w1"), now=now) is None
+    assert engine.evaluate(ctx("8", wallet_id="w2"), now=now) is None
+    # 计数已满且都在窗口内时拒绝新钱包，而不是淘汰 w1 的累计金额
+    assert "velocity counter is full" in engine.evaluate(ctx("1", wallet_id="w3"), now=now + 60)
+    assert "hourly" in engine.evaluate(ctx("8", wallet_id="w1"), now=now + 60)
+    # 窗口过后最早的钱包可以被淘汰
+    assert engine.evaluate(ctx("1", wallet_id="w3"), now=now + 3600 + 120) is None
+
+
+def test_shared_store_limits_across_engines(tmp_path):
+    path = str(tmp_path / "velocity.db")
+    first = PolicyEngine.from_specs(POLICIES, SQLiteVelocityStore(path))
+    second = PolicyEngine.from_specs(POLICIES, SQLiteVelocityStore(path))
+    now = 1_000_000.0
+    assert first.evaluate(ctx("8"), now=now) is None
+    # 另一个 worker 看到同一份累计金额
+    assert "eth-hourly" in second.evaluate(ctx("8"), now=now + 60)
+    assert second.evaluate(ctx("7"), now=now + 60) is None
+    assert "eth-hourly" in first.evaluate(ctx("0.5"), now=now + 120)
+    assert first.evaluate(ctx("8"), now=now + 3600 + 120) is None
+
+
+def test_evaluate_is_fast():
+    engine = PolicyEngine.from_specs(POLICIES)
+    start = time.perf_counter()
+    for i in range(2000):
+        engine.evaluate(ctx("0.001", wallet_id=f"w{i % 100}"))
+    per_call = (time.perf_counter() - start) / 2000
+    assert per_call < 200e-6
+
+
+def test_enforce_policy_rejects():
+    engine = PolicyEngine.from_specs(POLICIES)
+    tx = {"transaction_id": "tx-1", "chain_id": "ETH", "wallet_id": WALLET,
+          "token_id": "ETH", "amount": "20"}
+    with pytest.raises(Exception, match="eth-cap"):
+        validator.enforce_policy(engine, tx)
+    validator.enforce_policy(engine, dict(tx, amount="1"))
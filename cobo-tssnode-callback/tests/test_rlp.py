@@ -0,0 +1,82 @@
+import pytest
+
+from app.rlp import (
+    ACCESS_LIST_TX,
+    DYNAMIC_FEE_TX,
+    LEGACY_TX,
+    RLPDecodeError,
+    decode_evm_transaction,
+)
+
+RECIPIENT = bytes.fromhex("5aaeb6053f3e94c9b9a09f33669435e7ef1beaed")
+TOKEN = bytes.fromhex("dac17f958d2ee523a2206206994597c13d831ec7")
+
+
+def rlp_encode(item):
+    if isinstance(item, int):
+        item = item.to_bytes((item.bit_length() + 7) // 8, "big")
+    if isinstance(item, bytes):
+        if len(item) == 1 and item[0] < 0x80:
+            return item
+        return _length_prefix(len(item), 0x80) + item
+    payload = b"".join(rlp_encode(i) for i in item)
+    return _length_prefix(len(payload), 0xC0) + payload
+
+
+def _length_prefix(length, offset):
+    if length < 56:
+        return bytes([offset + length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([offset + 55 + len(encoded)]) + encoded
+
+
+def test_decode_legacy_eip155():
+    raw = rlp_encode([9, 20 * 10**9, 21000, RECIPIENT, 10**18, b"", 1, 0, 0])
+    tx = decode_evm_transaction(raw)
+
+    assert tx.tx_type == LEGACY_TX
+    assert tx.chain_id == 1
+    assert tx.nonce == 9
+    assert tx.to == "0x" + RECIPIENT.hex()
+    assert tx.value == 10**18
+    assert (tx.gas_limit, tx.max_fee_per_gas, tx.max_priority_fee_per_gas) == (21000, 20 * 10**9, None)
+    assert tx.transfer_recipient() == tx.to
+
+
+def test_decode_eip2930():
+    raw = bytes([1]) + rlp_encode([5, 0, 1, 21000, RECIPIENT, 7, b"", []])
+    tx = decode_evm_transaction(raw)
+
+    assert tx.tx_type == ACCESS_LIST_TX
+    assert (tx.chain_id, tx.nonce, tx.value) == (5, 0, 7)
+
+
+def test_decode_eip1559_erc20_transfer():
+    calldata = (
+        bytes.fromhex("a9059cbb") + bytes(12) + RECIPIENT + (2500000).to_bytes(32, "big")
+    )
+    raw = bytes([2]) + rlp_encode([1, 3, 1, 2, 60000, TOKEN, 0, calldata, []])
+    tx = decode_evm_transaction(raw)
+
+    assert tx.tx_type == DYNAMIC_FEE_TX
+    assert tx.to == "0x" + TOKEN.hex()
+    assert tx.data == calldata
+    assert tx.transfer_recipient() == "0x" + RECIPIENT.hex()
+    assert tx.transfer_amount() == 2500000
+    assert (tx.gas_limit, tx.max_fee_per_gas, tx.max_priority_fee_per_gas) == (60000, 2, 1)
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        b"",
+        bytes([3]) + rlp_encode([1]),
+        rlp_encode([1, 2, 3]),
+        rlp_encode([0, 0, 0, RECIPIENT, 1, b""])[:-1],
+        rlp_encode([b"\x00\x01", 0, 0, RECIPIENT, 1, b""]),
+        rlp_encode([0, 0, 0, b"\x01\x02", 1, b""]),
+    ],
+)
+def test_decode_rejects_malformed(raw):
+    with pytest.raises(RLPDecodeError):
+        decode_evm_transaction(raw)
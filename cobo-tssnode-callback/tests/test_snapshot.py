@@ -0,0 +1,102 @@
+import os
+import time
+
+import pytest
+
+from app import snapshot
+from app.config import ServiceConfig
+from tests.test_keys import generate_pem_pair
+
+
+@pytest.fixture(autouse=True)
+def restore_snapshot(monkeypatch):
+    monkeypatch.setattr(snapshot, "_current", None)
+    yield
+    snapshot.stop_watcher()
+
+
+def write(path, text):
+    # 原子替换，inode 变化，与部署工具写配置文件的方式一致
+    with open(f"{path}.tmp", "w" if isinstance(text, str) else "wb") as f:
+        f.write(text)
+    os.replace(f"{path}.tmp", path)
+
+
+@pytest.fixture
+def env_file(tmp_path):
+    path = str(tmp_path / ".env")
+    write(path, "EVM_CHAINS=ETH, SETH\nEVM_CHAIN_IDS=ETH:1,SETH:11155111\nTOKEN_DECIMALS=ETH_USDT:6\n"
+                "TOKEN_CONTRACTS=ETH_USDT:0xdAC17F958D2ee523a2206206994597C13D831ec7\n")
+    return path
+
+
+@pytest.fixture
+def service_config(tmp_path):
+    public_pem, private_pem = generate_pem_pair()
+    config = ServiceConfig(
+        client_public_key_path=str(tmp_path / "pub.key"),
+        service_private_key_path=str(tmp_path / "pri.pem"),
+        policy_path=str(tmp_path / "policy.yaml"),
+        token_expire_minutes=5,
+    )
+    write(config.client_public_key_path, public_pem)
+    write(config.service_private_key_path, private_pem)
+    return config
+
+
+def test_reload_swaps_snapshot_and_keeps_the_old_one_intact(env_file):
+    first = snapshot.load(env_file)
+    assert first.evm_chains == {"ETH", "SETH"}
+    assert first.evm_chain_ids["SETH"] == 11155111
+    assert first.token_contracts["ETH_USDT"] == "0xdac17f958d2ee523a2206206994597c13d831ec7"
+    assert not snapshot.reload()
+
+    write(env_file, "EVM_CHAINS=ETH\nSOLANA_CHAINS=SOL\nTOKEN_DECIMALS=ETH_USDT:6\n")
+    assert snapshot.reload()
+
+    second = snapshot.current()
+    assert second.version == first.version + 1
+    assert second.evm_chains == {"ETH"} and second.solana_chains == {"SOL"}
+    # 进行中的请求持有的旧快照不受影响
+    assert first.evm_chains == {"ETH", "SETH"}
+    with pytest.raises(TypeError):
+        first.evm_chain_ids["BSC"] = 56
+
+
+def test_failed_reload_keeps_previous_snapshot(env_file):
+    first = snapshot.load(env_file)
+    write(env_file, "EVM_CHAINS=ETH\nEVM_CHAIN_IDS=ETH:one\n")
+    assert not snapshot.reload()
+    assert snapshot.current().evm_chains == first.evm_chains
+    # 文件再次变化前不重复尝试
+    assert not snapshot.current().changed_files()
+
+    write(env_file, "EVM_CHAINS=ETH\nEVM_CHAIN_IDS=ETH:1\n")
+    assert snapshot.reload()
+    assert snapshot.current().evm_chains == {"ETH"}
+
+
+def test_reloads_rotated_keys_and_policy(env_file, service_config):
+    first = snapshot.load(env_file, service_config)
+    assert first.key_manager is not None and first.policy is None
+
+    public_pem, private_pem = generate_pem_pair()
+    write(service_config.service_private_key_path, private_pem)
+    write(service_config.client_public_key_path, public_pem)
+    write(service_config.policy_path, "policies:\n  - name: cap\n    max_amount: 10\n")
+    assert snapshot.reload()
+
+    second = snapshot.current()
+    assert second.key_manager is not first.key_manager
+    assert len(second.policy.rules) == 1
+    assert second.config.token_expire_minutes == 5
+
+
+def test_watcher_reloads_in_background(env_file):
+    snapshot.load(env_file)
+    snapshot.start_watcher(0.01)
+    write(env_file, "EVM_CHAINS=BSC\n")
+    deadline = time.monotonic() + 2
+    while snapshot.current().evm_chains != {"BSC"} and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert snapshot.current().evm_chains == {"BSC"}
@@ -0,0 +1,155 @@
+import hashlib
+
+import pytest
+
+from app.solana import (
+    ASSOCIATED_TOKEN_PROGRAM_ID,
+    COMPUTE_BUDGET_PROGRAM_ID,
+    SYSTEM_PROGRAM_ID,
+    TOKEN_PROGRAM_ID,
+    SolanaParseError,
+    associated_token_address,
+    b58decode,
+    b58encode,
+    extract_message,
+    is_on_curve,
+    message_matches_hash,
+    parse_message,
+)
+
+PAYER = bytes(range(1, 33))
+RECIPIENT = bytes(range(101, 133))
+BLOCKHASH = bytes([7]) * 32
+
+
+def compact_u16(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def build_message(keys, instructions, version=None, lookups=b""):
+    out = bytearray()
+    if version is not None:
+        out.append(0x80 | version)
+    out += bytes([1, 0, 1])
+    out += compact_u16(len(keys)) + b"".join(keys)
+    out += BLOCKHASH
+    out += compact_u16(len(instructions))
+    for program_index, accounts, data in instructions:
+        out.append(program_index)
+        out += compact_u16(len(accounts)) + bytes(accounts)
+        out += compact_u16(len(data)) + data
+    if version is not None:
+        out += lookups or compact_u16(0)
+    return bytes(out)
+
+
+def system_transfer_message(lamports=1500000000, version=None):
+    data = (2).to_bytes(4, "little") + lamports.to_bytes(8, "little")
+    return build_message(
+        [PAYER, RECIPIENT, SYSTEM_PROGRAM_ID], [(2, [0, 1], data)], version=version
+    )
+
+
+def test_base58_roundtrip():
+    assert b58encode(SYSTEM_PROGRAM_ID) == "1" * 32
+    assert b58encode(b58decode(TOKEN_PROGRAM_ID)) == TOKEN_PROGRAM_ID
+
+
+@pytest.mark.parametrize("version", [None, 0])
+def test_parse_system_transfer(version):
+    message = parse_message(system_transfer_message(version=version))
+
+    assert message.version == version
+    assert message.recent_blockhash == BLOCKHASH
+    (transfer,) = message.transfers()
+    assert transfer.kind == "system"
+    assert transfer.source == PAYER
+    assert transfer.destination_address == b58encode(RECIPIENT)
+    assert transfer.amount == 1500000000
+
+
+def test_parse_spl_transfer_checked():
+    mint = bytes([9]) * 32
+    data = bytes([12]) + (2500000).to_bytes(8, "little") + bytes([6])
+    raw = build_message(
+        [PAYER, RECIPIENT, mint, b58decode(TOKEN_PROGRAM_ID)],
+        [(3, [0, 2, 1, 0], data)],
+    )
+    (transfer,) = parse_message(raw).transfers()
+
+    assert transfer.kind == "spl"
+    assert transfer.destination == RECIPIENT
+    assert transfer.mint == mint
+    assert (transfer.amount, transfer.decimals) == (2500000, 6)
+
+
+def test_associated_token_address():
+    # 结果与 solders 的 Pubkey.find_program_address 和 is_on_curve 一致
+    mint = bytes([9]) * 32
+    address = associated_token_address(RECIPIENT, mint, b58decode(TOKEN_PROGRAM_ID))
+
+    assert b58encode(address) == "AhHNwqd1fdzmk6JrAa6PMawn2cTA4fihX59J58RVLh7N"
+    assert not is_on_curve(address)
+    assert [is_on_curve(hashlib.sha256(bytes([i])).digest()) for i in range(8)] == [
+        False, True, False, True, False, False, True, True,
+    ]
+
+
+def test_classify_instructions():
+    mint = bytes([9]) * 32
+    token_account = associated_token_address(RECIPIENT, mint, b58decode(TOKEN_PROGRAM_ID))
+    keys = [
+        PAYER, token_account, RECIPIENT, mint, SYSTEM_PROGRAM_ID, b58decode(TOKEN_PROGRAM_ID),
+        b58decode(ASSOCIATED_TOKEN_PROGRAM_ID), b58decode(COMPUTE_BUDGET_PROGRAM_ID),
+    ]
+    message = parse_message(build_message(keys, [
+        (7, [], bytes([3]) + (1000).to_bytes(8, "little")),
+        (6, [0, 1, 2, 3, 4, 5], bytes([1])),
+        (6, [0, 1, 2, 3, 4, 5], bytes([2])),
+        (4, [0, 1], (0).to_bytes(4, "little") + bytes(48)),
+    ]))
+    compute_budget, create, recover_nested, create_account = message.instructions
+
+    assert message.is_auxiliary(compute_budget)
+    assert message.associated_account_creation(create) == (token_account, RECIPIENT, mint)
+    assert message.associated_account_creation(recover_nested) is None
+    assert not message.is_auxiliary(create_account)
+    assert message.transfer(create_account) is None
+
+
+def test_extract_message_from_transaction():
+    message = system_transfer_message()
+    transaction = compact_u16(1) + bytes(64) + message
+
+    assert extract_message(message) == message
+    assert extract_message(transaction) == message
+
+
+def test_message_matches_hash():
+    message = system_transfer_message()
+
+    assert message_matches_hash(message, message.hex())
+    assert message_matches_hash(message, "0x" + hashlib.sha256(message).hexdigest())
+    assert not message_matches_hash(message, hashlib.sha256(b"other").hexdigest())
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        b"",
+        system_transfer_message()[:-1],
+        system_transfer_message() + b"\0",
+        build_message([PAYER, SYSTEM_PROGRAM_ID], [(5, [0], b"")]),
+    ],
+)
+def test_parse_rejects_malformed(raw):
+    with pytest.raises(SolanaParseError):
+        parse_message(raw)
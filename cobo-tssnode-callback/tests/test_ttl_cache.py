@@ -0,0 +1,62 @@
+from app.ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_pop_returns_entry_once():
+    cache = TTLCache(30, clock=FakeClock())
+    cache.set("tx-1", {"wallet_id": "w"})
+
+    assert cache.pop("tx-1") == {"wallet_id": "w"}
+    assert cache.pop("tx-1") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_expired_entries_are_dropped_in_order():
+    clock = FakeClock()
+    expired = []
+    cache = TTLCache(30, clock=clock, on_expire=expired.append)
+    cache.set("tx-1", 1)
+    clock.now += 10
+    cache.set("tx-2", 2)
+
+    clock.now += 25
+    assert cache.get("tx-1") is None
+    assert cache.get("tx-2") == 2
+
+    clock.now += 10
+    cache.set("tx-3", 3)
+    assert expired == ["tx-1", "tx-2"]
+    assert len(cache) == 1
+    assert cache.stats()["expirations"] == 2
+
+
+def test_reinsert_refreshes_expiry():
+    clock = FakeClock()
+    cache = TTLCache(30, clock=clock)
+    cache.set("tx-1", 1)
+    cache.set("tx-2", 2)
+    clock.now += 20
+    cache.set("tx-1", 10)
+
+    clock.now += 15
+    assert cache.expire() == 1
+    assert cache.get("tx-1") == 10
+
+
+def test_full_cache_evicts_oldest_entry():
+    cache = TTLCache(30, max_size=2, clock=FakeClock())
+    cache.set("tx-1", 1)
+    cache.set("tx-2", 2)
+    cache.set("tx-3", 3)
+
+    assert cache.get("tx-1") is None
+    assert cache.get("tx-3") == 3
+    assert cache.stats()["evictions"] == 1
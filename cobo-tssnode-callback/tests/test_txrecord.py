@@ -0,0 +1,66 @@
+import json
+import os
+
+import pytest
+
+from app import cache, txrecord
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RECORD = {
+    "transaction_id": "f47ac10b-58cc-4372-a567-0e02b2c3d479",
+    "wallet_id": "wallet-1",
+    "chain_id": "ETH",
+    "created_timestamp": 1729000000000,
+    "token_id": "ETH_USDT",
+    "destination_type": "Address",
+    "destination_address": "0x5aaeb6053f3e94c9b9a09f33669435e7ef1beaed",
+    "amount": "12.5",
+    "request_id": "withdraw-42",
+    "fee_type": "EVM_EIP_1559",
+    "gas_limit": "60000",
+    "max_fee_per_gas": "30000000000",
+    "max_priority_fee_per_gas": "1000000000",
+}
+
+
+def test_copies_are_identical():
+    with open(os.path.join(ROOT, "cobo-tssnode-callback", "app", "txrecord.py")) as f:
+        tss_copy = f.read()
+    with open(os.path.join(ROOT, "cobo_api_callback_server", "txrecord.py")) as f:
+        api_copy = f.read()
+    assert tss_copy == api_copy
+
+
+def test_round_trip_is_smaller_than_json():
+    body = txrecord.encode({**RECORD, "gas_price": None, "unknown": "x"})
+    assert txrecord.decode(body) == RECORD
+    assert len(body) < len(json.dumps(RECORD)) * 0.6
+
+
+def test_decoder_ignores_fields_it_does_not_know():
+    body = bytearray(txrecord.encode({"transaction_id": "tx-1"}))
+    body[2:6] = (1 | 1 << 31).to_bytes(4, "little")
+    assert txrecord.decode(bytes(body) + b"\x01\x00z") == {"transaction_id": "tx-1"}
+
+
+@pytest.mark.parametrize("body", [
+    b"\xc7\x01",
+    txrecord.encode(RECORD)[:-3],
+    b"\xc7\x02" + txrecord.encode(RECORD)[2:],
+])
+def test_decode_rejects_malformed(body):
+    with pytest.raises(ValueError):
+        txrecord.decode(body)
+
+
+def test_parse_message_accepts_both_formats():
+    assert cache.parse_message(txrecord.encode(RECORD)) == RECORD
+    assert cache.parse_message(json.dumps(RECORD).encode()) == RECORD
+
+
+def test_calldata_longer_than_a_short_string():
+    calldata = "0x" + "ab" * 40000
+    assert txrecord.decode(txrecord.encode({**RECORD, "calldata": calldata}))["calldata"] == calldata
+    with pytest.raises(ValueError):
+        txrecord.encode({**RECORD, "request_id": "x" * 70000})
@@ -0,0 +1,325 @@
+import base64
+import json
+from types import SimpleNamespace
+
+import pytest
+from eth_utils import keccak
+
+from app import validator
+from app.snapshot import Snapshot
+from app.solana import (
+    ASSOCIATED_TOKEN_PROGRAM_ID,
+    MEMO_PROGRAM_IDS,
+    SYSTEM_PROGRAM_ID,
+    TOKEN_PROGRAM_ID,
+    associated_token_address,
+    b58decode,
+    b58encode,
+)
+from app.validator import evm_transaction_verify, split_unsigned_payloads, verify_message_hashes
+from tests.test_rlp import RECIPIENT, TOKEN, rlp_encode
+from tests.test_solana import PAYER
+from tests.test_solana import RECIPIENT as SOL_RECIPIENT
+from tests.test_solana import build_message, system_transfer_message
+
+ATTACKER = bytes([66]) * 32
+MINT = bytes([9]) * 32
+
+
+def evm_pair(i):
+    raw_tx = bytes([i % 256]) * 40
+    return raw_tx.hex(), "0x" + keccak(raw_tx).hex()
+
+
+def test_split_unsigned_payloads():
+    assert split_unsigned_payloads("abcd") == ["abcd"]
+    assert split_unsigned_payloads("abcd", 2) == ["abcd", "abcd"]
+    assert split_unsigned_payloads(json.dumps(["ab", "cd"]), 2) == ["ab", "cd"]
+    with pytest.raises(Exception):
+        split_unsigned_payloads("")
+
+
+def test_verify_every_message_hash():
+    pairs = [evm_pair(i) for i in range(3)]
+    payloads = [p for p, _ in pairs]
+    hashes = [h for _, h in pairs]
+    verify_message_hashes(evm_transaction_verify, payloads, hashes)
+
+    hashes[2] = hashes[0]
+    with pytest.raises(Exception, match="EVM transaction verify failed"):
+        verify_message_hashes(evm_transaction_verify, payloads, hashes)
+
+    with pytest.raises(Exception, match="mismatch unsigned payload count"):
+        verify_message_hashes(evm_transaction_verify, payloads[:2], hashes)
+
+
+def test_verify_single_payload_against_each_hash():
+    # 同一消息需要多个签名时 msg_hash_list 中有多个相同的哈希
+    message = system_transfer_message()
+    payloads = split_unsigned_payloads(message.hex(), 2)
+    validator.verify_message_hashes(validator.solana_transaction_verify, payloads, [message.hex()] * 2)
+    tx = {"token_id": "SOL", "destination_address": b58encode(SOL_RECIPIENT), "amount": "2"}
+    with pytest.raises(Exception, match="amount mismatch"):
+        validator.compare_solana_transaction(payloads, tx, SimpleNamespace(chain_id="SOL"), Snapshot())
+
+    raw, msg_hash = evm_pair(1)
+    with pytest.raises(Exception, match="EVM transaction verify failed"):
+        verify_message_hashes(evm_transaction_verify, split_unsigned_payloads(raw, 2), [msg_hash, evm_pair(2)[1]])
+
+
+def test_compare_rejects_distinct_payloads():
+    # 两笔待签名交易中只有一笔与 API callback 的收款地址一致
+    good = rlp_encode([9, 1, 21000, RECIPIENT, 10**16, b"", 1, 0, 0])
+    bad = rlp_encode([10, 1, 21000, bytes([17]) * 20, 10**16, b"", 1, 0, 0])
+    payloads = split_unsigned_payloads(json.dumps([good.hex(), bad.hex()]), 2)
+    hashes = ["0x" + keccak(good).hex(), "0x" + keccak(bad).hex()]
+    verify_message_hashes(evm_transaction_verify, payloads, hashes)
+    source = SimpleNamespace(chain_id="ETH", raw_tx_info=SimpleNamespace(used_nonce=None))
+    tx = {"token_id": "ETH", "destination_address": "0x" + RECIPIENT.hex(), "amount": "0.01"}
+    with pytest.raises(Exception, match="2 distinct unsigned payloads"):
+        validator.compare_evm_transaction(payloads, hashes, tx, source, Snapshot(evm_chain_ids={"ETH": 1}))
+
+    attacker = build_message([PAYER, ATTACKER, SYSTEM_PROGRAM_ID], [system_transfer(1500000000)])
+    payloads = [system_transfer_message(lamports=1500000000).hex(), attacker.hex()]
+    tx = {"token_id": "SOL", "destination_address": b58encode(SOL_RECIPIENT), "amount": "1.5"}
+    with pytest.raises(Exception, match="2 distinct unsigned payloads"):
+        validator.compare_solana_transaction(payloads, tx, SimpleNamespace(chain_id="SOL"), Snapshot())
+
+
+def test_verify_large_batch_in_pool():
+    pairs = [evm_pair(i) for i in range(validator.BATCH_PARALLEL_THRESHOLD * 2)]
+    payloads = [p for p, _ in pairs]
+    hashes = [h for _, h in pairs]
+    verify_message_hashes(evm_transaction_verify, payloads, hashes)
+
+    hashes[-1] = hashes[0]
+    with pytest.raises(Exception, match="EVM transaction verify failed"):
+        verify_message_hashes(evm_transaction_verify, payloads, hashes)
+
+
+def test_compare_evm_transaction():
+    config = Snapshot(evm_chain_ids={"ETH": 1})
+    raw = rlp_encode([9, 1, 21000, RECIPIENT, 10**16, b"", 1, 0, 0])
+    payloads = [raw.hex()]
+    hashes = ["0x" + keccak(raw).hex()]
+    source = SimpleNamespace(chain_id="ETH", raw_tx_info=SimpleNamespace(used_nonce=9))
+    tx = {
+        "token_id": "ETH",
+        "destination_type": "Address",
+        "destination_address": "0x" + RECIPIENT.hex().upper(),
+        "amount": "0.01",
+    }
+    validator.compare_evm_transaction(payloads, hashes, tx, source, config)
+
+    with pytest.raises(Exception, match="amount"):
+        validator.compare_evm_transaction(payloads, hashes, {**tx, "amount": "0.02"}, source, config)
+    with pytest.raises(Exception, match="recipient"):
+        validator.compare_evm_transaction(
+            payloads, hashes, {**tx, "destination_address": "0x" + "11" * 20}, source, config
+        )
+    validator.compare_evm_transaction(payloads, hashes, {**tx, "gas_limit": "21000", "gas_price": "1"}, source, config)
+    with pytest.raises(Exception, match="gas_limit"):
+        validator.compare_evm_transaction(payloads, hashes, {**tx, "gas_limit": "20000"}, source, config)
+    with pytest.raises(Exception, match="gas_price"):
+        validator.compare_evm_transaction(payloads, hashes, {**tx, "gas_price": "0"}, source, config)
+    source.raw_tx_info.used_nonce = 10
+    with pytest.raises(Exception, match="nonce"):
+        validator.compare_evm_transaction(payloads, hashes, tx, source, config)
+
+
+def test_compare_evm_transaction_fails_closed():
+    config = Snapshot(evm_chain_ids={"ETH": 1})
+    raw = rlp_encode([9, 1, 21000, RECIPIENT, 10**16, b"", 1, 0, 0])
+    source = SimpleNamespace(chain_id="ETH", raw_tx_info=SimpleNamespace(used_nonce=None))
+    tx = {
+        "token_id": "ETH",
+        "destination_type": "Address",
+        "destination_address": "0x" + RECIPIENT.hex(),
+        "amount": "0.01",
+    }
+
+    def compare(raw, tx):
+        validator.compare_evm_transaction([raw.hex()], ["0x" + keccak(raw).hex()], tx, source, config)
+
+    # 没有 chainId 的 legacy 交易
+    with pytest.raises(Exception, match="chainId None"):
+        compare(rlp_encode([9, 1, 21000, RECIPIENT, 10**16, b""]), tx)
+    with pytest.raises(Exception, match="no destination"):
+        compare(raw, {**tx, "destination_address": None})
+    with pytest.raises(Exception, match="no amount"):
+        compare(raw, {**tx, "amount": None})
+    with pytest.raises(Exception, match="ETH_USDT is not configured in TOKEN_CONTRACTS"):
+        compare(raw, {**tx, "token_id": "ETH_USDT"})
+    with pytest.raises(Exception, match="not configured in EVM_CHAIN_IDS"):
+        validator.compare_evm_transaction(
+            [raw.hex()], ["0x" + keccak(raw).hex()], tx, SimpleNamespace(chain_id="BSC", raw_tx_info=None), config)
+    # 原生代币转账不能带 calldata
+    with pytest.raises(Exception, match="4 bytes of calldata"):
+        compare(rlp_encode([9, 1, 21000, RECIPIENT, 10**16, b"\x12\x34\x56\x78", 1, 0, 0]), tx)
+
+    # 部署合约没有收款地址，未给出金额时 value 必须为 0；calldata 必须逐字节一致
+    deploy = rlp_encode([9, 1, 21000, b"", 0, b"\x60\x00", 1, 0, 0])
+    contract_tx = {"token_id": "ETH", "destination_type": "EVM_Contract", "calldata": "0x6000"}
+    compare(deploy, contract_tx)
+    with pytest.raises(Exception, match="calldata"):
+        compare(deploy, {**contract_tx, "calldata": "0x6001"})
+    with pytest.raises(Exception, match="calldata"):
+        compare(deploy, {**contract_tx, "calldata": None})
+    with pytest.raises(Exception, match="amount"):
+        compare(raw, {**tx, "destination_type": "EVM_Contract", "amount": None})
+
+
+def test_compare_erc20_transfer():
+    config = Snapshot(
+        evm_chain_ids={"ETH": 1},
+        token_decimals={"ETH_USDT": 6},
+        token_contracts={"ETH_USDT": "0x" + TOKEN.hex()},
+    )
+    source = SimpleNamespace(chain_id="ETH", raw_tx_info=None)
+    tx = {"token_id": "ETH_USDT", "destination_address": "0x" + RECIPIENT.hex(), "amount": "2.5"}
+    calldata = bytes.fromhex("a9059cbb") + bytes(12) + RECIPIENT + (2500000).to_bytes(32, "big")
+
+    def compare(to, value=0, data=calldata):
+        raw = bytes([2]) + rlp_encode([1, 3, 1, 2, 60000, to, value, data, []])
+        validator.compare_evm_transaction([raw.hex()], ["0x" + keccak(raw).hex()], tx, source, config)
+
+    compare(TOKEN)
+    # 收款地址和金额一致，但调用的是另一个代币合约
+    with pytest.raises(Exception, match="token contract"):
+        compare(bytes([17]) * 20)
+    with pytest.raises(Exception, match="plain ERC-20 transfer"):
+        compare(TOKEN, value=1)
+    with pytest.raises(Exception, match="plain ERC-20 transfer"):
+        compare(TOKEN, data=bytes.fromhex("095ea7b3") + calldata[4:])
+
+
+def test_solana_transaction_verify_and_compare():
+    message = system_transfer_message(lamports=1500000000)
+    validator.solana_transaction_verify(message.hex(), message.hex())
+    with pytest.raises(Exception, match="Solana transaction verify failed"):
+        validator.solana_transaction_verify(message.hex(), "00" * 32)
+
+    source = SimpleNamespace(chain_id="SOL")
+    config = Snapshot()
+    tx = {"token_id": "SOL", "destination_address": b58encode(SOL_RECIPIENT), "amount": "1.5"}
+    validator.compare_solana_transaction([message.hex()], tx, source, config)
+    with pytest.raises(Exception, match="amount mismatch"):
+        validator.compare_solana_transaction([message.hex()], {**tx, "amount": "2"}, source, config)
+    with pytest.raises(Exception, match="destination mismatch"):
+        validator.compare_solana_transaction(
+            [message.hex()], {**tx, "destination_address": "1" * 32}, source, config
+        )
+
+
+def system_transfer(lamports, to_index=1):
+    return (2, [0, to_index], (2).to_bytes(4, "little") + lamports.to_bytes(8, "little"))
+
+
+@pytest.mark.parametrize(
+    "keys, instructions, reason",
+    [
+        # 正常转账之外还有一笔转给攻击者
+        (
+            [PAYER, SOL_RECIPIENT, SYSTEM_PROGRAM_ID, ATTACKER],
+            [system_transfer(1500000000), system_transfer(1, to_index=3)],
+            "2 transfers",
+        ),
+        # 一笔收款地址正确，另一笔金额正确
+        (
+            [PAYER, SOL_RECIPIENT, SYSTEM_PROGRAM_ID, ATTACKER],
+            [system_transfer(1), system_transfer(1500000000, to_index=3)],
+            "2 transfers",
+        ),
+        ([PAYER, ATTACKER, SYSTEM_PROGRAM_ID], [system_transfer(1500000000)], "destination mismatch"),
+        ([PAYER, SYSTEM_PROGRAM_ID], [], "no transfer"),
+        # System CreateAccount 也会转移 lamports
+        (
+            [PAYER, SOL_RECIPIENT, SYSTEM_PROGRAM_ID, ATTACKER],
+            [system_transfer(1500000000), (2, [0, 3], (0).to_bytes(4, "little") + bytes(48))],
+            "unexpected instruction",
+        ),
+    ],
+)
+def test_compare_solana_rejects(keys, instructions, reason):
+    message = build_message(keys, instructions)
+    tx = {"token_id": "SOL", "destination_address": b58encode(SOL_RECIPIENT), "amount": "1.5"}
+    with pytest.raises(Exception, match=reason):
+        validator.compare_solana_transaction([message.hex()], tx, SimpleNamespace(chain_id="SOL"), Snapshot())
+
+
+def test_compare_solana_spl_transfer():
+    token_program = b58decode(TOKEN_PROGRAM_ID)
+    token_account = associated_token_address(SOL_RECIPIENT, MINT, token_program)
+    source = SimpleNamespace(chain_id="SOL")
+    config = Snapshot(token_decimals={"SOL_USDC": 6}, token_mints={"SOL_USDC": b58encode(MINT)})
+    tx = {"token_id": "SOL_USDC", "destination_address": b58encode(SOL_RECIPIENT), "amount": "2.5"}
+    checked = bytes([12]) + (2500000).to_bytes(8, "little") + bytes([6])
+
+    def compare(keys, instructions, tx=tx, config=config):
+        message = build_message(keys, instructions)
+        validator.compare_solana_transaction([message.hex()], tx, source, config)
+
+    keys = [PAYER, token_account, MINT, token_program, b58decode(MEMO_PROGRAM_IDS[0])]
+    compare(keys, [(3, [0, 2, 1, 0], checked), (4, [], b"invoice 42")])
+    with pytest.raises(Exception, match="amount"):
+        compare(keys, [(3, [0, 2, 1, 0], checked)], tx={**tx, "amount": "2"})
+    with pytest.raises(Exception, match="SPL transfer destination"):
+        compare(keys, [(3, [0, 2, 1, 0], checked)], tx={**tx, "destination_address": b58encode(ATTACKER)})
+    # 精度以配置为准，而不是待签名指令中的精度
+    with pytest.raises(Exception, match="decimals 6 mismatch"):
+        compare(keys, [(3, [0, 2, 1, 0], checked)], config=Snapshot(
+            token_decimals={"SOL_USDC": 9}, token_mints={"SOL_USDC": b58encode(MINT)}))
+    # 收款地址和金额一致，但转的是另一个代币
+    other_mint = bytes([10]) * 32
+    other_account = associated_token_address(SOL_RECIPIENT, other_mint, token_program)
+    with pytest.raises(Exception, match="mint .* mismatch SOL_USDC"):
+        compare([PAYER, other_account, other_mint, token_program], [(3, [0, 2, 1, 0], checked)])
+    with pytest.raises(Exception, match="SOL_USDC is not configured in TOKEN_MINTS"):
+        compare(keys, [(3, [0, 2, 1, 0], checked)], config=Snapshot(token_decimals={"SOL_USDC": 6}))
+
+    # Transfer 指令没有 mint，目标账户需要是配置的 mint 的关联代币账户
+    plain = bytes([3]) + (2500000).to_bytes(8, "little")
+    keys = [PAYER, token_account, SOL_RECIPIENT, MINT, SYSTEM_PROGRAM_ID, token_program,
+            b58decode(ASSOCIATED_TOKEN_PROGRAM_ID)]
+    create = (6, [0, 1, 2, 3, 4, 5], bytes([1]))
+    compare(keys, [create, (5, [0, 1, 0], plain)])
+    compare(keys, [(5, [0, 1, 0], plain)])
+    with pytest.raises(Exception, match="SPL transfer destination"):
+        compare([PAYER, SOL_RECIPIENT, token_program], [(2, [0, 1, 0], plain)])
+    with pytest.raises(Exception, match="SPL transfer destination"):
+        compare([PAYER, other_account, token_program], [(2, [0, 1, 0], plain)])
+    # 为其他地址或其他 mint 创建代币账户也会花费租金
+    attacker_keys = [PAYER, token_account, ATTACKER] + keys[3:]
+    with pytest.raises(Exception, match="unexpected instruction"):
+        compare(attacker_keys, [create, (5, [0, 1, 0], plain)])
+    other_keys = [PAYER, other_account, SOL_RECIPIENT, other_mint] + keys[4:]
+    with pytest.raises(Exception, match="unexpected instruction"):
+        compare(other_keys, [create, (5, [0, 1, 0], plain)])
+
+
+def test_compare_solana_contract_call():
+    program = bytes([77]) * 32
+    keys = [PAYER, SOL_RECIPIENT, program, b58decode(MEMO_PROGRAM_IDS[0])]
+    approved = [{
+        "program_id": b58encode(program),
+        "accounts": [
+            {"pubkey": b58encode(PAYER), "is_signer": True, "is_writable": True},
+            {"pubkey": b58encode(SOL_RECIPIENT), "is_signer": False, "is_writable": True},
+        ],
+        "data": base64.b64encode(b"swap").decode(),
+    }]
+    tx = {"token_id": "SOL", "destination_type": "SOL_Contract", "instructions": json.dumps(approved)}
+
+    def compare(instructions, tx=tx):
+        message = build_message(keys, instructions)
+        validator.compare_solana_transaction([message.hex()], tx, SimpleNamespace(chain_id="SOL"), Snapshot())
+
+    compare([(3, [], b"memo"), (2, [0, 1], b"swap")])
+    with pytest.raises(Exception, match="unapproved instruction"):
+        compare([(2, [0, 1], b"swap"), (2, [1, 0], b"swap")])
+    with pytest.raises(Exception, match="unapproved instruction"):
+        compare([(2, [0, 1], b"drain")])
+    with pytest.raises(Exception, match="0 of 1 approved"):
+        compare([(3, [], b"memo")])
+    with pytest.raises(Exception, match="no instructions"):
+        compare([(2, [0, 1], b"swap")], tx={**tx, "instructions": None})
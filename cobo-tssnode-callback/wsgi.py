@@ -0,0 +1,9 @@
+import os
+
+from app import create_app
+from app.config import DEFAULT_CONFIG_YAML, load_yaml_config
+
+# gunicorn 的命令行参数不是本服务的参数，配置文件路径通过环境变量传入
+app = create_app(
+    load_yaml_config(os.environ.get("CALLBACK_SERVER_CONFIG", DEFAULT_CONFIG_YAML))
+)
@@ -1,21 +1,33 @@
-import hashlib
+import asyncio
 import json
 import logging
-import pika
+from contextlib import asynccontextmanager
 from typing import Optional
-from nacl.exceptions import BadSignatureError
-from nacl.signing import SigningKey, VerifyKey
 from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.responses import PlainTextResponse
 from cobo_waas2 import WebhookEvent, Transaction
 import dotenv
-
-# 配置日志
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from dedup import DedupCache, StaleTimestamp, check_timestamp
+from direct import DirectPublisher
+from dispatch import ALL_EVENTS, DispatchQueueFull, EventDispatcher, event_type_of
+from jsonlog import request_context, setup_logging
+import partition
+from publisher import PublishError, RabbitMQPublisher
+from signature import SignatureVerifier
+import txrecord
 
 # 加载 .env 配置文件
 dotenv.load_dotenv()
+
+# 配置日志：JSON 格式，由后台线程写出，请求处理只负责入队
+setup_logging(
+    level=(dotenv.get_key(".env", "LOG_LEVEL") or "INFO").upper(),
+    queue_size=int(dotenv.get_key(".env", "LOG_QUEUE_SIZE") or 10000),
+    rate=float(dotenv.get_key(".env", "LOG_RATE_LIMIT") or 100),
+    burst=int(dotenv.get_key(".env", "LOG_RATE_BURST") or 200),
+    max_field_length=int(dotenv.get_key(".env", "LOG_MAX_FIELD_LENGTH") or 2048),
+)
+logger = logging.getLogger(__name__)
 allow_list_str = dotenv.get_key(".env", "IP_ALLOWLIST")
 allow_list = [ip.strip() for ip in allow_list_str.split(",")] if allow_list_str else ["127.0.0.1"]
 if "127.0.0.1" not in allow_list:
@@ -23,19 +35,86 @@ if "127.0.0.1" not in allow_list:
 
 logger.info(f"IP allow list: {allow_list}")
 
-# 加载RabbitMQ
-def init_rabbitmq():
-    global connection, mq_channel
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host="localhost"),
+# 多个 TSS Node callback 服务各自消费一部分交易：按 PARTITION_KEY 字段的一致性哈希
+# 选择分区，0 表示不分区，所有交易发送到 cobo 队列
+partition_count = int(dotenv.get_key(".env", "PARTITION_COUNT") or 0)
+partition_key = dotenv.get_key(".env", "PARTITION_KEY") or "wallet_id"
+
+# 发送给 TSS Node callback 服务的消息格式：默认 json；binary 为 txrecord 定义的二进制记录，
+# 所有 TSS Node callback 服务升级到能解析二进制记录的版本后才能启用
+message_format = (dotenv.get_key(".env", "MESSAGE_FORMAT") or "json").lower()
+
+# RabbitMQ 发布器在独立线程中持有连接，请求处理只负责入队
+rabbitmq_host = dotenv.get_key(".env", "RABBITMQ_HOST") or "localhost"
+publish_timeout = float(dotenv.get_key(".env", "PUBLISH_TIMEOUT") or 5)
+publisher = RabbitMQPublisher(
+    host=rabbitmq_host,
+    max_queue_size=int(dotenv.get_key(".env", "PUBLISH_QUEUE_SIZE") or 10000),
+    batch_size=int(dotenv.get_key(".env", "PUBLISH_BATCH_SIZE") or 100),
+    durable=(dotenv.get_key(".env", "RABBITMQ_DURABLE") or "").lower() in ("1", "true", "yes"),
+    partitions=partition_count,
+)
+
+# 与 TSS Node callback 服务同机部署时通过 Unix socket 直接写入其缓存，RabbitMQ 作为备用。
+# 分区部署时只有 DIRECT_PARTITIONS（本机实例的 CONSUMER_PARTITIONS）中的分区直接发送
+direct_socket_path = dotenv.get_key(".env", "DIRECT_SOCKET_PATH")
+direct_partitions = dotenv.get_key(".env", "DIRECT_PARTITIONS")
+if direct_socket_path:
+    direct_routing_keys = None
+    if partition_count:
+        if not direct_partitions or not direct_partitions.strip():
+            raise ValueError("DIRECT_PARTITIONS is required when both PARTITION_COUNT and DIRECT_SOCKET_PATH are set")
+        direct_routing_keys = [
+            partition.routing_key(p) for p in partition.parse_partitions(direct_partitions, partition_count)
+        ]
+    publisher = DirectPublisher(
+        direct_socket_path,
+        fallback=publisher,
+        routing_keys=direct_routing_keys,
+        max_queue_size=int(dotenv.get_key(".env", "PUBLISH_QUEUE_SIZE") or 10000),
+        batch_size=int(dotenv.get_key(".env", "PUBLISH_BATCH_SIZE") or 100),
     )
-    mq_channel = connection.channel()
-    mq_channel.queue_declare(queue="cobo")
 
-init_rabbitmq()
+
+# Cobo 会重试 callback 和 webhook：时间戳超出允许偏差的请求直接拒绝，
+# 窗口内重复的 transaction_id / event_id 返回第一次请求的结果
+max_timestamp_skew = float(dotenv.get_key(".env", "MAX_TIMESTAMP_SKEW") or 300)
+dedup_cache = DedupCache(
+    ttl=float(dotenv.get_key(".env", "DEDUP_TTL") or 600),
+    max_size=int(dotenv.get_key(".env", "DEDUP_MAX_SIZE") or 100000),
+)
+
+# Webhook 事件在后台按类型分发给处理函数，接口验签入队后立即返回
+dispatcher = EventDispatcher(
+    max_queue_size=int(dotenv.get_key(".env", "WEBHOOK_QUEUE_SIZE") or 1000),
+    workers=int(dotenv.get_key(".env", "WEBHOOK_WORKERS") or 4),
+)
+
+
+@dispatcher.register(ALL_EVENTS, concurrency=16, timeout=5.0)
+async def log_webhook_event(event: WebhookEvent):
+    logger.info("Webhook event", extra={"event_id": event.event_id, "event_type": event_type_of(event)})
+    logger.debug("Webhook event data: %s", event.data)
+
+
+# 在此注册具体事件的处理函数，例如：
+# @dispatcher.register(WebhookEventType.WALLETS_DOT_TRANSACTION_DOT_SUCCEEDED, concurrency=4, timeout=10)
+# async def on_transaction_succeeded(event: WebhookEvent):
+#     ...
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    publisher.start()
+    await dispatcher.start()
+    yield
+    await dispatcher.stop()
+    await asyncio.get_running_loop().run_in_executor(None, publisher.stop)
+    verifier.close()
+
 
 # 启动服务器
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 # Select the public key based on the environment that you use,
@@ -45,7 +124,12 @@ pub_keys = {
     "PROD": "8d4a482641adb2a34b726f05827dba9a9653e5857469b8749052bf4458a86729",
 }
 
-pubkey = pub_keys["DEV"]
+cobo_env = dotenv.get_key(".env", "COBO_ENV") or "DEV"
+verifier = SignatureVerifier(
+    pub_keys,
+    env=cobo_env,
+    offload_threshold=int(dotenv.get_key(".env", "VERIFY_OFFLOAD_THRESHOLD") or 4),
+)
 
 
 @app.post("/api/webhook")
@@ -54,16 +138,25 @@ async def handle_webhook(
     biz_timestamp: Optional[str] = Header(None),
     biz_resp_signature: Optional[str] = Header(None),
 ):
-    raw_body = await request.body()
-    sig_valid = verify_signature(
-        pubkey, biz_resp_signature, f"{raw_body.decode('utf8')}|{biz_timestamp}"
+    reject_stale_timestamp(biz_timestamp)
+    raw_body, sig_valid = await verifier.verify_request(
+        request, biz_timestamp, biz_resp_signature
     )
     if not sig_valid:
         raise HTTPException(
             status_code=401, detail="Signature verification failed")
-    event = WebhookEvent.from_dict(json.loads(raw_body.decode('utf8')))
-    logger.info(event)
-    logger.info(event.data)
+    event = WebhookEvent.from_dict(json.loads(raw_body))
+
+    async def enqueue():
+        try:
+            dispatcher.dispatch(event)
+        except DispatchQueueFull as e:
+            # 返回 503 让 Cobo 稍后重试，而不是丢弃事件；失败的结果不会被缓存
+            logger.error(f"Failed to enqueue webhook event {event.event_id}: {e}")
+            raise HTTPException(status_code=503, detail="Webhook queue is full")
+
+    with request_context(event.event_id):
+        await dedup_cache.once(("webhook", event.event_id), enqueue)
 
 
 @app.post("/api/callback", response_class=PlainTextResponse)
@@ -72,15 +165,14 @@ async def handle_callback(
     biz_timestamp: Optional[str] = Header(None),
     biz_resp_signature: Optional[str] = Header(None),
 ):
-    raw_body = await request.body()
-    sig_valid = verify_signature(
-        pubkey, biz_resp_signature, f"{raw_body.decode('utf8')}|{biz_timestamp}"
+    reject_stale_timestamp(biz_timestamp)
+    raw_body, sig_valid = await verifier.verify_request(
+        request, biz_timestamp, biz_resp_signature
     )
-    tx = Transaction.from_dict(json.loads(raw_body.decode('utf8')))
-    logger.info(tx)
     if not sig_valid:
         raise HTTPException(
             status_code=401, detail="Signature verification failed")
+    tx = Transaction.from_dict(json.loads(raw_body))
 
     # 验证发起方IP
     # from_ip = request.client.host  # 请求发起方的IP
@@ -88,6 +180,25 @@ async def handle_callback(
     #     raise HTTPException(
     #         status_code=403, detail=f"IP {from_ip} is not allowed")
 
+    # 只合并同一个请求（相同 biz_timestamp）的重试：TSS Node callback 的缓存读取后即删除、
+    # 约 30 秒过期，同一交易的新一次 callback 必须重新发布。发布失败返回的 deny 不缓存
+    with request_context(tx.transaction_id):
+        return await dedup_cache.once(
+            ("callback", tx.transaction_id, biz_timestamp),
+            lambda: approve_transaction(tx),
+            cacheable=lambda answer: answer == "ok",
+        )
+
+
+async def approve_transaction(tx: Transaction) -> str:
+    logger.info("Callback transaction", extra={
+        "transaction_id": tx.transaction_id,
+        "wallet_id": tx.wallet_id,
+        "chain_id": tx.chain_id,
+        "token_id": tx.token_id,
+    })
+    logger.debug("Callback transaction detail: %s", tx)
+
     # TODO 添加实际的 API 请求验证逻辑，目前无条件通过
 
     # 把 tx 信息发送到 TSS Node callback 进程以备验证
@@ -96,37 +207,85 @@ async def handle_callback(
         "wallet_id": tx.wallet_id,
         "chain_id": tx.chain_id,
         "created_timestamp": tx.created_timestamp,
+        "token_id": tx.token_id,
+        "request_id": tx.request_id,
+        **extract_destination(tx),
+        **extract_fee(tx),
     }
-    
-    # 检查RabbitMQ连接状态
-    if mq_channel.is_open:
-        mq_channel.basic_publish(exchange="", routing_key="cobo",
-                                 body=json.dumps(msg))
-    else:
-        logger.warning("RabbitMQ channel is not open. Attempting to reconnect...")
-        try:
-            init_rabbitmq()
-            
-            # 重新连接后再次尝试发送消息
-            mq_channel.basic_publish(exchange="", routing_key="cobo",
-                                     body=json.dumps(msg))
-            logger.info("Successfully reconnected to RabbitMQ and sent message.")
-        except Exception as e:
-            logger.error(f"Failed to reconnect to RabbitMQ: {e}")
-            return "deny"
+    body = txrecord.encode(msg) if message_format == "binary" else json.dumps(msg).encode()
+
+    # 入队后等待 broker 确认，超时或失败时拒绝交易
+    ack = publisher.publish(body, routing_key=routing_key_for(msg))
+    try:
+        await asyncio.wait_for(asyncio.wrap_future(ack), timeout=publish_timeout)
+    except (PublishError, asyncio.TimeoutError) as e:
+        logger.error(f"Failed to publish transaction {tx.transaction_id}: {e!r}")
+        return "deny"
 
     return "ok"
 
 
-def verify_signature(public_key, signature, message):
-    vk = VerifyKey(key=bytes.fromhex(public_key))
-    sha256_hash = hashlib.sha256(hashlib.sha256(
-        message.encode()).digest()).digest()
+def routing_key_for(msg: dict) -> Optional[str]:
+    """未分区时返回 None，使用发布器默认的 routing key"""
+    if not partition_count:
+        return None
+    key = str(msg.get(partition_key) or "")
+    return partition.routing_key(partition.partition_for(key, partition_count))
+
+
+def reject_stale_timestamp(biz_timestamp: Optional[str]):
     try:
-        vk.verify(signature=bytes.fromhex(signature), smessage=sha256_hash)
-        return True
-    except BadSignatureError:
-        return False
+        check_timestamp(biz_timestamp, max_timestamp_skew)
+    except StaleTimestamp as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+
+def extract_destination(tx: Transaction) -> dict:
+    """提取目标地址和金额，供 TSS Node callback 与待签名交易的内容比对"""
+    destination = tx.destination.actual_instance if tx.destination else None
+    if destination is None:
+        return {}
+    address = amount = None
+    output = getattr(destination, "account_output", None)
+    if output is not None:
+        address, amount = output.address, output.amount
+    elif hasattr(destination, "address"):
+        address = destination.address
+        amount = getattr(destination, "value", None) or getattr(destination, "amount", None)
+    destination_type = destination.destination_type
+    return {
+        "destination_type": destination_type.value if destination_type else None,
+        "destination_address": address,
+        "amount": amount,
+        # 合约调用的 calldata，TSS Node callback 逐字节比对待签名交易的 data
+        "calldata": getattr(destination, "calldata", None),
+        # Solana 合约调用的指令，以 JSON 字符串发送，TSS Node callback 按顺序比对
+        "instructions": _instructions(destination),
+    }
+
+
+def _instructions(destination):
+    instructions = getattr(destination, "instructions", None)
+    if not instructions:
+        return None
+    return json.dumps([instruction.to_dict() for instruction in instructions])
+
+
+def extract_fee(tx: Transaction) -> dict:
+    """提取手续费参数，TSS Node callback 校验待签名交易的 gas 不超过这里批准的上限"""
+    fee = tx.fee.actual_instance if tx.fee else None
+    if fee is None:
+        return {}
+    fee_type = getattr(fee, "fee_type", None)
+    return {
+        "fee_type": fee_type.value if fee_type else None,
+        "fee_token_id": getattr(fee, "token_id", None),
+        "gas_price": getattr(fee, "gas_price", None),
+        "gas_limit": getattr(fee, "gas_limit", None),
+        "max_fee_per_gas": getattr(fee, "max_fee_per_gas", None),
+        "max_priority_fee_per_gas": getattr(fee, "max_priority_fee_per_gas", None),
+        "max_fee_amount": getattr(fee, "max_fee_amount", None),
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Optional
+
+
+class StaleTimestamp(Exception):
+    """biz_timestamp 超出允许的时钟偏差"""
+
+
+def check_timestamp(biz_timestamp: Optional[str], max_skew: float, now: float = None):
+    """biz_timestamp 为毫秒时间戳；max_skew 为 0 时不检查"""
+    if not max_skew:
+        return
+    try:
+        timestamp = int(biz_timestamp) / 1000
+    except (TypeError, ValueError):
+        raise StaleTimestamp(f"Invalid timestamp {biz_timestamp!r}")
+    now = time.time() if now is None else now
+    if abs(now - timestamp) > max_skew:
+        raise StaleTimestamp(f"Timestamp {biz_timestamp} is outside the {max_skew:g}s window")
+
+
+class DedupCache:
+    """
+    按 key 记住请求结果的有界缓存，用于处理 Cobo 的重试。
+
+    同一个 key 第一次请求执行 work，处理期间和之后 ttl 秒内的重复请求直接
+    等待并返回第一次的结果。所有条目的 ttl 相同，按插入顺序即过期顺序排列，
+    超出 max_size 时淘汰最早的条目。work 抛出异常或结果不可缓存时删除条目，
+    下一次重试会重新执行。
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 100000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        # key -> (过期时间, Future)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _expire(self, now: float):
+        entries = self._entries
+        while entries:
+            key, (expires_at, _) = next(iter(entries.items()))
+            if expires_at > now:
+                break
+            entries.popitem(last=False)
+
+    async def once(
+        self,
+        key: Hashable,
+        work: Callable[[], Awaitable],
+        cacheable: Callable[[object], bool] = lambda result: True,
+    ):
+        now = self.clock()
+        self._expire(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            # shield：重复请求断开连接时不能取消第一个请求的 Future
+            return await asyncio.shield(entry[1])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (now + self.ttl, future)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            self._discard(key, future)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._discard(key, future)
+            future.set_exception(e)
+            # 没有重复请求等待时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        if not cacheable(result):
+            self._discard(key, future)
+        future.set_result(result)
+        return result
+
+    def _discard(self, key: Hashable, future: asyncio.Future):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is future:
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,224 @@
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import Collection, List, Optional, Tuple
+
+from publisher import PublishError, PublisherQueueFull
+
+logger = logging.getLogger(__name__)
+
+# 帧格式与 TSS Node callback 服务的 app/direct.py 一致：
+#   batch  u32 body length | u64 batch id | u64 sent at (ms) | body
+#   body   (u32 message length | message) * n
+#   ack    u64 batch id | u8 status
+BATCH_HEADER = struct.Struct("<IQQ")
+MESSAGE_LENGTH = struct.Struct("<I")
+ACK = struct.Struct("<QB")
+ACK_OK = 0
+
+
+class DirectPublisher:
+    """
+    通过 Unix socket 把交易消息直接推送到同机部署的 TSS Node callback 服务。
+
+    接口与 RabbitMQPublisher 相同：publish() 把消息放入有界队列并返回 Future，
+    发送线程把队列中的消息合并成一批发送，对端写入缓存并确认后完成 Future。
+    同一时间只有一批消息等待确认，对端处理变慢时消息在队列中积压，队列满时
+    publish() 直接失败（背压）。
+
+    连接失败、确认超时或对端返回失败时，这一批及之后的消息交给 fallback
+    （通常是 RabbitMQPublisher）发送，并按指数退避重新连接。
+
+    分区部署时本机实例只负责部分分区：``routing_keys`` 为本机实例的分区对应的
+    routing key，其他分区的消息直接交给 fallback 发送到对应的分区队列。
+    为 None 时（不分区）所有消息都直接发送。
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        fallback=None,
+        routing_keys: Optional[Collection[str]] = None,
+        max_queue_size: int = 10000,
+        batch_size: int = 100,
+        ack_timeout: float = 1.0,
+        reconnect_delay: float = 0.5,
+        max_reconnect_delay: float = 30.0,
+    ):
+        self.socket_path = socket_path
+        self.fallback = fallback
+        self.routing_keys = frozenset(routing_keys) if routing_keys is not None else None
+        self.batch_size = batch_size
+        self.ack_timeout = ack_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._socket: Optional[socket.socket] = None
+        self._batch_id = 0
+        self._retry_at = 0.0
+        self._delay = reconnect_delay
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"direct": 0, "fallback": 0, "batches": 0, "failures": 0}
+
+    # ---- 调用方接口（任意线程） ----
+
+    def start(self):
+        if self.fallback is not None:
+            self.fallback.start()
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="direct-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """发送完队列中的消息后关闭连接"""
+        self._stopping = True
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.fallback is not None:
+            self.fallback.stop(timeout)
+
+    def publish(self, body: bytes, routing_key: Optional[str] = None) -> Future:
+        future = Future()
+        if self._stopping:
+            future.set_exception(PublishError("publisher is stopped"))
+            return future
+        if self.routing_keys is not None and routing_key not in self.routing_keys:
+            # 不属于本机实例的分区
+            if self.fallback is None:
+                future.set_exception(PublishError(f"routing key {routing_key} is not served directly"))
+                return future
+            self.stats["fallback"] += 1
+            return self.fallback.publish(body, routing_key)
+        try:
+            self._queue.put_nowait((body, routing_key, future))
+        except queue.Full:
+            future.set_exception(PublisherQueueFull("publish queue is full"))
+        return future
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    # ---- 发送线程 ----
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            if batch:
+                self._send(batch)
+        self._disconnect()
+
+    def _next_batch(self) -> Optional[List[Tuple[bytes, Optional[str], Future]]]:
+        """阻塞等待第一条消息，再取出队列中已有的消息凑成一批；收到停止标记时返回 None"""
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = []
+        while item is not None:
+            # 调用方已超时取消的消息不再发送
+            if item[2].set_running_or_notify_cancel():
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+        if item is None:
+            # 停止标记放回队列，发送完这一批后退出
+            self._queue.put(None)
+        return batch
+
+    def _send(self, batch):
+        conn = self._connect()
+        if conn is not None:
+            self._batch_id += 1
+            body = b"".join(MESSAGE_LENGTH.pack(len(m[0])) + m[0] for m in batch)
+            frame = BATCH_HEADER.pack(len(body), self._batch_id, int(time.time() * 1000)) + body
+            try:
+                conn.sendall(frame)
+                ack = self._recv_exact(conn, ACK.size)
+                batch_id, status = ACK.unpack(ack)
+                if batch_id != self._batch_id or status != ACK_OK:
+                    raise PublishError(f"batch {batch_id} was not accepted (status {status})")
+            except (OSError, PublishError) as e:
+                self.stats["failures"] += 1
+                logger.warning(f"Direct publish failed, using fallback: {e!r}")
+                self._disconnect()
+                self._schedule_reconnect()
+            else:
+                self.stats["batches"] += 1
+                self.stats["direct"] += len(batch)
+                for _, _, future in batch:
+                    future.set_result(True)
+                return
+        self._publish_fallback(batch)
+
+    def _publish_fallback(self, batch):
+        self.stats["fallback"] += len(batch)
+        for body, routing_key, future in batch:
+            if self.fallback is None:
+                future.set_exception(PublishError("direct transport is unavailable"))
+                continue
+            _chain(self.fallback.publish(body, routing_key), future)
+
+    def _connect(self) -> Optional[socket.socket]:
+        if self._socket is not None:
+            return self._socket
+        if time.monotonic() < self._retry_at:
+            return None
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(self.ack_timeout)
+        try:
+            conn.connect(self.socket_path)
+        except OSError as e:
+            conn.close()
+            logger.warning(f"Failed to connect to {self.socket_path}: {e!r}")
+            self._schedule_reconnect()
+            return None
+        logger.info(f"Direct publisher connected to {self.socket_path}")
+        self._delay = self.reconnect_delay
+        self._socket = conn
+        return conn
+
+    def _schedule_reconnect(self):
+        self._retry_at = time.monotonic() + self._delay
+        self._delay = min(self._delay * 2, self.max_reconnect_delay)
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    @staticmethod
+    def _recv_exact(conn: socket.socket, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed by peer")
+            data += chunk
+        return data
+
+
+def _chain(source: Future, target: Future):
+    def copy(f: Future):
+        if f.cancelled():
+            target.set_exception(PublishError("fallback publish was cancelled"))
+            return
+        error = f.exception()
+        if error is not None:
+            target.set_exception(error)
+        else:
+            target.set_result(f.result())
+
+    source.add_done_callback(copy)
@@ -0,0 +1,140 @@
+import asyncio
+import inspect
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from jsonlog import request_context
+
+logger = logging.getLogger(__name__)
+
+# 注册到该类型的处理函数接收所有事件
+ALL_EVENTS = "*"
+
+
+class DispatchQueueFull(Exception):
+    """事件队列已满，调用方应当让 Cobo 稍后重试"""
+
+
+@dataclass
+class EventHandler:
+    func: Callable
+    timeout: float
+    semaphore: asyncio.Semaphore
+    name: str = field(default="")
+
+    async def run(self, event):
+        async with self.semaphore:
+            if inspect.iscoroutinefunction(self.func):
+                await asyncio.wait_for(self.func(event), timeout=self.timeout)
+            else:
+                # 同步函数在线程池中执行；超时后不再等待，但线程中的调用无法被中断
+                loop = asyncio.get_running_loop()
+                await asyncio.wait_for(
+                    loop.run_in_executor(None, self.func, event), timeout=self.timeout
+                )
+
+
+def event_type_of(event) -> str:
+    event_type = getattr(event, "type", None)
+    return getattr(event_type, "value", event_type)
+
+
+class EventDispatcher:
+    """
+    Webhook 事件分发器。
+
+    处理函数按 event.type 注册，HTTP 接口只负责把事件放入有界队列，
+    由固定数量的 worker 协程取出事件并执行对应的处理函数。每个处理函数
+    有独立的并发上限和超时时间，处理慢或失败只记录日志，不影响接口响应。
+    """
+
+    def __init__(self, max_queue_size: int = 1000, workers: int = 4):
+        self.max_queue_size = max_queue_size
+        self.workers = workers
+        self._handlers: Dict[str, List[EventHandler]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"dispatched": 0, "dropped": 0, "handled": 0, "failed": 0, "timeouts": 0}
+
+    def register(self, event_type: str, func: Callable = None, *,
+                 concurrency: int = 4, timeout: float = 10.0):
+        """注册处理函数，可以直接调用，也可以作为装饰器使用"""
+        event_type = getattr(event_type, "value", event_type)
+
+        def decorator(f):
+            handler = EventHandler(
+                func=f,
+                timeout=timeout,
+                semaphore=asyncio.Semaphore(concurrency),
+                name=getattr(f, "__name__", repr(f)),
+            )
+            self._handlers.setdefault(event_type, []).append(handler)
+            return f
+
+        return decorator(func) if func is not None else decorator
+
+    def handlers_for(self, event) -> List[EventHandler]:
+        return self._handlers.get(event_type_of(event), []) + self._handlers.get(ALL_EVENTS, [])
+
+    def dispatch(self, event):
+        """把事件放入队列，队列已满时抛出 DispatchQueueFull"""
+        if self._queue is None:
+            raise RuntimeError("EventDispatcher is not started")
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            raise DispatchQueueFull(f"webhook queue is full ({self.max_queue_size})")
+        self.stats["dispatched"] += 1
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"webhook-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self, timeout: float = 5.0):
+        """等待队列中的事件处理完，超时后取消剩余任务"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self._queue.qsize()} unhandled webhook events")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _worker(self):
+        queue = self._queue
+        while True:
+            event = await queue.get()
+            try:
+                # gather 创建的任务复制当前上下文，处理函数中的日志带有 event_id
+                with request_context(getattr(event, "event_id", None)):
+                    handlers = self.handlers_for(event)
+                    if handlers:
+                        await asyncio.gather(*(self._run(h, event) for h in handlers))
+            finally:
+                queue.task_done()
+
+    async def _run(self, handler: EventHandler, event):
+        event_id = getattr(event, "event_id", None)
+        try:
+            await handler.run(event)
+            self.stats["handled"] += 1
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logger.error(f"Webhook handler {handler.name} timed out on event {event_id}")
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"Webhook handler {handler.name} failed on event {event_id}: {e!r}")
@@ -0,0 +1,317 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Optional
+
+import pika
+
+import partition
+
+logger = logging.getLogger(__name__)
+
+
+class PublishError(Exception):
+    """消息未能成功投递到 RabbitMQ"""
+
+
+class PublisherQueueFull(PublishError):
+    """发送队列已满，调用方应当拒绝本次请求"""
+
+
+class RabbitMQPublisher:
+    """
+    在独立线程中持有 RabbitMQ 连接的发布器。
+
+    调用方通过 publish() 把消息放入有界队列并拿到一个 Future，发布线程
+    批量发送消息并在收到 publisher confirm 后完成 Future。连接断开时按
+    指数退避重连，未确认的消息会在重连后重新发送（至少一次语义）。
+
+    partitions 大于 0 时声明 direct exchange 和每个分区的队列（见 partition.py），
+    调用方按分区指定 routing_key；为 0 时所有消息发送到 queue_name 队列。
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        queue_name: str = "cobo",
+        exchange: str = "",
+        routing_key: str = "cobo",
+        max_queue_size: int = 10000,
+        batch_size: int = 100,
+        max_in_flight: int = 1000,
+        reconnect_delay: float = 0.5,
+        max_reconnect_delay: float = 30.0,
+        durable: bool = False,
+        partitions: int = 0,
+    ):
+        self.parameters = pika.ConnectionParameters(host=host)
+        self.queue_name = queue_name
+        # 持久化队列和消息，RabbitMQ 重启后未消费的消息不会丢失
+        self.durable = durable
+        self.partitions = partitions
+        self.exchange = partition.EXCHANGE if partitions and not exchange else exchange
+        self.routing_key = routing_key
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        # 断线时尚未确认的消息，重连后优先重发
+        self._retry = deque()
+        # delivery_tag -> (body, routing_key, future)，按 tag 递增排列
+        self._unconfirmed = OrderedDict()
+        self._delivery_tag = 0
+
+        self._connection: Optional[pika.SelectConnection] = None
+        self._channel = None
+        self._ready = False
+        self._wakeup_pending = False
+        self._stopping = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- 调用方接口（任意线程） ----
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="rabbitmq-publisher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """尽量发送完队列中的消息后关闭连接"""
+        self._stopping = True
+        self._stop_event.set()
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._shutdown)
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def publish(self, body: bytes, routing_key: Optional[str] = None) -> Future:
+        """把消息放入发送队列，返回在 broker 确认后完成的 Future"""
+        future = Future()
+        if self._stopping:
+            future.set_exception(PublishError("publisher is stopped"))
+            return future
+        try:
+            self._queue.put_nowait((body, routing_key or self.routing_key, future))
+        except queue.Full:
+            future.set_exception(PublisherQueueFull("publish queue is full"))
+            return future
+        self._wakeup()
+        return future
+
+    def qsize(self) -> int:
+        return self._queue.qsize() + len(self._retry)
+
+    def _wakeup(self):
+        connection = self._connection
+        if connection is None or not self._ready or self._wakeup_pending:
+            return
+        self._wakeup_pending = True
+        try:
+            connection.ioloop.add_callback_threadsafe(self._drain)
+        except Exception:
+            # 连接正在关闭，消息会在重连后发送
+            self._wakeup_pending = False
+
+    # ---- 发布线程 ----
+
+    def _run(self):
+        delay = self.reconnect_delay
+        while not self._stopping:
+            self._ready = False
+            self._connection = pika.SelectConnection(
+                self.parameters,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_open_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            self._connection.ioloop.start()
+
+            # ioloop 返回说明连接已断开
+            connected = self._ready
+            self._connection = None
+            self._channel = None
+            self._ready = False
+            self._requeue_unconfirmed()
+
+            if self._stopping:
+                break
+            if connected:
+                delay = self.reconnect_delay
+            logger.warning(f"RabbitMQ publisher disconnected, reconnecting in {delay:.1f}s")
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+        self._fail_outstanding(PublishError("publisher is stopped"))
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        logger.error(f"Failed to connect to RabbitMQ: {error}")
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        logger.warning(f"RabbitMQ connection closed: {reason}")
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        if self.partitions:
+            channel.exchange_declare(
+                exchange=self.exchange, exchange_type="direct", durable=self.durable,
+                callback=lambda _frame: self._declare_partition(0),
+            )
+            return
+        channel.queue_declare(
+            queue=self.queue_name, durable=self.durable, callback=self._on_queue_declared
+        )
+
+    def _declare_partition(self, n: int):
+        """依次声明分区队列并绑定到 exchange，全部完成后开启 confirm"""
+        if n >= self.partitions:
+            self._on_queue_declared(None)
+            return
+
+        def bind(_frame):
+            self._channel.queue_bind(
+                queue=partition.queue_name(n), exchange=self.exchange,
+                routing_key=partition.routing_key(n),
+                callback=lambda _frame: self._declare_partition(n + 1),
+            )
+
+        self._channel.queue_declare(
+            queue=partition.queue_name(n), durable=self.durable, callback=bind
+        )
+
+    def _on_channel_closed(self, channel, reason):
+        logger.warning(f"RabbitMQ channel closed: {reason}")
+        self._channel = None
+        self._ready = False
+        connection = self._connection
+        if connection is not None and not (connection.is_closing or connection.is_closed):
+            connection.close()
+
+    def _on_queue_declared(self, _frame):
+        self._channel.confirm_delivery(
+            ack_nack_callback=self._on_delivery_confirmation,
+            callback=self._on_confirm_selected,
+        )
+
+    def _on_confirm_selected(self, _frame):
+        self._delivery_tag = 0
+        self._ready = True
+        logger.info("RabbitMQ publisher connected")
+        self._drain()
+
+    def _drain(self):
+        """从队列中取出一批消息发送，剩余的消息留给下一轮 ioloop"""
+        self._wakeup_pending = False
+        if not self._ready or self._channel is None:
+            return
+
+        # 发布时间供消费者计算消息延迟
+        properties = pika.BasicProperties(
+            headers={"published_at_ms": int(time.time() * 1000)},
+            delivery_mode=pika.DeliveryMode.Persistent if self.durable else None,
+        )
+        published = 0
+        while published < self.batch_size and len(self._unconfirmed) < self.max_in_flight:
+            item = self._next_message()
+            if item is None:
+                break
+            body, routing_key, future = item
+            try:
+                self._channel.basic_publish(
+                    exchange=self.exchange, routing_key=routing_key, body=body,
+                    properties=properties,
+                )
+            except Exception as e:
+                logger.error(f"Failed to publish message: {e}")
+                self._retry.appendleft(item)
+                return
+            self._delivery_tag += 1
+            self._unconfirmed[self._delivery_tag] = item
+            published += 1
+
+        if self._stopping and not self._unconfirmed and not self.qsize():
+            self._close()
+        elif published == self.batch_size and not self._wakeup_pending:
+            # 让出 ioloop 处理 confirm，再继续发送下一批
+            self._wakeup_pending = True
+            self._connection.ioloop.call_later(0, self._drain)
+
+    def _next_message(self):
+        while True:
+            if self._retry:
+                return self._retry.popleft()
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return None
+            # 调用方已超时取消的消息不再发送
+            if item[2].set_running_or_notify_cancel():
+                return item
+
+    def _on_delivery_confirmation(self, frame):
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        tag = method.delivery_tag
+        if method.multiple:
+            tags = []
+            for t in self._unconfirmed:
+                if t > tag:
+                    break
+                tags.append(t)
+        else:
+            tags = [tag]
+        for t in tags:
+            item = self._unconfirmed.pop(t, None)
+            if item is None:
+                continue
+            if acked:
+                item[2].set_result(True)
+            else:
+                item[2].set_exception(PublishError("message was nacked by broker"))
+        self._drain()
+
+    def _requeue_unconfirmed(self):
+        if self._unconfirmed:
+            logger.warning(f"Re-sending {len(self._unconfirmed)} unconfirmed messages")
+            self._retry.extendleft(reversed(list(self._unconfirmed.values())))
+            self._unconfirmed.clear()
+
+    def _fail_outstanding(self, error: Exception):
+        while True:
+            item = self._next_message()
+            if item is None:
+                break
+            item[2].set_exception(error)
+
+    def _shutdown(self):
+        if not self._ready:
+            self._close()
+            return
+        self._drain()
+        # 超时后不再等待未确认的消息
+        self._connection.ioloop.call_later(3, self._close)
+
+    def _close(self):
+        connection = self._connection
+        if connection is not None and not (connection.is_closing or connection.is_closed):
+            connection.close()
+        elif connection is not None:
+            connection.ioloop.stop()
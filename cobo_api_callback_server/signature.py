@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+
+
+class SignatureVerifier:
+    """
+    Cobo 回调签名验证器。
+
+    每个环境的 VerifyKey 只在初始化时构建一次；签名消息为
+    sha256(sha256(raw_body | "|" | biz_timestamp))，直接对原始请求体字节做
+    增量哈希，不再解码再编码。并发验签请求较多时，把 Ed25519 验证放到
+    线程池执行，避免阻塞事件循环上的其他连接。
+    """
+
+    def __init__(
+        self,
+        pub_keys: Dict[str, str],
+        env: str = "DEV",
+        offload_threshold: int = 4,
+        max_workers: int = 4,
+    ):
+        self._verify_keys = {
+            name: VerifyKey(key=bytes.fromhex(key)) for name, key in pub_keys.items()
+        }
+        if env not in self._verify_keys:
+            raise ValueError(f"Unknown Cobo environment: {env}")
+        self.env = env
+        self.offload_threshold = offload_threshold
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="signature-verify"
+        )
+        # 正在读取请求体或验签的请求数，只在事件循环线程中修改
+        self._in_flight = 0
+
+    def verify(
+        self,
+        raw_body: bytes,
+        timestamp: Optional[str],
+        signature: Optional[str],
+        env: Optional[str] = None,
+    ) -> bool:
+        if not signature or timestamp is None:
+            return False
+        try:
+            sig = bytes.fromhex(signature)
+        except ValueError:
+            return False
+
+        inner = hashlib.sha256(raw_body)
+        inner.update(b"|")
+        inner.update(timestamp.encode())
+        digest = hashlib.sha256(inner.digest()).digest()
+
+        try:
+            self._verify_keys[env or self.env].verify(smessage=digest, signature=sig)
+            return True
+        except (BadSignatureError, ValueError):
+            return False
+
+    async def verify_request(
+        self,
+        request,
+        timestamp: Optional[str],
+        signature: Optional[str],
+        env: Optional[str] = None,
+    ) -> Tuple[bytes, bool]:
+        """读取请求体并验签，返回 (raw_body, 是否通过)
+
+        并发请求数低于阈值时直接在事件循环中验签，否则交给线程池。
+        """
+        self._in_flight += 1
+        try:
+            raw_body = await request.body()
+            if self._in_flight <= self.offload_threshold:
+                return raw_body, self.verify(raw_body, timestamp, signature, env)
+            valid = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.verify, raw_body, timestamp, signature, env
+            )
+            return raw_body, valid
+        finally:
+            self._in_flight -= 1
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 服务的模块位于上一级目录，以顶层模块导入（与 python3 app.py 启动时一致）
+API_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if API_SERVER_DIR not in sys.path:
+    sys.path.insert(0, API_SERVER_DIR)
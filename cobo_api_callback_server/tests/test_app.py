@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import Future
+
+import httpx
+import pytest
+from nacl.signing import SigningKey
+
+from conftest import API_SERVER_DIR
+from dedup import DedupCache
+from dispatch import EventDispatcher
+from publisher import PublishError
+from signature import SignatureVerifier
+
+SIGNING_KEY = SigningKey(bytes(range(1, 33)))
+
+
+class FakePublisher:
+    def __init__(self):
+        self.bodies = []
+        self.fail = False
+
+    def publish(self, body, routing_key=None):
+        future = Future()
+        if self.fail:
+            future.set_exception(PublishError("broker is down"))
+        else:
+            self.bodies.append(body)
+            future.set_result(True)
+        return future
+
+
+@pytest.fixture
+def server():
+    spec = importlib.util.spec_from_file_location("api_callback_app", os.path.join(API_SERVER_DIR, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.publisher = FakePublisher()
+    module.verifier = SignatureVerifier({"TEST": SIGNING_KEY.verify_key.encode().hex()}, env="TEST")
+    module.dedup_cache = DedupCache()
+    yield module
+    module.verifier.close()
+
+
+def post(module, path, payload, timestamp=None):
+    body = json.dumps(payload).encode()
+    timestamp = timestamp or str(int(time.time() * 1000))
+    digest = hashlib.sha256(hashlib.sha256(body + b"|" + timestamp.encode()).digest()).digest()
+    headers = {"Biz-Timestamp": timestamp, "Biz-Resp-Signature": SIGNING_KEY.sign(digest).signature.hex()}
+
+    async def send():
+        transport = httpx.ASGITransport(app=module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, content=body, headers=headers)
+
+    return asyncio.run(send())
+
+
+TRANSACTION = {
+    "transaction_id": "f47ac10b-58cc-4372-a567-0e02b2c3d479",
+    "wallet_id": "f47ac10b-58cc-4372-a567-0e02b2c3d480",
+    "chain_id": "ETH",
+    "token_id": "ETH",
+    "status": "PendingApproval",
+    "source": {"source_type": "Org-Controlled", "wallet_id": "f47ac10b-58cc-4372-a567-0e02b2c3d480"},
+    "destination": {"destination_type": "Address", "account_output": {"address": "0xabc", "amount": "1.5"}},
+    "initiator_type": "API",
+    "created_timestamp": 1729000000000,
+    "updated_timestamp": 1729000000000,
+}
+
+
+def test_failed_publish_is_not_cached(server):
+    server.publisher.fail = True
+    timestamp = str(int(time.time() * 1000))
+    assert post(server, "/api/callback", TRANSACTION, timestamp).text == "deny"
+    server.publisher.fail = False
+    assert post(server, "/api/callback", TRANSACTION, timestamp).text == "ok"
+    assert len(server.publisher.bodies) == 1
+
+
+def test_callback_retry_is_published_once(server):
+    timestamp = str(int(time.time() * 1000))
+    assert post(server, "/api/callback", TRANSACTION, timestamp).text == "ok"
+    assert post(server, "/api/callback", TRANSACTION, timestamp).text == "ok"
+    assert len(server.publisher.bodies) == 1
+    # 同一交易的新 callback 需要重新发布，TSS Node callback 的缓存读取后即删除
+    assert post(server, "/api/callback", TRANSACTION, str(int(timestamp) + 1)).text == "ok"
+    assert len(server.publisher.bodies) == 2
+    assert json.loads(server.publisher.bodies[0])["destination_address"] == "0xabc"
+
+
+def test_stale_timestamp_is_rejected(server):
+    assert post(server, "/api/callback", TRANSACTION, "1000").status_code == 401
+    assert not server.publisher.bodies
+
+
+def test_webhook_queue_full_returns_503(server):
+    server.dispatcher = EventDispatcher(max_queue_size=1, workers=0)
+    asyncio.run(server.dispatcher.start())
+    event = {
+        "event_id": "evt-1",
+        "url": "https://example.com/api/webhook",
+        "created_timestamp": 1729000000000,
+        "type": "wallets.transaction.created",
+        "data": {"data_type": "Transaction", **TRANSACTION},
+    }
+    assert post(server, "/api/webhook", event).status_code == 200
+    assert post(server, "/api/webhook", event).status_code == 200
+    assert post(server, "/api/webhook", {**event, "event_id": "evt-2"}).status_code == 503
+    stats = server.dispatcher.stats
+    assert (stats["dispatched"], stats["dropped"]) == (1, 1)
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from dedup import DedupCache, StaleTimestamp, check_timestamp
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_result_is_reused_until_ttl():
+    clock = Clock()
+    cache = DedupCache(ttl=10, clock=clock)
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return "ok"
+
+    async def main():
+        assert await cache.once("tx-1", work) == "ok"
+        assert await cache.once("tx-1", work) == "ok"
+        clock.now = 11
+        assert await cache.once("tx-1", work) == "ok"
+
+    asyncio.run(main())
+    assert len(calls) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_failed_publish_is_not_cached():
+    cache = DedupCache()
+    answers = iter(["deny", "ok", "unused"])
+
+    async def work():
+        return next(answers)
+
+    async def main():
+        cacheable = lambda answer: answer == "ok"  # noqa: E731
+        assert await cache.once("tx-1", work, cacheable) == "deny"
+        assert await cache.once("tx-1", work, cacheable) == "ok"
+        assert await cache.once("tx-1", work, cacheable) == "ok"
+
+    asyncio.run(main())
+    assert len(cache) == 1
+
+
+def test_exception_is_not_cached():
+    cache = DedupCache()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("broker is down")
+        return "ok"
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await cache.once("tx-1", work)
+        assert await cache.once("tx-1", work) == "ok"
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_concurrent_duplicate_awaits_first_result():
+    cache = DedupCache()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return "ok"
+
+        first = asyncio.create_task(cache.once("tx-1", work))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.once("tx-1", work))
+        await asyncio.sleep(0)
+        assert not second.done()
+        release.set()
+        return await first, await second
+
+    assert asyncio.run(main()) == ("ok", "ok")
+    assert len(calls) == 1
+
+
+def test_concurrent_duplicate_sees_first_failure():
+    cache = DedupCache()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            raise RuntimeError("broker is down")
+
+        first = asyncio.create_task(cache.once("tx-1", work))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.once("tx-1", work))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(cache) == 0
+
+
+def test_oldest_entry_is_evicted():
+    cache = DedupCache(max_size=2)
+
+    async def work():
+        return "ok"
+
+    async def main():
+        for key in ("a", "b", "c", "c", "a"):
+            await cache.once(key, work)
+
+    asyncio.run(main())
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_check_timestamp():
+    check_timestamp("1000000", max_skew=5, now=1002)
+    check_timestamp(None, max_skew=0)
+    with pytest.raises(StaleTimestamp, match="outside"):
+        check_timestamp("1000000", max_skew=5, now=1006)
+    with pytest.raises(StaleTimestamp, match="Invalid"):
+        check_timestamp("soon", max_skew=5)
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from dispatch import ALL_EVENTS, DispatchQueueFull, EventDispatcher
+
+
+def event(event_type="wallets.transaction.succeeded", event_id="evt-1"):
+    return SimpleNamespace(type=SimpleNamespace(value=event_type), event_id=event_id)
+
+
+def test_dispatch_runs_matching_handlers():
+    dispatcher = EventDispatcher(workers=2)
+    seen = []
+
+    @dispatcher.register("wallets.transaction.succeeded")
+    async def on_succeeded(e):
+        seen.append(("succeeded", e.event_id))
+
+    dispatcher.register(ALL_EVENTS, lambda e: seen.append(("all", e.event_id)))
+
+    async def main():
+        await dispatcher.start()
+        dispatcher.dispatch(event())
+        dispatcher.dispatch(event("wallets.transaction.failed", "evt-2"))
+        await dispatcher.stop()
+
+    asyncio.run(main())
+    assert sorted(seen) == [("all", "evt-1"), ("all", "evt-2"), ("succeeded", "evt-1")]
+    assert dispatcher.stats["handled"] == 3
+
+
+def test_queue_full_raises():
+    dispatcher = EventDispatcher(max_queue_size=1, workers=0)
+
+    async def main():
+        await dispatcher.start()
+        dispatcher.dispatch(event())
+        with pytest.raises(DispatchQueueFull):
+            dispatcher.dispatch(event(event_id="evt-2"))
+        await dispatcher.stop(timeout=0)
+
+    asyncio.run(main())
+    assert (dispatcher.stats["dispatched"], dispatcher.stats["dropped"]) == (1, 1)
+
+
+def test_dispatch_before_start_raises():
+    with pytest.raises(RuntimeError, match="not started"):
+        EventDispatcher().dispatch(event())
+
+
+def test_timed_out_and_failed_handlers_are_counted():
+    dispatcher = EventDispatcher(workers=1)
+    after = []
+
+    @dispatcher.register(ALL_EVENTS, timeout=0.05)
+    async def slow(e):
+        await asyncio.sleep(1)
+
+    @dispatcher.register(ALL_EVENTS, timeout=0.05)
+    def slow_sync(e):
+        time.sleep(0.2)
+
+    @dispatcher.register(ALL_EVENTS)
+    async def broken(e):
+        raise ValueError("bad event")
+
+    @dispatcher.register(ALL_EVENTS)
+    async def healthy(e):
+        after.append(e.event_id)
+
+    async def main():
+        await dispatcher.start()
+        dispatcher.dispatch(event())
+        await dispatcher.stop()
+
+    asyncio.run(main())
+    assert dispatcher.stats["timeouts"] == 2
+    assert dispatcher.stats["failed"] == 1
+    assert dispatcher.stats["handled"] == 1
+    # 其他处理函数超时或失败不影响同一事件的其他处理函数
+    assert after == ["evt-1"]
+
+
+def test_concurrency_limit_per_handler():
+    dispatcher = EventDispatcher(workers=4)
+    running = []
+    peak = []
+
+    @dispatcher.register(ALL_EVENTS, concurrency=2)
+    async def limited(e):
+        running.append(e)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(e)
+
+    async def main():
+        await dispatcher.start()
+        for i in range(8):
+            dispatcher.dispatch(event(event_id=f"evt-{i}"))
+        await dispatcher.stop()
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert dispatcher.stats["handled"] == 8
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from publisher import PublishError, PublisherQueueFull, RabbitMQPublisher
+
+
+def confirm(method_class, tag, multiple=False):
+    return SimpleNamespace(method=method_class(delivery_tag=tag, multiple=multiple))
+
+
+def unconfirmed(publisher, count):
+    """放入 count 条消息并模拟已发送、等待 broker 确认"""
+    futures = [publisher.publish(f"m{i}".encode()) for i in range(count)]
+    for tag in range(1, count + 1):
+        publisher._unconfirmed[tag] = publisher._next_message()
+    return futures
+
+
+def test_publish_fails_when_queue_is_full():
+    publisher = RabbitMQPublisher(max_queue_size=1)
+    assert not publisher.publish(b"first").done()
+    with pytest.raises(PublisherQueueFull):
+        publisher.publish(b"second").result(timeout=0)
+    assert publisher.qsize() == 1
+
+
+def test_publish_fails_after_stop():
+    publisher = RabbitMQPublisher()
+    publisher.stop()
+    with pytest.raises(PublishError, match="stopped"):
+        publisher.publish(b"late").result(timeout=0)
+
+
+def test_confirms_complete_futures():
+    publisher = RabbitMQPublisher()
+    futures = unconfirmed(publisher, 4)
+
+    publisher._on_delivery_confirmation(confirm(pika.spec.Basic.Ack, 2, multiple=True))
+    assert [f.done() for f in futures] == [True, True, False, False]
+    publisher._on_delivery_confirmation(confirm(pika.spec.Basic.Nack, 4))
+    with pytest.raises(PublishError, match="nacked"):
+        futures[3].result(timeout=0)
+    assert not futures[2].done()
+    assert futures[0].result(timeout=0) is True
+
+
+def test_unconfirmed_messages_are_resent_first_after_reconnect():
+    publisher = RabbitMQPublisher()
+    unconfirmed(publisher, 2)
+    publisher.publish(b"queued")
+
+    publisher._requeue_unconfirmed()
+    bodies = [publisher._next_message()[0] for _ in range(3)]
+    assert bodies == [b"m0", b"m1", b"queued"]
+
+
+def test_cancelled_messages_are_not_sent():
+    publisher = RabbitMQPublisher()
+    cancelled = publisher.publish(b"timed out")
+    cancelled.cancel()
+    publisher.publish(b"live")
+    assert publisher._next_message()[0] == b"live"
+    assert publisher._next_message() is None
+
+
+def test_outstanding_messages_fail_on_stop():
+    publisher = RabbitMQPublisher()
+    future = publisher.publish(b"pending")
+    publisher._fail_outstanding(PublishError("publisher is stopped"))
+    with pytest.raises(PublishError):
+        future.result(timeout=0)
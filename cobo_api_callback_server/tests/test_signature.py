@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+
+import pytest
+from nacl.signing import SigningKey
+
+from signature import SignatureVerifier
+
+SIGNING_KEY = SigningKey(bytes(range(32)))
+PUBLIC_KEY = SIGNING_KEY.verify_key.encode().hex()
+BODY = b'{"transaction_id": "tx-1"}'
+TIMESTAMP = "1729000000000"
+
+
+def sign(body: bytes, timestamp: str) -> str:
+    digest = hashlib.sha256(hashlib.sha256(body + b"|" + timestamp.encode()).digest()).digest()
+    return SIGNING_KEY.sign(digest).signature.hex()
+
+
+class FakeRequest:
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def body(self):
+        await asyncio.sleep(0)
+        return self._body
+
+
+@pytest.fixture
+def verifier():
+    verifier = SignatureVerifier({"TEST": PUBLIC_KEY}, env="TEST", offload_threshold=1)
+    yield verifier
+    verifier.close()
+
+
+def test_verify(verifier):
+    signature = sign(BODY, TIMESTAMP)
+    assert verifier.verify(BODY, TIMESTAMP, signature)
+    assert not verifier.verify(BODY + b" ", TIMESTAMP, signature)
+    assert not verifier.verify(BODY, "1729000000001", signature)
+    assert not verifier.verify(BODY, TIMESTAMP, "not hex")
+    assert not verifier.verify(BODY, TIMESTAMP, signature[:-2])
+    assert not verifier.verify(BODY, None, signature)
+    assert not verifier.verify(BODY, TIMESTAMP, None)
+
+
+def test_unknown_environment():
+    with pytest.raises(ValueError, match="Unknown Cobo environment"):
+        SignatureVerifier({"TEST": PUBLIC_KEY}, env="PROD")
+
+
+def test_verify_request_inline_and_offloaded(verifier):
+    # 并发数超过阈值的请求在线程池中验签，结果与直接验签一致
+    bodies = [BODY + str(i).encode() for i in range(8)]
+
+    async def main():
+        requests = [
+            verifier.verify_request(FakeRequest(body), TIMESTAMP, sign(body, TIMESTAMP) if i % 2 else "00" * 64)
+            for i, body in enumerate(bodies)
+        ]
+        return await asyncio.gather(*requests)
+
+    results = asyncio.run(main())
+    assert [raw for raw, _ in results] == bodies
+    assert [valid for _, valid in results] == [bool(i % 2) for i in range(8)]
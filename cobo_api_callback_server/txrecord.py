@@ -0,0 +1,106 @@
+"""
+Compact binary transaction record sent from the API callback server to the TSS callback server.
+
+The two copies (cobo-tssnode-callback/app/txrecord.py and
+cobo_api_callback_server/txrecord.py) must stay identical.
+
+Layout (little endian)::
+
+    u8 magic 0xC7 | u8 version | u32 field bitmap | fields
+
+Bit ``i`` of the bitmap is set when ``FIELDS[i]`` is present; present fields
+follow in ``FIELDS`` order, strings as u16 length + UTF-8, long strings
+(calldata, instructions) as u32 length + UTF-8 and integers as i64. Fields are only ever
+appended, so a decoder ignores bitmap bits and bytes it does not know;
+``VERSION`` changes only for incompatible layouts.
+JSON messages start with ``{`` and are told apart by the first byte.
+"""
+import struct
+
+MAGIC = 0xC7
+VERSION = 1
+HEADER = struct.Struct("<BBI")
+STR_LENGTH = struct.Struct("<H")
+TEXT_LENGTH = struct.Struct("<I")
+INT = struct.Struct("<q")
+
+STR, TEXT, I64 = "str", "text", "i64"
+
+FIELDS = (
+    ("transaction_id", STR),
+    ("wallet_id", STR),
+    ("chain_id", STR),
+    ("created_timestamp", I64),
+    ("token_id", STR),
+    ("destination_type", STR),
+    ("destination_address", STR),
+    ("amount", STR),
+    ("request_id", STR),
+    ("fee_type", STR),
+    ("fee_token_id", STR),
+    ("gas_price", STR),
+    ("gas_limit", STR),
+    ("max_fee_per_gas", STR),
+    ("max_priority_fee_per_gas", STR),
+    ("max_fee_amount", STR),
+    ("calldata", TEXT),
+    ("instructions", TEXT),
+)
+
+
+def is_record(body: bytes) -> bool:
+    return bool(body) and body[0] == MAGIC
+
+
+def encode(record: dict) -> bytes:
+    """Encode the known fields of ``record``; None values and unknown keys are left out"""
+    bitmap = 0
+    parts = []
+    for i, (name, kind) in enumerate(FIELDS):
+        value = record.get(name)
+        if value is None:
+            continue
+        bitmap |= 1 << i
+        if kind == I64:
+            parts.append(INT.pack(int(value)))
+        else:
+            data = str(value).encode()
+            length = STR_LENGTH if kind == STR else TEXT_LENGTH
+            if len(data) >= 1 << length.size * 8:
+                raise ValueError(f"{name} is too long")
+            parts.append(length.pack(len(data)))
+            parts.append(data)
+    return HEADER.pack(MAGIC, VERSION, bitmap) + b"".join(parts)
+
+
+def decode(body: bytes) -> dict:
+    """Decode a record into a dict with the same keys as the JSON message; raises ValueError"""
+    if len(body) < HEADER.size:
+        raise ValueError("record is truncated")
+    magic, version, bitmap = HEADER.unpack_from(body, 0)
+    if magic != MAGIC:
+        raise ValueError("not a transaction record")
+    if version != VERSION:
+        raise ValueError(f"unsupported record version {version}")
+    record = {}
+    position = HEADER.size
+    try:
+        for i, (name, kind) in enumerate(FIELDS):
+            if not bitmap >> i & 1:
+                continue
+            if kind == I64:
+                (record[name],) = INT.unpack_from(body, position)
+                position += INT.size
+            else:
+                prefix = STR_LENGTH if kind == STR else TEXT_LENGTH
+                (length,) = prefix.unpack_from(body, position)
+                position += prefix.size
+                end = position + length
+                if end > len(body):
+                    raise ValueError(f"{name} is truncated")
+                record[name] = body[position:end].decode()
+                position = end
+    except struct.error:
+        raise ValueError("record is truncated")
+    return record
+